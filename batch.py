@@ -0,0 +1,230 @@
+"""
+Headless batch processing of saved queries: segregation plus WFS/WMS URL generation for
+every query in a JSONL or CSV file, without the Streamlit UI.
+
+Usage:
+    python batch.py queries.jsonl results.jsonl [--concurrency 16] [--save-features DIR]
+                    [--features-format geojson|parquet|csv|csv.gz]
+
+Input rows need a 'query' (JSONL objects or CSV columns; a bare JSON string also works)
+and may carry an 'id'; rows without one are numbered by position. Each result is appended
+to the output JSONL as soon as it is ready, so the output doubles as the checkpoint:
+re-running the same command skips every id already in it. Failed rows are recorded with
+an 'error' and retried only with --retry-failed.
+
+Saved features are GeoJSON by default; GeoParquet and (gzipped) CSV are written in
+bounded chunks by export.py, which keeps memory flat on large date ranges.
+
+Features saved for aggregate queries ("roads that averaged ...") hold one feature per
+matching road, taken from the rollups in rollups.py.
+
+LLM calls go through the shared client's rate limiter (llm.rate_limiter), which follows
+the OpenAI x-ratelimit-* headers; GEOINT_LLM_REQUESTS_PER_MINUTE and
+GEOINT_LLM_TOKENS_PER_MINUTE add client-side caps.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import segregation
+from filter_spec import get_filter_spec
+from wfs import build_wfs_url
+from wms import build_wms_url
+import llm
+import rollups
+import wfs_client
+import export
+
+DATASETS = ('traffic', 'footfall')
+
+FEATURE_FORMATS = ('geojson',) + tuple(export.FORMATS)
+
+# How many results are written between fsyncs of the output file
+SYNC_EVERY = 50
+
+def read_queries(path):
+    """Yield (id, query) pairs from a JSONL or CSV file"""
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.lower().endswith('.csv'):
+            for position, row in enumerate(csv.DictReader(f), 1):
+                query = row.get('query') or next(iter(row.values()), None)
+                yield str(row.get('id') or position), query
+            return
+        for position, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if isinstance(row, str):
+                yield str(position), row
+            else:
+                yield str(row.get('id') or position), row.get('query')
+
+def read_checkpoint(path):
+    """Return {id: record} of the results already written; a torn last line is ignored"""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            done[record['id']] = record
+    return done
+
+def save_features(url, path):
+    """Stream the features a WFS URL selects into a GeoJSON, GeoParquet or CSV file; returns the feature count"""
+    return write_features(wfs_client.iter_layer_features(url), path)
+
+def write_features(features, path):
+    """Write features to a file as they arrive, in the format its extension names; returns the feature count"""
+    if not path.lower().endswith('.geojson'):
+        return export.write_features(features, path)
+    count = 0
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write('{"type":"FeatureCollection","features":[')
+        for feature in features:
+            f.write((',' if count else '') + json.dumps(feature))
+            count += 1
+        f.write(']}')
+    os.replace(tmp_path, path)
+    return count
+
+def process_query(query_id, query, features_dir=None, features_format='geojson'):
+    """
+    Segregate one query and generate its URLs
+    Returns:
+        Result record with the component queries and, per dataset, 'wfs'/'wms' URLs (plus
+        'features_path'/'feature_count' when saving features) or an 'error'
+    """
+    record = {'id': query_id, 'query': query}
+    if not query or not query.strip():
+        record['error'] = "Empty query"
+        return record
+    try:
+        segregated = segregation.segregate_query(query)
+    except Exception as e:
+        record['error'] = f"Segregation failed: {e}"
+        return record
+
+    for dataset in DATASETS:
+        dataset_query = segregated.get(f"{dataset}_query")
+        record[f"{dataset}_query"] = dataset_query
+        if not dataset_query:
+            continue
+        try:
+            spec = get_filter_spec(dataset, dataset_query)
+            aggregated = rollups.query_spec(dataset, spec) if spec.get('aggregate') and features_dir else None
+            if spec.get('aggregate') and features_dir and aggregated is None:
+                # Nothing to average without the local feature store; save the matching daily rows
+                spec = dict(spec, aggregate=False)
+            result = {'wfs': build_wfs_url(dataset, spec), 'wms': build_wms_url(dataset, spec)}
+            if features_dir:
+                path = os.path.join(features_dir, f"{query_id}_{dataset}.{features_format}")
+                if aggregated is not None:
+                    result['feature_count'] = write_features(aggregated['features'], path)
+                else:
+                    result['feature_count'] = save_features(result['wfs'], path)
+                result['features_path'] = path
+        except Exception as e:
+            result = {'error': str(e)}
+        record[dataset] = result
+
+    if not any(record.get(f"{dataset}_query") for dataset in DATASETS):
+        record['error'] = "No traffic or footfall component found"
+    elif any('error' in record.get(dataset, {}) for dataset in DATASETS):
+        record['error'] = "; ".join(f"{dataset}: {record[dataset]['error']}" for dataset in DATASETS if 'error' in record.get(dataset, {}))
+    return record
+
+def run(input_path, output_path, concurrency=8, features_dir=None, retry_failed=False, log=print,
+        features_format='geojson'):
+    """
+    Process every query in `input_path` not yet in `output_path`, appending results to it
+    Returns:
+        Dict of counts: 'processed', 'failed', 'skipped' and 'seconds'
+    """
+    done = read_checkpoint(output_path)
+    skip = {query_id for query_id, record in done.items() if not (retry_failed and record.get('error'))}
+    if features_dir:
+        os.makedirs(features_dir, exist_ok=True)
+
+    # Make sure appended records start on a fresh line after an interrupted write
+    if os.path.exists(output_path) and os.path.getsize(output_path):
+        with open(output_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b'\n'
+        if needs_newline:
+            with open(output_path, 'a', encoding='utf-8') as f:
+                f.write('\n')
+
+    summary = {'processed': 0, 'failed': 0, 'skipped': 0}
+    start = time.monotonic()
+    rows = iter(read_queries(input_path))
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    pending = set()
+    try:
+        with open(output_path, 'a', encoding='utf-8') as out:
+            while True:
+                # Keep a bounded window of work in flight so huge inputs aren't queued all at once
+                while len(pending) < concurrency * 2:
+                    row = next(rows, None)
+                    if row is None:
+                        break
+                    query_id, query = row
+                    if query_id in skip:
+                        summary['skipped'] += 1
+                        continue
+                    skip.add(query_id)
+                    pending.add(executor.submit(process_query, query_id, query, features_dir, features_format))
+                if not pending:
+                    break
+
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    record = future.result()
+                    out.write(json.dumps(record) + '\n')
+                    out.flush()
+                    summary['processed'] += 1
+                    summary['failed'] += bool(record.get('error'))
+                    if summary['processed'] % SYNC_EVERY == 0:
+                        os.fsync(out.fileno())
+                        elapsed = time.monotonic() - start
+                        log(f"{summary['processed']:,} processed ({summary['processed'] / elapsed:.1f}/s), "
+                            f"{summary['failed']:,} failed, rate limiter waited {llm.rate_limiter.waited:.1f}s")
+    finally:
+        # On Ctrl-C, drop queued work; results already written stay as the checkpoint
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    summary['seconds'] = round(time.monotonic() - start, 2)
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help="Queries as JSONL or CSV")
+    parser.add_argument('output', help="Results JSONL, appended to and used to resume")
+    parser.add_argument('--concurrency', type=int, default=8, help="Queries processed at once")
+    parser.add_argument('--save-features', metavar='DIR', help="Also save each dataset's filtered WFS features in --features-format")
+    parser.add_argument('--features-format', choices=FEATURE_FORMATS, default='geojson',
+                        help="File format of the features saved with --save-features")
+    parser.add_argument('--retry-failed', action='store_true', help="Reprocess rows whose earlier result was an error")
+    args = parser.parse_args()
+
+    if args.concurrency > llm.LLM_POOL_SIZE:
+        print(f"Note: concurrency {args.concurrency} exceeds GEOINT_LLM_POOL_SIZE={llm.LLM_POOL_SIZE}; "
+              f"LLM calls will queue for connections", file=sys.stderr)
+    try:
+        summary = run(args.input, args.output, args.concurrency, args.save_features, args.retry_failed,
+                      features_format=args.features_format)
+    except KeyboardInterrupt:
+        print(f"Interrupted; re-run the same command to resume from {args.output}", file=sys.stderr)
+        sys.exit(130)
+    print(f"Done: {summary['processed']:,} processed, {summary['failed']:,} failed, "
+          f"{summary['skipped']:,} already done, in {summary['seconds']}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+Mock GeoServer for offline benchmarks: serves synthetic, Rivonia-shaped versions of the
+traffic and footfall layers over WFS (GetFeature with CQL_FILTER, resultType=hits and
+startIndex/count paging; JSON DescribeFeatureType) and WMS (GetMap returning a blank PNG).
+
+The traffic layer is a network of random-walk roads around the mall with one row per
+road per day; the footfall layer is a grid of square cells. CQL_FILTER is evaluated with
+the same engine the app uses for its local feature store.
+
+Usage:
+    python -m benchmarks.mock_geoserver [--port 8781] [--roads 300] [--days 28] [--cells 40] [--latency 0.05]
+
+Point the app at it with GEOINT_WFS_BASE_URL=http://127.0.0.1:8781/geoserver/mtn/ows and
+GEOINT_WMS_BASE_URL=http://127.0.0.1:8781/geoserver/mtn/wms.
+"""
+import argparse
+import datetime
+import json
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import cql
+from feature_store import LayerData, _features_to_frame
+from filter_spec import DATASETS, DAYS, MALL_LATITUDE, MALL_LONGITUDE
+from benchmarks.mock_http import MockHTTPServer
+from benchmarks.payload import synthetic_roads
+
+INCOME_CLASSES = ('Low', 'Lower Middle', 'Middle', 'Upper Middle', 'High')
+
+def traffic_features(roads=300, days=28, vertices=60, seed=0):
+    """One feature per road per day, starting on a Monday, with the traffic layer's attributes"""
+    rng = np.random.default_rng(seed)
+    geometries = [feature['geometry'] for feature in synthetic_roads(roads, vertices, seed)['features']]
+    first_day = datetime.date(2024, 1, 1)
+    features = []
+    for day in range(days):
+        date = first_day + datetime.timedelta(days=day)
+        density = rng.gamma(2.0, 1.2, roads)
+        for road, geometry in enumerate(geometries):
+            hits = float(density[road] * 1000)
+            features.append({
+                'type': 'Feature',
+                'id': f"mtn_rivonia_geom_traffic.{day * roads + road}",
+                'geometry': geometry,
+                'properties': {
+                    'day': DAYS[date.weekday()],
+                    'avg_traffic_den': float(density[road]),
+                    'avg_hits': hits,
+                    'total_hits': hits * 24,
+                    'daily_ts': f"{date.isoformat()}T00:00:00Z",
+                },
+            })
+    return features
+
+def footfall_features(cells=40, cell_degrees=0.004, seed=1):
+    """A cells x cells grid of square polygons centred on the mall with the footfall attributes"""
+    rng = np.random.default_rng(seed)
+    origin_lon = MALL_LONGITUDE - cells * cell_degrees / 2
+    origin_lat = MALL_LATITUDE - cells * cell_degrees / 2
+    properties = [name for name in DATASETS['footfall']['properties'] if name != 'income_class']
+    features = []
+    for row in range(cells):
+        for column in range(cells):
+            lon, lat = origin_lon + column * cell_degrees, origin_lat + row * cell_degrees
+            ring = [[lon, lat], [lon + cell_degrees, lat], [lon + cell_degrees, lat + cell_degrees],
+                    [lon, lat + cell_degrees], [lon, lat]]
+            values = {name: float(value) for name, value in zip(properties, rng.gamma(1.5, 2.0, len(properties)))}
+            values['income_class'] = INCOME_CLASSES[int(rng.integers(len(INCOME_CLASSES)))]
+            features.append({
+                'type': 'Feature',
+                'id': f"mtn_rivonia_ff_dataset.{row * cells + column}",
+                'geometry': {'type': 'Polygon', 'coordinates': [ring]},
+                'properties': values,
+            })
+    return features
+
+def _blank_png(width=1, height=1):
+    """A fully transparent RGBA PNG"""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+    rows = b''.join(b'\x00' + b'\x00' * 4 * width for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows))
+            + chunk(b'IEND', b''))
+
+class MockGeoServer:
+    """Synthetic layers, pre-serialized per feature so responses cost little beyond the filter"""
+
+    def __init__(self, roads=300, days=28, cells=40, vertices=60, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        self.layers = {}
+        self._feature_json = {}
+        self._lock = threading.Lock()
+        for type_name, features in (
+            (DATASETS['traffic']['type_name'], traffic_features(roads, days, vertices)),
+            (DATASETS['footfall']['type_name'], footfall_features(cells)),
+        ):
+            attributes, geometry = _features_to_frame(features)
+            self.layers[type_name] = LayerData(type_name, attributes, geometry)
+            self._feature_json[type_name] = [json.dumps(feature) for feature in features]
+        self.png = _blank_png()
+
+    def get_feature(self, params):
+        """Return (status, content_type, body) for a WFS GetFeature request"""
+        type_name = params.get('typenames') or params.get('typename')
+        layer = self.layers.get(type_name)
+        if layer is None:
+            return 400, 'text/plain', f"Unknown layer {type_name}".encode('utf-8')
+        try:
+            matched = np.flatnonzero(cql.evaluate(layer, params.get('cql_filter')))
+        except cql.UnsupportedFilter as e:
+            return 400, 'text/plain', str(e).encode('utf-8')
+
+        if params.get('resulttype', '').lower() == 'hits':
+            body = (f'<?xml version="1.0" encoding="UTF-8"?><wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs/2.0" '
+                    f'numberMatched="{len(matched)}" numberReturned="0"/>')
+            return 200, 'text/xml', body.encode('utf-8')
+
+        start = int(params.get('startindex') or 0)
+        limit = params.get('count') or params.get('maxfeatures')
+        page = matched[start:start + int(limit)] if limit else matched[start:]
+        serialized = self._feature_json[type_name]
+        body = (f'{{"type":"FeatureCollection","numberMatched":{len(matched)},"numberReturned":{len(page)},"features":['
+                + ','.join(serialized[index] for index in page) + ']}')
+        return 200, 'application/json', body.encode('utf-8')
+
+    def describe_feature_type(self, params):
+        """Return (status, content_type, body) for a JSON DescribeFeatureType request"""
+        type_name = params.get('typenames') or params.get('typename')
+        layer = self.layers.get(type_name)
+        if layer is None:
+            return 400, 'text/plain', f"Unknown layer {type_name}".encode('utf-8')
+        properties = [{'name': 'geom', 'type': 'gml:Geometry', 'localType': 'Geometry'}]
+        for name, dtype in layer.attributes.dtypes.items():
+            if dtype.kind in 'iu':
+                xsd_type = 'xsd:int'
+            elif dtype.kind == 'f':
+                xsd_type = 'xsd:number'
+            elif dtype.kind == 'M' or name.endswith('_ts'):
+                xsd_type = 'xsd:date-time'
+            else:
+                xsd_type = 'xsd:string'
+            properties.append({'name': name, 'type': xsd_type, 'localType': xsd_type.split(':')[1]})
+        body = {
+            'elementFormDefault': 'qualified',
+            'targetNamespace': 'http://mtn',
+            'targetPrefix': type_name.split(':')[0],
+            'featureTypes': [{'typeName': type_name.split(':')[-1], 'properties': properties}],
+        }
+        return 200, 'application/json', json.dumps(body).encode('utf-8')
+
+    def handle(self, query_string):
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        params = {key.lower(): values[-1] for key, values in parse_qs(query_string, keep_blank_values=True).items()}
+        request = params.get('request', '').lower()
+        if request == 'getfeature':
+            return self.get_feature(params)
+        if request == 'describefeaturetype':
+            return self.describe_feature_type(params)
+        if request == 'getmap':
+            return 200, 'image/png', self.png
+        return 400, 'text/plain', f"Unsupported request {params.get('request')}".encode('utf-8')
+
+def _make_handler(mock):
+    class GeoServerHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            if not parsed.path.startswith('/geoserver/'):
+                self.send_error(404)
+                return
+            status, content_type, body = mock.handle(parsed.query)
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return GeoServerHandler
+
+def serve(mock=None, host='127.0.0.1', port=0):
+    """Create (but don't start) the mock server; port 0 picks a free port"""
+    return MockHTTPServer((host, port), _make_handler(mock or MockGeoServer()))
+
+def start(mock=None, host='127.0.0.1', port=0):
+    """Start the mock server in a background thread and return (server, wfs_url, wms_url)"""
+    server = serve(mock, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://{host}:{server.server_address[1]}/geoserver/mtn"
+    return server, f"{base}/ows", f"{base}/wms"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8781)
+    parser.add_argument('--roads', type=int, default=300)
+    parser.add_argument('--days', type=int, default=28)
+    parser.add_argument('--cells', type=int, default=40, help="Footfall grid is cells x cells")
+    parser.add_argument('--vertices', type=int, default=60)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every request")
+    args = parser.parse_args()
+
+    mock = MockGeoServer(args.roads, args.days, args.cells, args.vertices, args.latency)
+    for type_name, layer in mock.layers.items():
+        print(f"{type_name}: {len(layer):,} features")
+    print(f"Mock GeoServer on http://{args.host}:{args.port}/geoserver/mtn/ows and /wms")
+    serve(mock, args.host, args.port).serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+"""
+HTTP server shared by the mock services. Clients that time out or stop reading a stream
+hang up mid-response; the default server prints a traceback for each, which buries real
+errors in the benchmark output.
+"""
+import sys
+from http.server import ThreadingHTTPServer
+
+class MockHTTPServer(ThreadingHTTPServer):
+    """Threaded server with daemon request threads that ignores clients disconnecting early"""
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError, ConnectionAbortedError)):
+            return
+        super().handle_error(request, client_address)
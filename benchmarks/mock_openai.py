@@ -0,0 +1,282 @@
+"""
+Mock OpenAI-compatible chat completions server for offline benchmarks.
+
+Answers POST /v1/chat/completions (plain and streamed) after a configurable delay. The
+segregation prompt is answered with the rule-based classifier's split and the filter spec
+prompt with a spec derived from the query's numbers, radius, days and time-of-day words,
+so every response is valid for the app. Exact answers can be pinned with a canned
+responses file: a JSON object mapping a query to the message content to return.
+
+With --requests-per-minute the server also enforces a fixed one-minute request window,
+sending OpenAI's x-ratelimit-* headers and answering 429 once the window is used up.
+
+Faults can be injected to exercise the client's deadlines, hedging, retries and circuit
+breaker: --error-rate answers that fraction of requests with a 500 and --slow-rate
+delays that fraction by an extra --slow-latency seconds.
+
+Usage:
+    python -m benchmarks.mock_openai [--port 8780] [--latency 0.5] [--jitter 0.2] [--responses FILE]
+
+Point the app at it with GEOINT_LLM_BASE_URL=http://127.0.0.1:8780/v1 (and any OPENAI_API_KEY).
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from filter_spec import DATASETS, DAYS
+from segregation import classify_query
+from benchmarks.mock_http import MockHTTPServer
+
+FILTER_LAYER = re.compile(r"GeoServer layer (\S+?)\.?\s")
+RADIUS = re.compile(r"(\d+(?:\.\d+)?)\s*(?:km|kilomet)", re.I)
+THRESHOLD = re.compile(r"(>=|<=|>|<|=)\s*(\d+(?:\.\d+)?)")
+PERIODS = ('morning', 'midday', 'afternoon', 'evening', 'weekend', 'week')
+
+# Characters per streamed chunk, roughly one token
+STREAM_CHUNK_CHARS = 4
+
+def _number(text):
+    return float(text) if '.' in text else int(text)
+
+def filter_spec_for(dataset, query):
+    """A plausible filter spec for a query, built the way the real model is asked to"""
+    lowered = query.lower()
+    op, value = '>', 0
+    match = THRESHOLD.search(query)
+    if match:
+        op, value = match.group(1), _number(match.group(2))
+
+    if dataset == 'traffic':
+        predicates = [{'attribute': 'avg_traffic_den', 'op': op, 'value': value}]
+        days = [day for day in DAYS if day.lower() in lowered] or None
+        if 'weekend' in lowered:
+            days = ['Saturday', 'Sunday']
+    else:
+        prefix = 'ffc' if 'competitor' in lowered else 'ff'
+        period = next((period for period in PERIODS if period in lowered), None)
+        attribute = f"{prefix}_{period}_rivil" if period else f"{prefix}_rivil"
+        predicates = [{'attribute': attribute, 'op': op, 'value': value}]
+        days = None
+
+    radius = RADIUS.search(query)
+    return {
+        'predicates': predicates,
+        'combine': 'AND',
+        'days': days,
+        'time_range': None,
+        'aggregate': bool(DATASETS[dataset].get('rollups')) and 'averag' in lowered,
+        'radius_km': _number(radius.group(1)) if radius else None,
+    }
+
+def answer(messages, canned=None):
+    """Message content the mock returns for a chat request"""
+    # The app sends its instructions as the system message and the bare query as the user message
+    query = (messages[-1]['content'] if messages else '').strip()
+    layer = FILTER_LAYER.search(messages[0]['content'] if len(messages) > 1 else '')
+    if canned and query in canned:
+        return canned[query] if isinstance(canned[query], str) else json.dumps(canned[query])
+
+    if layer:
+        dataset = next((name for name, config in DATASETS.items() if config['type_name'] == layer.group(1)), 'traffic')
+        return json.dumps(filter_spec_for(dataset, query))
+    result, _ = classify_query(query)
+    return json.dumps(result)
+
+def _tokens(text):
+    return max(1, len(text) // 4)
+
+class MockOpenAI:
+    """Request handling state: latency model, canned answers and counters"""
+
+    def __init__(self, latency=0.5, jitter=0.0, chunk_delay=0.0, canned=None, seed=0, requests_per_minute=None,
+                 error_rate=0.0, slow_rate=0.0, slow_latency=5.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.chunk_delay = chunk_delay
+        self.canned = canned or {}
+        self.requests_per_minute = requests_per_minute
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.requests = 0
+        self.rejected = 0
+        self.errors = 0
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def admit(self):
+        """Count a request against the rate window; returns (allowed, rate-limit headers)"""
+        if not self.requests_per_minute:
+            return True, {}
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= 60:
+                self._window_start, self._window_count = now, 0
+            allowed = self._window_count < self.requests_per_minute
+            if allowed:
+                self._window_count += 1
+            else:
+                self.rejected += 1
+            reset = 60 - (now - self._window_start)
+            headers = {
+                'x-ratelimit-limit-requests': str(self.requests_per_minute),
+                'x-ratelimit-remaining-requests': str(self.requests_per_minute - self._window_count),
+                'x-ratelimit-reset-requests': f"{reset:.3f}s",
+            }
+            if not allowed:
+                headers['retry-after'] = f"{reset:.3f}"
+        return allowed, headers
+
+    def delay(self):
+        """Time to first byte for one request: latency plus uniform jitter (and any injected slowness), never negative"""
+        with self._lock:
+            self.requests += 1
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            if self._random.random() < self.slow_rate:
+                delay += self.slow_latency
+            return delay
+
+    def fail(self):
+        """Whether to answer this request with an injected server error"""
+        with self._lock:
+            failed = self._random.random() < self.error_rate
+            self.errors += failed
+            return failed
+
+    def completion(self, body):
+        messages = body.get('messages') or []
+        content = answer(messages, self.canned)
+        prompt_tokens = sum(_tokens(message.get('content') or '') for message in messages)
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': _tokens(content),
+            'total_tokens': prompt_tokens + _tokens(content),
+        }
+        return content, usage
+
+def _make_handler(mock):
+    class CompletionsHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            if not self.path.rstrip('/').endswith('/chat/completions'):
+                self.send_error(404)
+                return
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            allowed, rate_headers = mock.admit()
+            if not allowed:
+                payload = json.dumps({'error': {'message': 'Rate limit reached', 'type': 'requests', 'code': 'rate_limit_exceeded'}}).encode('utf-8')
+                self.send_response(429)
+                for name, value in rate_headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                return
+            if mock.fail():
+                payload = json.dumps({'error': {'message': 'Injected server error', 'type': 'server_error'}}).encode('utf-8')
+                self.send_response(500)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                return
+            content, usage = mock.completion(body)
+            time.sleep(mock.delay())
+            envelope = {'id': 'chatcmpl-mock', 'created': int(time.time()), 'model': body.get('model', 'mock')}
+
+            if not body.get('stream'):
+                payload = json.dumps(dict(
+                    envelope,
+                    object='chat.completion',
+                    choices=[{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+                    usage=usage,
+                )).encode('utf-8')
+                self.send_response(200)
+                for name, value in rate_headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                return
+
+            self.send_response(200)
+            for name, value in rate_headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+
+            def send(data):
+                event = f"data: {data}\n\n".encode('utf-8')
+                self.wfile.write(f"{len(event):x}\r\n".encode('ascii') + event + b"\r\n")
+                self.wfile.flush()
+
+            try:
+                self._stream(send, envelope, content, usage, body)
+            except (BrokenPipeError, ConnectionResetError):
+                # The client hung up, e.g. a hedged duplicate won
+                self.close_connection = True
+
+        def _stream(self, send, envelope, content, usage, body):
+            for start in range(0, len(content), STREAM_CHUNK_CHARS):
+                delta = {'content': content[start:start + STREAM_CHUNK_CHARS]}
+                send(json.dumps(dict(
+                    envelope,
+                    object='chat.completion.chunk',
+                    choices=[{'index': 0, 'delta': delta, 'finish_reason': None}],
+                )))
+                if mock.chunk_delay:
+                    time.sleep(mock.chunk_delay)
+            if (body.get('stream_options') or {}).get('include_usage'):
+                send(json.dumps(dict(envelope, object='chat.completion.chunk', choices=[], usage=usage)))
+            send('[DONE]')
+            self.wfile.write(b"0\r\n\r\n")
+
+        def log_message(self, format, *args):
+            pass
+
+    return CompletionsHandler
+
+def serve(mock=None, host='127.0.0.1', port=0):
+    """Create (but don't start) the mock server; port 0 picks a free port"""
+    return MockHTTPServer((host, port), _make_handler(mock or MockOpenAI()))
+
+def start(mock=None, host='127.0.0.1', port=0):
+    """Start the mock server in a background thread and return (server, base_url)"""
+    server = serve(mock, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8780)
+    parser.add_argument('--latency', type=float, default=0.5, help="Seconds before the first byte")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Uniform +/- jitter on the latency")
+    parser.add_argument('--chunk-delay', type=float, default=0.0, help="Seconds between streamed chunks")
+    parser.add_argument('--responses', help="JSON file mapping queries to canned message content")
+    parser.add_argument('--requests-per-minute', type=int, help="Enforce a request rate limit with 429s")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with a 500")
+    parser.add_argument('--slow-rate', type=float, default=0.0, help="Fraction of requests delayed by --slow-latency")
+    parser.add_argument('--slow-latency', type=float, default=5.0, help="Extra seconds for slowed requests")
+    args = parser.parse_args()
+
+    canned = None
+    if args.responses:
+        with open(args.responses) as f:
+            canned = json.load(f)
+    mock = MockOpenAI(args.latency, args.jitter, args.chunk_delay, canned, requests_per_minute=args.requests_per_minute,
+                      error_rate=args.error_rate, slow_rate=args.slow_rate, slow_latency=args.slow_latency)
+    print(f"Mock OpenAI on http://{args.host}:{args.port}/v1")
+    serve(mock, args.host, args.port).serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Payload benchmark for the inline map layers: compares the raw GeoJSON the map used to
+receive with the simplified, quantized TopoJSON from simplify.encode_for_map.
+
+Usage:
+    python -m benchmarks.payload [--features N] [--vertices N] [--zoom Z] [--layer TYPE_NAME]
+
+With --layer the features come from the local feature store; otherwise a synthetic
+road network around the mall is generated. Parse time is measured in Python (json.loads
+plus decoding back to coordinates), as a stand-in for the browser's parse cost.
+"""
+import argparse
+import json
+import time
+import numpy as np
+from filter_spec import MALL_LATITUDE, MALL_LONGITUDE
+from simplify import SIMPLIFY_ZOOM, encode_for_map
+
+def synthetic_roads(features, vertices, seed=0):
+    """Random-walk polylines around the mall, densely sampled like surveyed road geometry"""
+    rng = np.random.default_rng(seed)
+    collection = []
+    for index in range(features):
+        start = [MALL_LONGITUDE + rng.uniform(-0.05, 0.05), MALL_LATITUDE + rng.uniform(-0.05, 0.05)]
+        heading = rng.uniform(0, 2 * np.pi) + np.cumsum(rng.normal(0, 0.05, vertices))
+        steps = np.column_stack([np.cos(heading), np.sin(heading)]) * 0.00005
+        coords = np.asarray(start) + np.cumsum(steps, axis=0)
+        collection.append({
+            'type': 'Feature',
+            'id': f"mtn_rivonia_geom_traffic.{index}",
+            'geometry': {'type': 'LineString', 'coordinates': coords.tolist()},
+            'properties': {'day': 'Monday', 'avg_traffic_den': float(rng.uniform(0, 10))},
+        })
+    return {'type': 'FeatureCollection', 'features': collection}
+
+def decode_geojson(text):
+    """Parse GeoJSON and touch every coordinate, like readFeatures does"""
+    data = json.loads(text)
+    return sum(len(feature['geometry']['coordinates']) for feature in data['features'])
+
+def decode_topojson(text):
+    """
+    Parse TopoJSON, undo the delta encoding and quantization of every arc and stitch each
+    geometry's arcs back into coordinates, like ol.format.TopoJSON does
+    """
+    data = json.loads(text)
+    scale = np.asarray(data['transform']['scale'])
+    translate = np.asarray(data['transform']['translate'])
+    arcs = [np.cumsum(np.asarray(arc, dtype=np.float64).reshape(-1, 2), axis=0) * scale + translate
+            for arc in data['arcs']]
+
+    def line(indexes):
+        # A negative index ~i is arc i reversed; consecutive arcs share their joining point
+        parts = [arcs[index] if index >= 0 else arcs[~index][::-1] for index in indexes]
+        return np.concatenate([parts[0]] + [part[1:] for part in parts[1:]]) if parts else np.zeros((0, 2))
+
+    def resolve(geometry):
+        kind, indexes = geometry.get('type'), geometry.get('arcs')
+        if kind == 'LineString':
+            return [line(indexes)]
+        if kind in ('MultiLineString', 'Polygon'):
+            return [line(part) for part in indexes]
+        if kind == 'MultiPolygon':
+            return [line(ring) for polygon in indexes for ring in polygon]
+        return []
+
+    return sum(
+        len(points)
+        for topology_object in data['objects'].values()
+        for geometry in topology_object['geometries']
+        for points in resolve(geometry)
+    )
+
+def measure(decode, text, repeat):
+    """Best-of-`repeat` wall time of decoding `text`, in milliseconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        decode(text)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--features', type=int, default=2000)
+    parser.add_argument('--vertices', type=int, default=200)
+    parser.add_argument('--zoom', type=int, default=SIMPLIFY_ZOOM)
+    parser.add_argument('--layer', help="Read features from the local feature store instead")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.layer:
+        from feature_store import get_store
+        layer = get_store().load(args.layer)
+        if layer is None:
+            parser.error(f"{args.layer} is not in the feature store; run python feature_store.py first")
+        collection = layer.to_geojson()
+    else:
+        collection = synthetic_roads(args.features, args.vertices)
+
+    start = time.perf_counter()
+    topology = encode_for_map(collection, args.zoom)
+    encode_ms = (time.perf_counter() - start) * 1000
+
+    before = json.dumps(collection)
+    after = json.dumps(topology, separators=(',', ':'))
+    before_ms = measure(decode_geojson, before, args.repeat)
+    after_ms = measure(decode_topojson, after, args.repeat)
+
+    print(f"features:          {len(collection['features'])}")
+    print(f"zoom:              {args.zoom}")
+    print(f"GeoJSON bytes:     {len(before):>12,}")
+    print(f"TopoJSON bytes:    {len(after):>12,}  ({len(after) / len(before):.1%})")
+    print(f"GeoJSON parse:     {before_ms:>10.1f} ms")
+    print(f"TopoJSON parse:    {after_ms:>10.1f} ms  ({after_ms / before_ms:.1%})")
+    print(f"encode (one-off):  {encode_ms:>10.1f} ms")
+
+if __name__ == "__main__":
+    main()
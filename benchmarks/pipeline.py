@@ -0,0 +1,299 @@
+"""
+End-to-end latency benchmark against local mocks of OpenAI and GeoServer, so it costs
+nothing, needs no network and is stable enough to gate CI.
+
+Starts benchmarks.mock_openai and benchmarks.mock_geoserver on free ports, points the app
+at them through its GEOINT_* settings and drives three scenarios over a corpus of queries:
+
+    datasets       segregation.segregate_query + geoint._prepare_dataset per dataset, concurrently
+                   (filter spec, URLs and map layer, without the Streamlit rendering)
+    process_query  geoint.process_query, headless (Streamlit bare mode), including layer loading
+    sites          geoint.process_query comparing --sites synthetic sites around the mall
+
+Each scenario runs with every requested number of concurrent sessions and reports p50,
+p95 and p99 latency, throughput, mean time per pipeline stage (from telemetry) and memory.
+
+Usage:
+    python -m benchmarks.pipeline [--sessions 1,4,16] [--iterations 3] [--llm-latency 0.3] [--sites 50]
+                                  [--cache cold|warm] [--output results.json]
+                                  [--baseline baseline.json --tolerance 0.25]
+
+With --baseline the run exits non-zero if any p95 regressed by more than the tolerance
+or any stage raised.
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import socket
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+
+SCENARIOS = ('datasets', 'process_query', 'sites')
+
+DEFAULT_QUERIES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'queries.txt')
+LAYERS_CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'layers.json')
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def write_sites_config(path, sites, seed=0):
+    """
+    Copy of layers.json with `sites` extra sites scattered within the mock layers' extent
+    around the default site, sharing its layers and attribute suffix
+    """
+    # Read the file directly: importing schema now would fix its settings before configure() sets them
+    with open(LAYERS_CONFIG) as f:
+        config = json.load(f)
+    default = config['sites'][config['default_site']]
+    rng = np.random.default_rng(seed)
+    offsets = rng.uniform(-0.06, 0.06, (sites, 2))
+    for index, (lon_offset, lat_offset) in enumerate(offsets):
+        config['sites'][f"site_{index:02d}"] = dict(
+            default, name=f"Site {index:02d}",
+            longitude=round(default['longitude'] + lon_offset, 6),
+            latitude=round(default['latitude'] + lat_offset, 6),
+        )
+    with open(path, 'w') as f:
+        json.dump(config, f, indent=2)
+
+def configure(args, work_dir):
+    """
+    Point the app's settings at the mocks and a scratch directory. Must run before any app
+    module is imported, since they read their settings at import time.
+    """
+    llm_port, geoserver_port = _free_port(), _free_port()
+    if args.sites:
+        config_path = os.path.join(work_dir, 'layers.json')
+        write_sites_config(config_path, args.sites)
+        os.environ['GEOINT_LAYERS_CONFIG'] = config_path
+    os.environ.update({
+        'OPENAI_API_KEY': os.environ.get('OPENAI_API_KEY') or 'benchmark',
+        'GEOINT_LLM_BASE_URL': f"http://127.0.0.1:{llm_port}/v1",
+        'GEOINT_WFS_BASE_URL': f"http://127.0.0.1:{geoserver_port}/geoserver/mtn/ows",
+        'GEOINT_WMS_BASE_URL': f"http://127.0.0.1:{geoserver_port}/geoserver/mtn/wms",
+        'GEOINT_CACHE_PATH': os.path.join(work_dir, 'cache.sqlite'),
+        # A zero-entry cache evicts every response as soon as it is stored
+        'GEOINT_CACHE_MAX_ENTRIES': '0' if args.cache == 'cold' else '10000',
+        'GEOINT_FEATURE_STORE_DIR': os.path.join(work_dir, 'features'),
+        'GEOINT_SCHEMA_CACHE': os.path.join(work_dir, 'schema.json'),
+        'GEOINT_TILE_PROXY': '0',
+    })
+    return llm_port, geoserver_port
+
+def percentiles(latencies):
+    values = np.asarray(latencies) * 1000
+    if not len(values):
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'p50_ms': round(float(p50), 2), 'p95_ms': round(float(p95), 2), 'p99_ms': round(float(p99), 2)}
+
+def rss_mb():
+    """Current resident set size in MB (0 where /proc is unavailable)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        return 0.0
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+def stage_totals(telemetry):
+    """Snapshot of (count, total seconds) per stage and errors per stage"""
+    with telemetry.metrics.lock:
+        stages = {stage: (buckets[-1], telemetry.metrics.latency_sum[stage]) for stage, buckets in telemetry.metrics.latency.items()}
+        errors = dict(telemetry.metrics.errors)
+    return stages, errors
+
+def run_scenario(call, queries, sessions, iterations):
+    """Run `call` over the corpus in `sessions` threads; returns (latencies, failures, elapsed)"""
+    latencies, failures = [], []
+    lock = threading.Lock()
+
+    def session(offset):
+        for iteration in range(iterations):
+            for index in range(len(queries)):
+                # Stagger sessions so they are not all sending the same query at once
+                query = queries[(index + offset) % len(queries)]
+                start = time.perf_counter()
+                try:
+                    call(query)
+                    error = None
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+                    if error:
+                        failures.append(error)
+
+    threads = [threading.Thread(target=session, args=(offset,)) for offset in range(sessions)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, failures, time.perf_counter() - start
+
+def compare(results, baseline, tolerance):
+    """Messages for every scenario whose p95 regressed beyond the tolerance or that had errors"""
+    expected = {(row['scenario'], row['sessions']): row for row in baseline.get('results', [])}
+    problems = []
+    for row in results:
+        if row['errors']:
+            problems.append(f"{row['scenario']} x{row['sessions']}: {row['errors']} errors")
+        previous = expected.get((row['scenario'], row['sessions']))
+        if previous and previous.get('p95_ms') and row['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            problems.append(
+                f"{row['scenario']} x{row['sessions']}: p95 {row['p95_ms']:.1f} ms vs baseline {previous['p95_ms']:.1f} ms"
+            )
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--queries', default=DEFAULT_QUERIES, help="Text file with one query per line")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--sessions', default='1,4,16', help="Comma-separated concurrent session counts")
+    parser.add_argument('--iterations', type=int, default=3, help="Passes over the corpus per session")
+    parser.add_argument('--llm-latency', type=float, default=0.3)
+    parser.add_argument('--llm-jitter', type=float, default=0.1)
+    parser.add_argument('--llm-chunk-delay', type=float, default=0.0)
+    parser.add_argument('--llm-error-rate', type=float, default=0.0, help="Fraction of LLM requests failing with a 500")
+    parser.add_argument('--llm-slow-rate', type=float, default=0.0, help="Fraction of LLM requests slowed by --llm-slow-latency")
+    parser.add_argument('--llm-slow-latency', type=float, default=5.0)
+    parser.add_argument('--geoserver-latency', type=float, default=0.02)
+    parser.add_argument('--roads', type=int, default=300)
+    parser.add_argument('--days', type=int, default=28)
+    parser.add_argument('--cells', type=int, default=40)
+    parser.add_argument('--sites', type=int, default=50, help="Synthetic sites compared by the sites scenario")
+    parser.add_argument('--cache', choices=('cold', 'warm'), default='cold',
+                        help="cold disables the LLM response cache; warm runs one untimed pass first")
+    parser.add_argument('--local-store', action='store_true',
+                        help="Load the mock layers into the feature store so WFS queries are answered locally")
+    parser.add_argument('--output', help="Write the results as JSON")
+    parser.add_argument('--baseline', help="Results JSON of a previous run to compare p95 against")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    with open(args.queries) as f:
+        queries = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    session_counts = [int(value) for value in args.sessions.split(',')]
+
+    if 'sites' not in scenarios:
+        args.sites = 0
+    work_dir = tempfile.mkdtemp(prefix='geoint-bench-')
+    llm_port, geoserver_port = configure(args, work_dir)
+
+    # App modules are imported only now, after their settings point at the mocks
+    from benchmarks import mock_geoserver, mock_openai
+    import geoint
+    import segregation
+    import telemetry
+    from feature_store import get_store
+    from schema import get_registry
+
+    # Streamlit warns about the missing script context on every call made outside `streamlit run`
+    for name, logger in list(logging.root.manager.loggerDict.items()):
+        if name.startswith('streamlit') and isinstance(logger, logging.Logger):
+            logger.disabled = True
+    mock_openai.start(mock_openai.MockOpenAI(
+        args.llm_latency, args.llm_jitter, args.llm_chunk_delay,
+        error_rate=args.llm_error_rate, slow_rate=args.llm_slow_rate, slow_latency=args.llm_slow_latency,
+    ), port=llm_port)
+    geoserver = mock_geoserver.MockGeoServer(args.roads, args.days, args.cells, latency=args.geoserver_latency)
+    mock_geoserver.start(geoserver, port=geoserver_port)
+    if args.local_store:
+        for type_name in geoserver.layers:
+            get_store().refresh(type_name)
+
+    def prepare_datasets(query):
+        segregated = segregation.segregate_query(query)
+        progress = {}
+        futures = [
+            geoint._executor.submit(telemetry.propagate(geoint._prepare_dataset), dataset, segregated[f"{dataset}_query"], progress)
+            for dataset in ('traffic', 'footfall') if segregated.get(f"{dataset}_query")
+        ]
+        return [future.result() for future in futures]
+
+    site_names = [name for name in get_registry().sites if name.startswith('site_')]
+    calls = {
+        'datasets': prepare_datasets,
+        'process_query': geoint.process_query,
+        'sites': lambda query: geoint.process_query(query, site_names),
+    }
+
+    if args.cache == 'warm':
+        for name in scenarios:
+            run_scenario(calls[name], queries, 1, 1)
+
+    print(f"{len(queries)} queries, LLM latency {args.llm_latency}s +/- {args.llm_jitter}s, cache {args.cache}, "
+          f"layers: " + ", ".join(f"{name} {len(layer):,}" for name, layer in geoserver.layers.items()))
+    print(f"{'scenario':<14} {'sessions':>8} {'calls':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'calls/s':>8} {'RSS MB':>8} {'errors':>6}")
+
+    results = []
+    for name in scenarios:
+        for sessions in session_counts:
+            stages_before, errors_before = stage_totals(telemetry)
+            latencies, failures, elapsed = run_scenario(calls[name], queries, sessions, args.iterations)
+            stages_after, errors_after = stage_totals(telemetry)
+
+            stage_means = {}
+            for stage, (count, total) in stages_after.items():
+                previous_count, previous_total = stages_before.get(stage, (0, 0.0))
+                if count > previous_count:
+                    stage_means[stage] = round((total - previous_total) / (count - previous_count) * 1000, 2)
+            stage_errors = sum(errors_after.values()) - sum(errors_before.values())
+
+            row = {
+                'scenario': name,
+                'sessions': sessions,
+                'calls': len(latencies),
+                **percentiles(latencies),
+                'throughput_per_s': round(len(latencies) / elapsed, 2),
+                'rss_mb': round(rss_mb(), 1),
+                'errors': len(failures) + stage_errors,
+                'stage_mean_ms': stage_means,
+            }
+            results.append(row)
+            print(f"{name:<14} {sessions:>8} {row['calls']:>6} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} "
+                  f"{row['p99_ms']:>9.1f} {row['throughput_per_s']:>8.2f} {row['rss_mb']:>8.1f} {row['errors']:>6}")
+            if failures:
+                print(f"    first failure: {failures[0]}")
+
+    print(f"peak RSS: {peak_rss_mb():.1f} MB")
+    print("mean ms per stage (last run of each scenario):")
+    for row in results:
+        if row['sessions'] == session_counts[-1]:
+            stages = ", ".join(f"{stage} {value:.1f}" for stage, value in sorted(row['stage_mean_ms'].items()))
+            print(f"    {row['scenario']}: {stages}")
+
+    report = {
+        'settings': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare(results, json.load(f), args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        if problems:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from hashlib import sha256
+from dotenv import load_dotenv
+import telemetry
+
+load_dotenv()
+
+# Location and bounds of the on-disk LLM response cache
+CACHE_PATH = os.getenv("GEOINT_CACHE_PATH", ".geoint_cache.sqlite")
+CACHE_MAX_ENTRIES = int(os.getenv("GEOINT_CACHE_MAX_ENTRIES", "10000"))
+CACHE_TTL = float(os.getenv("GEOINT_CACHE_TTL", str(7 * 24 * 3600)))
+
+def normalize_query(query):
+    """Normalize query text so trivially different spellings share a cache entry"""
+    normalized = re.sub(r"\s+", " ", query.strip().lower())
+    return normalized.rstrip(" .?!")
+
+class QueryCache:
+    """
+    SQLite-backed cache for LLM results, shared across Streamlit sessions and restarts.
+    Entries expire after `ttl` seconds and the least recently used entries are evicted
+    once the cache holds more than `max_entries`.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed_at)")
+
+    def _connect(self):
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def make_key(kind, query, model, prompt_version):
+        """Hash the cache kind, normalized query, model and prompt version into a key"""
+        raw = json.dumps([kind, normalize_query(query), model, prompt_version])
+        return sha256(raw.encode("utf-8")).hexdigest()
+
+    def _count(self, kind, hit):
+        telemetry.record_cache(kind, hit)
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, kind, query, model, prompt_version):
+        """Return the cached value, or None on a miss or expired entry"""
+        key = self.make_key(kind, query, model, prompt_version)
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self._count(kind, False)
+                return None
+            if now - row[1] > self.ttl:
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._count(kind, False)
+                return None
+            conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        self._count(kind, True)
+        return json.loads(row[0])
+
+    def set(self, kind, query, model, prompt_version, value):
+        """Store a JSON-serializable value and evict entries beyond the size cap"""
+        key = self.make_key(kind, query, model, prompt_version)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now),
+            )
+            conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+            conn.execute(
+                """DELETE FROM llm_cache WHERE key IN (
+                    SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.max_entries,),
+            )
+
+    def clear(self):
+        """Remove every entry and reset the counters"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM llm_cache")
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Return hit/miss counters for this process and the current entry count"""
+        with self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': entries}
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """Return the process-wide cache, creating it on first use"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = QueryCache()
+        return _cache
@@ -0,0 +1 @@
+# Lets pytest import the top-level modules (cql, feature_store, ...) from tests/
@@ -0,0 +1,253 @@
+import re
+import numpy as np
+import pandas as pd
+from feature_store import get_store
+from filter_spec import DATASETS, MALL_LATITUDE, MALL_LONGITUDE, render_cql
+import spatial
+
+class UnsupportedFilter(ValueError):
+    """Raised for CQL the local engine can't evaluate; callers fall back to GeoServer"""
+
+TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+        (?P<number>-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)
+      | (?P<string>'(?:[^']|'')*')
+      | (?P<op><>|!=|>=|<=|=|>|<)
+      | (?P<punct>[(),])
+      | (?P<name>[A-Za-z_][A-Za-z0-9_.:]*)
+    )""", re.VERBOSE)
+
+KEYWORDS = {'AND', 'OR', 'NOT', 'BBOX', 'BETWEEN', 'IN', 'IS', 'NULL', 'TRUE', 'FALSE'}
+
+ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}")
+
+def tokenize(text):
+    """Split a CQL expression into (kind, value) tokens"""
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN_PATTERN.match(text, position)
+        if not match or match.end() == position:
+            raise UnsupportedFilter(f"Unexpected CQL at: {text[position:position + 20]!r}")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'string':
+            value = value[1:-1].replace("''", "'")
+        elif kind == 'number':
+            value = float(value) if any(c in value for c in '.eE') else int(value)
+        elif kind == 'name' and value.upper() in KEYWORDS:
+            kind, value = 'keyword', value.upper()
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+class _Parser:
+    """Recursive descent parser producing a tuple AST"""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self, kind=None, value=None):
+        token = self.peek()
+        if token[0] is None or (kind and token[0] != kind) or (value is not None and token[1] != value):
+            raise UnsupportedFilter(f"Expected {value or kind}, got {token[1]!r}")
+        self.position += 1
+        return token
+
+    def parse(self):
+        node = self.parse_or()
+        if self.peek()[0] is not None:
+            raise UnsupportedFilter(f"Unexpected token {self.peek()[1]!r}")
+        return node
+
+    def parse_or(self):
+        node = self.parse_and()
+        while self.peek() == ('keyword', 'OR'):
+            self.take()
+            node = ('or', node, self.parse_and())
+        return node
+
+    def parse_and(self):
+        node = self.parse_not()
+        while self.peek() == ('keyword', 'AND'):
+            self.take()
+            node = ('and', node, self.parse_not())
+        return node
+
+    def parse_not(self):
+        if self.peek() == ('keyword', 'NOT'):
+            self.take()
+            return ('not', self.parse_not())
+        return self.parse_predicate()
+
+    def parse_literal(self):
+        kind, value = self.peek()
+        if kind in ('number', 'string'):
+            self.take()
+            return value
+        if (kind, value) in (('keyword', 'TRUE'), ('keyword', 'FALSE')):
+            self.take()
+            return value == 'TRUE'
+        raise UnsupportedFilter(f"Expected a literal, got {value!r}")
+
+    def parse_predicate(self):
+        kind, value = self.peek()
+        if (kind, value) == ('punct', '('):
+            self.take()
+            node = self.parse_or()
+            self.take('punct', ')')
+            return node
+
+        if (kind, value) == ('keyword', 'BBOX'):
+            self.take()
+            self.take('punct', '(')
+            attribute = self.take('name')[1]
+            numbers = []
+            for _ in range(4):
+                self.take('punct', ',')
+                numbers.append(float(self.take('number')[1]))
+            if self.peek() == ('punct', ','):
+                raise UnsupportedFilter("BBOX with an explicit CRS is not supported locally")
+            self.take('punct', ')')
+            return ('bbox', attribute, *numbers)
+
+        if kind != 'name':
+            raise UnsupportedFilter(f"Unsupported CQL construct at {value!r}")
+        attribute = self.take()[1]
+
+        kind, value = self.peek()
+        if kind == 'op':
+            self.take()
+            return ('cmp', '<>' if value == '!=' else value, attribute, self.parse_literal())
+        negate = False
+        if (kind, value) == ('keyword', 'NOT'):
+            self.take()
+            negate = True
+            kind, value = self.peek()
+        if (kind, value) == ('keyword', 'BETWEEN'):
+            self.take()
+            low = self.parse_literal()
+            self.take('keyword', 'AND')
+            node = ('between', attribute, low, self.parse_literal())
+        elif (kind, value) == ('keyword', 'IN'):
+            self.take()
+            self.take('punct', '(')
+            values = [self.parse_literal()]
+            while self.peek() == ('punct', ','):
+                self.take()
+                values.append(self.parse_literal())
+            self.take('punct', ')')
+            node = ('in', attribute, values)
+        elif (kind, value) == ('keyword', 'IS') and not negate:
+            self.take()
+            if self.peek() == ('keyword', 'NOT'):
+                self.take()
+                negate = True
+            self.take('keyword', 'NULL')
+            node = ('null', attribute)
+        else:
+            raise UnsupportedFilter(f"Unsupported CQL operator {value!r}")
+        return ('not', node) if negate else node
+
+def parse(text):
+    """Parse a CQL_FILTER expression into a tuple AST, raising UnsupportedFilter if it can't"""
+    return _Parser(tokenize(text)).parse()
+
+class _Evaluator:
+    """Evaluates an AST to a boolean mask over a LayerData snapshot"""
+
+    def __init__(self, layer):
+        self.layer = layer
+        self.attributes = layer.attributes
+        self._datetimes = {}
+
+    def column(self, attribute, literal):
+        if attribute not in self.attributes:
+            raise UnsupportedFilter(f"Unknown attribute {attribute!r}")
+        column = self.attributes[attribute]
+        # Compare timestamps as instants, so '2024-01-01T00:00:00Z' matches however the store spells it
+        if isinstance(literal, str) and ISO_DATE.match(literal) and not pd.api.types.is_numeric_dtype(column):
+            if attribute not in self._datetimes:
+                if pd.api.types.is_datetime64_any_dtype(column):
+                    parsed = pd.to_datetime(column, utc=True)
+                else:
+                    parsed = pd.to_datetime(column.astype(str).str.rstrip('Z'), format='ISO8601', errors='coerce', utc=True)
+                self._datetimes[attribute] = parsed
+            return self._datetimes[attribute], pd.Timestamp(literal.rstrip('Z'), tz='UTC')
+        return column, literal
+
+    def evaluate(self, node):
+        kind = node[0]
+        if kind == 'and':
+            return self.evaluate(node[1]) & self.evaluate(node[2])
+        if kind == 'or':
+            return self.evaluate(node[1]) | self.evaluate(node[2])
+        if kind == 'not':
+            return ~self.evaluate(node[1])
+        if kind == 'cmp':
+            _, op, attribute, literal = node
+            column, literal = self.column(attribute, literal)
+            result = {
+                '=': lambda: column == literal,
+                '<>': lambda: column != literal,
+                '>': lambda: column > literal,
+                '>=': lambda: column >= literal,
+                '<': lambda: column < literal,
+                '<=': lambda: column <= literal,
+            }[op]()
+            return result.fillna(False).to_numpy(dtype=bool)
+        if kind == 'between':
+            _, attribute, low, high = node
+            column, low = self.column(attribute, low)
+            _, high = self.column(attribute, high)
+            return ((column >= low) & (column <= high)).fillna(False).to_numpy(dtype=bool)
+        if kind == 'in':
+            _, attribute, values = node
+            if attribute not in self.attributes:
+                raise UnsupportedFilter(f"Unknown attribute {attribute!r}")
+            return self.attributes[attribute].isin(values).to_numpy(dtype=bool)
+        if kind == 'null':
+            if node[1] not in self.attributes:
+                raise UnsupportedFilter(f"Unknown attribute {node[1]!r}")
+            return self.attributes[node[1]].isna().to_numpy(dtype=bool)
+        if kind == 'bbox':
+            # Same latitude/longitude order the WFS URL builder emits
+            _, _, min_lat, min_lon, max_lat, max_lon = node
+            mask = np.zeros(len(self.layer), dtype=bool)
+            mask[spatial.get_index(self.layer).query(min_lon, min_lat, max_lon, max_lat)] = True
+            return mask
+        raise UnsupportedFilter(f"Unsupported node {kind!r}")
+
+def evaluate(layer, cql_filter):
+    """Return a boolean mask of the layer's features matching a CQL_FILTER expression"""
+    if not cql_filter:
+        return np.ones(len(layer), dtype=bool)
+    try:
+        return _Evaluator(layer).evaluate(parse(cql_filter))
+    except TypeError as e:
+        # e.g. a numeric literal compared with a text column
+        raise UnsupportedFilter(str(e))
+
+def query_spec(dataset, spec, store=None):
+    """
+    Answer a filter spec from the local feature store, applying its radius as an exact
+    distance from the mall rather than a bounding box
+    Returns:
+        Tuple of (LayerData, boolean mask of the matching features), or None if the layer
+        isn't cached or the filter isn't supported locally
+    """
+    layer = (store or get_store()).load(DATASETS[dataset]['type_name'])
+    if layer is None:
+        return None
+    try:
+        mask = evaluate(layer, render_cql(dataset, spec, include_bbox=False))
+    except UnsupportedFilter:
+        return None
+    if spec['radius_km']:
+        mask = mask & spatial.within_radius(layer, MALL_LONGITUDE, MALL_LATITUDE, spec['radius_km'])
+    return layer, mask
@@ -0,0 +1,357 @@
+import gzip
+import json
+import os
+import re
+import shutil
+import struct
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import chain, islice
+from urllib.parse import urlparse, parse_qs, quote
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+import telemetry
+import wfs_client
+from singleflight import SingleFlight
+
+load_dotenv()
+
+# Exported files, reused for the same URL and format until they are this many seconds old
+EXPORT_DIR = os.getenv("GEOINT_EXPORT_DIR", ".geoint_exports")
+EXPORT_MAX_AGE = float(os.getenv("GEOINT_EXPORT_MAX_AGE", "3600"))
+# Features per chunk (and per Parquet row group); memory holds a few chunks at a time
+EXPORT_CHUNK_ROWS = int(os.getenv("GEOINT_EXPORT_CHUNK_ROWS", "10000"))
+# Threads encoding and compressing chunks while the next ones are read
+EXPORT_WORKERS = int(os.getenv("GEOINT_EXPORT_WORKERS", "4"))
+EXPORT_COMPRESSION = os.getenv("GEOINT_EXPORT_COMPRESSION", "zstd")
+
+# Local server the download links point at; it streams files from EXPORT_DIR
+EXPORT_SERVER_HOST = os.getenv("GEOINT_EXPORT_SERVER_HOST", "127.0.0.1")
+# 0 binds any free port, for several app processes on one host
+EXPORT_SERVER_PORT = int(os.getenv("GEOINT_EXPORT_SERVER_PORT", "8766"))
+# Base of the download links as the browser sees it, an http(s) URL ending in the /exports path:
+# set it when browsers aren't on the app's host, e.g. https://geoint.example.org/exports behind
+# a reverse proxy forwarding /exports/ to the server. Defaults to http://localhost:<port>/exports
+EXPORT_PUBLIC_URL = os.getenv("GEOINT_EXPORT_PUBLIC_URL")
+
+# Format name to (file extension, MIME type)
+FORMATS = {
+    'parquet': ('.parquet', 'application/vnd.apache.parquet'),
+    'csv': ('.csv', 'text/csv'),
+    'csv.gz': ('.csv.gz', 'application/gzip'),
+}
+
+# Names the download server will serve: export_path() output and nothing else
+EXPORT_NAME = re.compile(r'^[0-9a-f]{24}(\.parquet|\.csv|\.csv\.gz)$')
+
+STREAM_BYTES = 1024 * 1024
+
+WKB_TYPES = {
+    'Point': 1, 'LineString': 2, 'Polygon': 3,
+    'MultiPoint': 4, 'MultiLineString': 5, 'MultiPolygon': 6, 'GeometryCollection': 7,
+}
+
+# GeoParquet 1.1 column metadata; without a 'crs' readers assume OGC:CRS84 (lon/lat), which the WFS JSON is in
+GEO_METADATA = {
+    'version': '1.1.0',
+    'primary_column': 'geometry',
+    'columns': {'geometry': {'encoding': 'WKB', 'geometry_types': []}},
+}
+
+_flights = SingleFlight()
+
+def export_format(path):
+    """The export format a file name asks for, from its extension"""
+    for name, (extension, _) in sorted(FORMATS.items(), key=lambda item: -len(item[1][0])):
+        if path.lower().endswith(extension):
+            return name
+    raise ValueError(f"Unsupported export format for {path!r}; use one of {', '.join(FORMATS)}")
+
+def _positions(coordinates):
+    """Little-endian count plus x/y doubles of a list of positions"""
+    try:
+        array = np.asarray(coordinates, dtype='<f8')
+    except ValueError:
+        # Mixed 2D/3D positions
+        array = np.array([position[:2] for position in coordinates], dtype='<f8')
+    array = array.reshape(len(coordinates), -1)[:, :2] if len(coordinates) else np.zeros((0, 2), dtype='<f8')
+    return struct.pack('<I', len(array)) + np.ascontiguousarray(array).tobytes()
+
+def to_wkb(geometry):
+    """Little-endian 2D WKB for a GeoJSON geometry (None stays None)"""
+    if geometry is None:
+        return None
+    kind = geometry['type']
+    header = struct.pack('<BI', 1, WKB_TYPES[kind])
+    if kind == 'GeometryCollection':
+        parts = geometry['geometries']
+        return header + struct.pack('<I', len(parts)) + b''.join(to_wkb(part) for part in parts)
+    coordinates = geometry['coordinates']
+    if kind == 'Point':
+        x, y = coordinates[:2] if coordinates else (float('nan'), float('nan'))
+        return header + struct.pack('<dd', x, y)
+    if kind == 'LineString':
+        return header + _positions(coordinates)
+    if kind == 'Polygon':
+        return header + struct.pack('<I', len(coordinates)) + b''.join(_positions(ring) for ring in coordinates)
+    part_type = kind[len('Multi'):]
+    return header + struct.pack('<I', len(coordinates)) + b''.join(
+        to_wkb({'type': part_type, 'coordinates': part}) for part in coordinates
+    )
+
+def _wkt_positions(coordinates):
+    return "(" + ", ".join(f"{position[0]!r} {position[1]!r}" for position in coordinates) + ")"
+
+def _wkt_body(kind, coordinates):
+    if kind == 'Point':
+        return f"({coordinates[0]!r} {coordinates[1]!r})" if coordinates else "EMPTY"
+    if kind in ('LineString', 'MultiPoint'):
+        return _wkt_positions(coordinates) if coordinates else "EMPTY"
+    if kind in ('Polygon', 'MultiLineString'):
+        return "(" + ", ".join(_wkt_positions(ring) for ring in coordinates) + ")" if coordinates else "EMPTY"
+    return "(" + ", ".join(_wkt_body('Polygon', polygon) for polygon in coordinates) + ")" if coordinates else "EMPTY"
+
+def to_wkt(geometry):
+    """2D WKT for a GeoJSON geometry (None stays None)"""
+    if geometry is None:
+        return None
+    kind = geometry['type']
+    if kind == 'GeometryCollection':
+        return "GEOMETRYCOLLECTION (" + ", ".join(to_wkt(part) for part in geometry['geometries']) + ")"
+    return f"{kind.upper()} {_wkt_body(kind, geometry['coordinates'])}"
+
+def _frame(features, columns=None):
+    """Attribute DataFrame of a chunk of features, with the feature id first"""
+    frame = pd.DataFrame([feature.get('properties') or {} for feature in features])
+    frame.insert(0, 'fid', [feature.get('id') for feature in features])
+    return frame if columns is None else frame.reindex(columns=columns)
+
+def _arrow_type(column):
+    if pd.api.types.is_bool_dtype(column):
+        return pa.bool_()
+    # A chunk of whole numbers says nothing about the next one, so every number is a double
+    if pd.api.types.is_numeric_dtype(column):
+        return pa.float64()
+    if pd.api.types.is_datetime64_any_dtype(column):
+        return pa.timestamp('ms', tz='UTC')
+    return pa.string()
+
+def _arrow_column(column, arrow_type):
+    if arrow_type == pa.float64():
+        column = pd.to_numeric(column, errors='coerce')
+    elif arrow_type == pa.bool_():
+        column = column.astype('boolean')
+    elif pa.types.is_timestamp(arrow_type):
+        column = pd.to_datetime(column, utc=True, errors='coerce')
+    else:
+        column = column.astype('string')
+    return pa.array(column, type=arrow_type, from_pandas=True)
+
+class _ParquetSink:
+    """GeoParquet output: one row group per chunk, WKB geometry, schema fixed by the first chunk"""
+
+    def __init__(self, path, first_chunk):
+        frame = _frame(first_chunk)
+        self.columns = list(frame.columns)
+        fields = [pa.field(name, _arrow_type(frame[name])) for name in self.columns]
+        fields.append(pa.field('geometry', pa.binary()))
+        self.schema = pa.schema(fields, metadata={b'geo': json.dumps(GEO_METADATA).encode('utf-8')})
+        self.writer = pq.ParquetWriter(path, self.schema, compression=EXPORT_COMPRESSION)
+
+    def encode(self, features, first):
+        frame = _frame(features, self.columns)
+        arrays = [_arrow_column(frame[name], self.schema.field(name).type) for name in self.columns]
+        arrays.append(pa.array([to_wkb(feature.get('geometry')) for feature in features], type=pa.binary()))
+        return pa.Table.from_arrays(arrays, schema=self.schema)
+
+    def write(self, table):
+        self.writer.write_table(table, row_group_size=max(len(table), 1))
+
+    def close(self):
+        self.writer.close()
+
+class _CsvSink:
+    """CSV output with WKT geometry; compressed chunks are separate gzip members, which gzip reads as one file"""
+
+    def __init__(self, path, first_chunk, compress):
+        self.columns = list(_frame(first_chunk).columns)
+        self.compress = compress
+        self.file = open(path, 'wb')
+
+    def encode(self, features, first):
+        frame = _frame(features, self.columns)
+        frame['geometry'] = [to_wkt(feature.get('geometry')) for feature in features]
+        data = frame.to_csv(index=False, header=first).encode('utf-8')
+        return gzip.compress(data, compresslevel=6) if self.compress else data
+
+    def write(self, data):
+        self.file.write(data)
+
+    def close(self):
+        self.file.close()
+
+def _chunks(features, size):
+    features = iter(features)
+    while True:
+        chunk = list(islice(features, size))
+        if not chunk:
+            return
+        yield chunk
+
+def write_features(features, path, chunk_rows=EXPORT_CHUNK_ROWS, workers=EXPORT_WORKERS, on_progress=None):
+    """
+    Write features to GeoParquet (.parquet), CSV (.csv) or gzipped CSV (.csv.gz) as they
+    arrive. Worker threads encode and compress chunks of `chunk_rows` while the next ones
+    are read, and a writer thread appends finished chunks in order, so memory holds about
+    `workers` + 1 chunks however large the result is.
+    Args:
+        features: Iterable of GeoJSON features
+        on_progress: Optional callback receiving the number of features read so far
+    Returns:
+        The number of features written
+    """
+    kind = export_format(path)
+    tmp_path = f"{path}.tmp"
+    chunks = _chunks(features, chunk_rows)
+    first = next(chunks, [])
+    sink = _ParquetSink(tmp_path, first) if kind == 'parquet' else _CsvSink(tmp_path, first, compress=kind == 'csv.gz')
+    count = 0
+    pending = deque()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as encoders, ThreadPoolExecutor(max_workers=1) as writer:
+            for index, chunk in enumerate(chain([first], chunks)):
+                encoded = encoders.submit(sink.encode, chunk, index == 0)
+                pending.append(writer.submit(lambda encoded=encoded: sink.write(encoded.result())))
+                count += len(chunk)
+                if on_progress:
+                    on_progress(count)
+                # Read ahead no further than the encoders can keep up with; this also surfaces
+                # encode and write errors early
+                while len(pending) > workers:
+                    pending.popleft().result()
+            while pending:
+                pending.popleft().result()
+    except BaseException:
+        sink.close()
+        os.remove(tmp_path)
+        raise
+    sink.close()
+    os.replace(tmp_path, path)
+    return count
+
+def export(url, path, chunk_rows=EXPORT_CHUNK_ROWS, workers=EXPORT_WORKERS, on_progress=None, store=None, session=None):
+    """
+    Export the features a WFS URL selects, paged from GeoServer or read from the local
+    feature store when it can answer the filter; see write_features
+    Returns:
+        The number of features written
+    """
+    with telemetry.span("export", format=export_format(path)) as current:
+        count = write_features(wfs_client.iter_layer_features(url, store=store, session=session), path,
+                               chunk_rows=chunk_rows, workers=workers, on_progress=on_progress)
+        current.set(features=count, bytes=os.path.getsize(path))
+        return count
+
+def export_path(url, fmt):
+    """Where the export of a URL in a format is kept"""
+    return os.path.join(EXPORT_DIR, sha256(url.encode('utf-8')).hexdigest()[:24] + FORMATS[fmt][0])
+
+def _prune():
+    """Delete exports older than EXPORT_MAX_AGE"""
+    cutoff = time.time() - EXPORT_MAX_AGE
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+def export_url(url, fmt='parquet', on_progress=None):
+    """
+    Export a WFS URL's features into EXPORT_DIR, reusing a recent export of the same URL and
+    format; sessions exporting the same one at the same time share the work
+    Returns:
+        Path of the exported file
+    """
+    path = export_path(url, fmt)
+    if os.path.exists(path) and time.time() - os.path.getmtime(path) < EXPORT_MAX_AGE:
+        return path
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    _prune()
+    _flights.do(path, export, url, path, on_progress=on_progress)
+    return path
+
+class _DownloadHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        name = parsed.path.rsplit('/', 1)[-1]
+        path = os.path.join(EXPORT_DIR, name)
+        if not parsed.path.startswith('/exports/') or not EXPORT_NAME.match(name) or not os.path.isfile(path):
+            self.send_error(404)
+            return
+        fmt = export_format(name)
+        file_name = parse_qs(parsed.query).get('name', [f"export{FORMATS[fmt][0]}"])[-1]
+        file_name = re.sub(r'[^A-Za-z0-9._-]', '_', file_name)
+        with open(path, 'rb') as f:
+            self.send_response(200)
+            self.send_header('Content-Type', FORMATS[fmt][1])
+            self.send_header('Content-Length', str(os.fstat(f.fileno()).st_size))
+            self.send_header('Content-Disposition', f'attachment; filename="{file_name}"')
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile, STREAM_BYTES)
+
+    def log_message(self, format, *args):
+        pass
+
+_server = None
+_server_lock = threading.Lock()
+
+def start_server():
+    """
+    Start the download server in a background thread, once
+    Raises:
+        OSError: EXPORT_SERVER_PORT can't be bound, e.g. another process already uses it
+    """
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((EXPORT_SERVER_HOST, EXPORT_SERVER_PORT), _DownloadHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+        return _server
+
+def public_url():
+    """
+    Base URL of the download links: EXPORT_PUBLIC_URL, or the running server on localhost
+    Raises:
+        ValueError: EXPORT_PUBLIC_URL is not an http(s) URL
+    """
+    if not EXPORT_PUBLIC_URL:
+        port = _server.server_address[1] if _server is not None else EXPORT_SERVER_PORT
+        return f"http://localhost:{port}/exports"
+    parts = urlparse(EXPORT_PUBLIC_URL)
+    if parts.scheme not in ('http', 'https') or not parts.netloc or parts.query or parts.fragment:
+        raise ValueError(f"GEOINT_EXPORT_PUBLIC_URL must be an http(s) URL without a query, got {EXPORT_PUBLIC_URL!r}")
+    return EXPORT_PUBLIC_URL.rstrip('/')
+
+def download_url(path, file_name):
+    """
+    Link that downloads an exported file from the download server under `file_name`
+    Raises:
+        ValueError: EXPORT_PUBLIC_URL is not an http(s) URL
+    """
+    return f"{public_url()}/{os.path.basename(path)}?name={quote(file_name)}"
+
+if __name__ == "__main__":
+    # python export.py WFS_URL OUTPUT.parquet|.csv|.csv.gz
+    count = export(sys.argv[1], sys.argv[2], on_progress=lambda count: print(f"\r{count:,} features", end='', file=sys.stderr))
+    print(f"\nWrote {count:,} features to {sys.argv[2]}", file=sys.stderr)
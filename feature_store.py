@@ -0,0 +1,346 @@
+import json
+import os
+import shutil
+import threading
+import time
+import numpy as np
+import pandas as pd
+import requests
+from dotenv import load_dotenv
+from schema import load_config
+
+load_dotenv()
+
+# Where layer snapshots are kept and how many features each WFS page pulls
+FEATURE_STORE_DIR = os.getenv("GEOINT_FEATURE_STORE_DIR", ".geoint_features")
+WFS_PAGE_SIZE = int(os.getenv("GEOINT_WFS_PAGE_SIZE", "5000"))
+
+WFS_BASE_URL = os.getenv("GEOINT_WFS_BASE_URL", "https://mapstack2.mapit.co.za/geoserver/mtn/ows")
+
+# Layers kept locally; `watermark` names the attribute used for incremental refreshes
+LAYERS = {
+    config['type_name']: {'watermark': config.get('watermark')}
+    for config in load_config()['datasets'].values()
+}
+
+GEOMETRY_TYPES = ['Point', 'LineString', 'Polygon', 'MultiPoint', 'MultiLineString', 'MultiPolygon']
+
+GEOMETRY_ARRAYS = ('geom_types', 'geom_offsets', 'part_offsets', 'ring_offsets', 'coords')
+
+def _geometry_parts(geometry):
+    """Return the geometry as a list of parts, each a list of coordinate rings"""
+    kind, coordinates = geometry['type'], geometry['coordinates']
+    if kind == 'Point':
+        return [[[coordinates]]]
+    if kind == 'LineString':
+        return [[coordinates]]
+    if kind == 'Polygon':
+        return [coordinates]
+    if kind == 'MultiPoint':
+        return [[[point]] for point in coordinates]
+    if kind == 'MultiLineString':
+        return [[line] for line in coordinates]
+    if kind == 'MultiPolygon':
+        return coordinates
+    raise ValueError(f"Unsupported geometry type: {kind}")
+
+def encode_geometries(geometries):
+    """
+    Encode GeoJSON geometries into flat coordinate arrays with offsets
+    Args:
+        geometries: Iterable of GeoJSON geometry dicts (None for empty geometry)
+    Returns:
+        Dict of NumPy arrays: geom_types (int8 per feature), geom_offsets (feature -> parts),
+        part_offsets (part -> rings), ring_offsets (ring -> coords) and coords (n x 2 lon/lat)
+    """
+    geom_types, geom_offsets, part_offsets, ring_offsets = [], [0], [0], [0]
+    coords = []
+    for geometry in geometries:
+        parts = _geometry_parts(geometry) if geometry else []
+        geom_types.append(GEOMETRY_TYPES.index(geometry['type']) if geometry else -1)
+        for rings in parts:
+            for ring in rings:
+                coords.extend(point[:2] for point in ring)
+                ring_offsets.append(len(coords))
+            part_offsets.append(len(ring_offsets) - 1)
+        geom_offsets.append(len(part_offsets) - 1)
+
+    return {
+        'geom_types': np.array(geom_types, dtype=np.int8),
+        'geom_offsets': np.array(geom_offsets, dtype=np.int64),
+        'part_offsets': np.array(part_offsets, dtype=np.int64),
+        'ring_offsets': np.array(ring_offsets, dtype=np.int64),
+        'coords': np.array(coords, dtype=np.float64).reshape(-1, 2),
+    }
+
+def concat_geometries(first, second):
+    """Append one set of encoded geometry arrays to another"""
+    return {
+        'geom_types': np.concatenate([first['geom_types'], second['geom_types']]),
+        'geom_offsets': np.concatenate([first['geom_offsets'], second['geom_offsets'][1:] + first['geom_offsets'][-1]]),
+        'part_offsets': np.concatenate([first['part_offsets'], second['part_offsets'][1:] + first['part_offsets'][-1]]),
+        'ring_offsets': np.concatenate([first['ring_offsets'], second['ring_offsets'][1:] + first['ring_offsets'][-1]]),
+        'coords': np.concatenate([first['coords'], second['coords']]),
+    }
+
+def _expand_ranges(starts, ends):
+    """Concatenate arange(start, end) for each pair without a Python loop"""
+    lengths = ends - starts
+    if not len(lengths):
+        return np.zeros(0, dtype=np.int64)
+    shifts = starts - np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    return np.repeat(shifts, lengths) + np.arange(lengths.sum())
+
+def take_geometries(geometry, indices):
+    """Return encoded geometry arrays for the features at `indices`, in that order"""
+    indices = np.asarray(indices, dtype=np.int64)
+    geom_offsets, part_offsets, ring_offsets = geometry['geom_offsets'], geometry['part_offsets'], geometry['ring_offsets']
+
+    parts = _expand_ranges(geom_offsets[indices], geom_offsets[indices + 1])
+    rings = _expand_ranges(part_offsets[parts], part_offsets[parts + 1])
+    coords = _expand_ranges(ring_offsets[rings], ring_offsets[rings + 1])
+
+    def offsets(starts, ends):
+        return np.concatenate([[0], np.cumsum(ends - starts)]).astype(np.int64)
+
+    return {
+        'geom_types': np.asarray(geometry['geom_types'])[indices],
+        'geom_offsets': offsets(geom_offsets[indices], geom_offsets[indices + 1]),
+        'part_offsets': offsets(part_offsets[parts], part_offsets[parts + 1]),
+        'ring_offsets': offsets(ring_offsets[rings], ring_offsets[rings + 1]),
+        'coords': np.asarray(geometry['coords'])[coords].reshape(-1, 2),
+    }
+
+class LayerData:
+    """Columnar snapshot of a layer: attributes in a DataFrame plus flat geometry arrays"""
+
+    def __init__(self, type_name, attributes, geometry, watermark=None):
+        self.type_name = type_name
+        self.attributes = attributes.reset_index(drop=True)
+        self.geometry = geometry
+        self.watermark = watermark
+        self._bounds = None
+
+    def __len__(self):
+        return len(self.attributes)
+
+    @property
+    def bounds(self):
+        """Per-feature (min_lon, min_lat, max_lon, max_lat) as an n x 4 array"""
+        if self._bounds is None:
+            coords = self.geometry['coords']
+            # Coordinate ranges of each feature, via the offsets of its first and last ring
+            starts = self.geometry['ring_offsets'][self.geometry['part_offsets'][self.geometry['geom_offsets'][:-1]]]
+            ends = self.geometry['ring_offsets'][self.geometry['part_offsets'][self.geometry['geom_offsets'][1:]]]
+            bounds = np.full((len(self), 4), np.nan)
+            present = ends > starts
+            if present.any():
+                bounds[present, 0] = np.minimum.reduceat(coords[:, 0], starts[present])
+                bounds[present, 1] = np.minimum.reduceat(coords[:, 1], starts[present])
+                bounds[present, 2] = np.maximum.reduceat(coords[:, 0], starts[present])
+                bounds[present, 3] = np.maximum.reduceat(coords[:, 1], starts[present])
+            self._bounds = bounds
+        return self._bounds
+
+    def feature_coords(self, index):
+        """Return the slice of `coords` belonging to one feature"""
+        geometry = self.geometry
+        first_part, last_part = geometry['geom_offsets'][index], geometry['geom_offsets'][index + 1]
+        start = geometry['ring_offsets'][geometry['part_offsets'][first_part]]
+        end = geometry['ring_offsets'][geometry['part_offsets'][last_part]]
+        return geometry['coords'][start:end]
+
+    def decode_geometry(self, index):
+        """Rebuild the GeoJSON geometry of one feature"""
+        geometry = self.geometry
+        type_code = geometry['geom_types'][index]
+        if type_code < 0:
+            return None
+        kind = GEOMETRY_TYPES[type_code]
+
+        parts = []
+        for part in range(geometry['geom_offsets'][index], geometry['geom_offsets'][index + 1]):
+            rings = []
+            for ring in range(geometry['part_offsets'][part], geometry['part_offsets'][part + 1]):
+                start, end = geometry['ring_offsets'][ring], geometry['ring_offsets'][ring + 1]
+                rings.append(geometry['coords'][start:end].tolist())
+            parts.append(rings)
+
+        if kind == 'Point':
+            coordinates = parts[0][0][0]
+        elif kind == 'LineString':
+            coordinates = parts[0][0]
+        elif kind == 'Polygon':
+            coordinates = parts[0]
+        elif kind == 'MultiPoint':
+            coordinates = [rings[0][0] for rings in parts]
+        elif kind == 'MultiLineString':
+            coordinates = [rings[0] for rings in parts]
+        else:
+            coordinates = parts
+        return {'type': kind, 'coordinates': coordinates}
+
+    def iter_features(self, mask=None, chunk_rows=10000):
+        """
+        Yield GeoJSON features, optionally only those selected by a boolean mask; attributes
+        are serialized `chunk_rows` rows at a time, so a consumer streaming the features
+        holds one block of records rather than the whole selection
+        """
+        indices = np.arange(len(self)) if mask is None else np.flatnonzero(mask)
+        for start in range(0, len(indices), chunk_rows):
+            block = indices[start:start + chunk_rows]
+            rows = self.attributes.iloc[block]
+            # Round-trip through JSON so NumPy scalars, NaN and timestamps come out as plain values
+            records = json.loads(rows.to_json(orient='records', date_format='iso'))
+            for index, record in zip(block, records):
+                fid = record.pop('fid')
+                yield {
+                    'type': 'Feature',
+                    'id': fid,
+                    'geometry': self.decode_geometry(index),
+                    'properties': record,
+                }
+
+    def to_geojson(self, mask=None):
+        """Return a GeoJSON FeatureCollection, optionally filtered by a boolean mask"""
+        return {'type': 'FeatureCollection', 'features': list(self.iter_features(mask))}
+
+def _features_to_frame(features):
+    """Split WFS GeoJSON features into an attribute DataFrame and encoded geometry"""
+    attributes = pd.DataFrame([feature.get('properties') or {} for feature in features])
+    attributes.insert(0, 'fid', [feature.get('id') for feature in features])
+    geometry = encode_geometries(feature.get('geometry') for feature in features)
+    return attributes, geometry
+
+def fetch_features(type_name, cql_filter=None, session=None, page_size=WFS_PAGE_SIZE):
+    """Download every feature of a layer (optionally filtered) from GeoServer, one page at a time"""
+    session = session or requests.Session()
+    features = []
+    start_index = 0
+    while True:
+        params = {
+            'service': 'WFS',
+            'version': '2.0.0',
+            'request': 'GetFeature',
+            'typeNames': type_name,
+            'outputFormat': 'application/json',
+            'srsName': 'EPSG:4326',
+            'count': page_size,
+            'startIndex': start_index,
+        }
+        if cql_filter:
+            params['CQL_FILTER'] = cql_filter
+        response = session.get(WFS_BASE_URL, params=params, timeout=120)
+        response.raise_for_status()
+        page = response.json().get('features', [])
+        features.extend(page)
+        if len(page) < page_size:
+            return features
+        start_index += page_size
+
+class FeatureStore:
+    """
+    Local copy of the WFS layers, one directory per layer holding attributes.parquet,
+    one .npy file per geometry array and meta.json with the refresh watermark.
+    """
+
+    def __init__(self, root=FEATURE_STORE_DIR):
+        self.root = root
+        self._layers = {}
+        self._lock = threading.Lock()
+
+    def _layer_dir(self, type_name):
+        return os.path.join(self.root, type_name.replace(':', '_'))
+
+    def load(self, type_name):
+        """Return the stored LayerData for a layer, or None if it has never been fetched"""
+        with self._lock:
+            if type_name in self._layers:
+                return self._layers[type_name]
+
+            layer_dir = self._layer_dir(type_name)
+            meta_path = os.path.join(layer_dir, 'meta.json')
+            if not os.path.exists(meta_path):
+                return None
+            with open(meta_path) as f:
+                meta = json.load(f)
+            attributes = pd.read_parquet(os.path.join(layer_dir, 'attributes.parquet'))
+            geometry = {
+                name: np.load(os.path.join(layer_dir, f"{name}.npy"), mmap_mode='r')
+                for name in GEOMETRY_ARRAYS
+            }
+            layer = LayerData(type_name, attributes, geometry, meta.get('watermark'))
+            self._layers[type_name] = layer
+            return layer
+
+    def save(self, layer):
+        """Write a layer snapshot, replacing the previous one atomically"""
+        layer_dir = self._layer_dir(layer.type_name)
+        tmp_dir = f"{layer_dir}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        layer.attributes.to_parquet(os.path.join(tmp_dir, 'attributes.parquet'), index=False)
+        for name in GEOMETRY_ARRAYS:
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), np.asarray(layer.geometry[name]))
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump({'watermark': layer.watermark, 'count': len(layer), 'updated_at': time.time()}, f)
+
+        with self._lock:
+            old_dir = f"{layer_dir}.old"
+            shutil.rmtree(old_dir, ignore_errors=True)
+            if os.path.exists(layer_dir):
+                os.replace(layer_dir, old_dir)
+            os.replace(tmp_dir, layer_dir)
+            shutil.rmtree(old_dir, ignore_errors=True)
+            self._layers[layer.type_name] = layer
+
+    def refresh(self, type_name, session=None):
+        """
+        Bring a layer up to date: a full download the first time, then only rows at or after
+        the stored watermark for layers that have one
+        Returns:
+            Number of features fetched from GeoServer
+        """
+        watermark_attribute = LAYERS.get(type_name, {}).get('watermark')
+        existing = self.load(type_name)
+
+        cql_filter = None
+        if existing is not None and watermark_attribute and existing.watermark:
+            # >= rather than > so rows added later for the watermark day are picked up; fid dedupes
+            cql_filter = f"{watermark_attribute}>='{existing.watermark}'"
+        elif existing is not None and not watermark_attribute:
+            existing = None
+
+        features = fetch_features(type_name, cql_filter, session=session)
+        attributes, geometry = _features_to_frame(features)
+
+        if existing is not None:
+            keep = ~existing.attributes['fid'].isin(attributes['fid']).to_numpy()
+            kept_geometry = take_geometries(existing.geometry, np.flatnonzero(keep))
+            attributes = pd.concat([existing.attributes[keep], attributes], ignore_index=True)
+            geometry = concat_geometries(kept_geometry, geometry)
+
+        watermark = None
+        if watermark_attribute and watermark_attribute in attributes and len(attributes):
+            watermark = str(attributes[watermark_attribute].max())
+
+        self.save(LayerData(type_name, attributes, geometry, watermark))
+        return len(features)
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store():
+    """Return the process-wide feature store"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = FeatureStore()
+        return _store
+
+if __name__ == "__main__":
+    store = get_store()
+    for type_name in LAYERS:
+        fetched = store.refresh(type_name)
+        print(f"{type_name}: fetched {fetched} features, {len(store.load(type_name))} stored")
@@ -0,0 +1,292 @@
+import json
+import re
+from datetime import date, datetime
+from cache import get_cache, normalize_query
+from llm import LLMUnavailable, complete
+import telemetry
+from singleflight import SingleFlight
+import spatial
+from schema import get_registry
+
+MODEL = 'gpt-4o'
+
+# Bump whenever the prompt or spec format changes so stale cache entries are ignored
+PROMPT_VERSION = 3
+
+# Layers, their attribute descriptions and the mall location come from layers.json
+DATASETS = get_registry().datasets
+
+# Mall location used as the centre of every radius condition
+MALL_LONGITUDE = get_registry().site()['longitude']
+MALL_LATITUDE = get_registry().site()['latitude']
+
+# Radius used for the WMS bbox when the query has no distance condition
+DEFAULT_RADIUS_KM = 10
+
+# Comparison operators the URL builders will emit
+OPERATORS = ('=', '<>', '>', '>=', '<', '<=')
+
+DAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+
+# Patterns for the rule-based spec used while the LLM is unavailable
+THRESHOLD = re.compile(r"(>=|<=|<>|>|<|=)\s*(-?\d+(?:\.\d+)?)")
+RADIUS = re.compile(r"(\d+(?:\.\d+)?)\s*(?:km|kilomet)", re.I)
+WORD = re.compile(r"[a-z]{3,}")
+
+def _build_prompts(dataset, query):
+    """
+    Build the system and user prompts asking for a JSON filter spec. Everything but the
+    query sits in the system prompt, which is identical for every call on a dataset, so
+    the provider's prompt cache can reuse it.
+    """
+    config = DATASETS[dataset]
+    lines = [
+        f"Translate the user's query into a JSON filter for GeoServer layer {config['type_name']}. "
+        "Return ONLY a JSON object with:",
+        f'- "predicates": list of {{"attribute", "op" (one of {" ".join(OPERATORS)}), "value" (number or string)}}',
+        '- "combine": "AND" or "OR"',
+    ]
+    if config['day_attribute']:
+        lines.append('- "days": list of day names the data must fall on, or null')
+    if config['time_attribute']:
+        lines.append('- "time_range": {"start": "yyyy-mm-dd", "end": "yyyy-mm-dd"} on the daily timestamp, or null')
+    if config.get('rollups'):
+        lines.append(f'- "aggregate": true if the predicates apply to each {config["rollups"]["label"]}\'s average over the selected days '
+                     '(e.g. "averaged", "on average"), else false')
+    lines.append('- "radius_km": distance from the mall in km if mentioned, else null')
+    lines.append("Attributes (use no others):")
+    lines.append(get_registry().describe(dataset))
+    system_prompt = "\n".join(lines)
+
+    return system_prompt, query
+
+def _iso_date(value, name):
+    """A yyyy-mm-dd string for an ISO date (or date-time) from the LLM, raising ValueError otherwise"""
+    if not isinstance(value, str):
+        raise ValueError(f"time_range {name} must be an ISO date, got {value!r}")
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).date().isoformat()
+    except ValueError:
+        raise ValueError(f"time_range {name} must be an ISO date, got {value!r}")
+
+def validate_spec(dataset, spec):
+    """Check a filter spec against the dataset's properties, raising ValueError on anything the builders can't use"""
+    config = DATASETS[dataset]
+
+    if not isinstance(spec, dict):
+        raise ValueError("Filter spec must be a JSON object")
+
+    attributes = get_registry().schema(dataset)
+    predicates = spec.get('predicates') or []
+    if not isinstance(predicates, list) or not all(isinstance(predicate, dict) for predicate in predicates):
+        raise ValueError("predicates must be a list of objects")
+    for predicate in predicates:
+        if predicate.get('attribute') not in attributes:
+            raise ValueError(f"Unknown {dataset} attribute: {predicate.get('attribute')}")
+        if predicate.get('op') not in OPERATORS:
+            raise ValueError(f"Unsupported operator: {predicate.get('op')}")
+        if not isinstance(predicate.get('value'), (int, float, str)):
+            raise ValueError(f"Unsupported value for {predicate['attribute']}: {predicate.get('value')!r}")
+        if attributes[predicate['attribute']]['type'] == 'number' and isinstance(predicate['value'], str):
+            try:
+                predicate['value'] = float(predicate['value'])
+            except ValueError:
+                raise ValueError(f"{predicate['attribute']} is numeric, got {predicate['value']!r}")
+
+    combine = (spec.get('combine') or 'AND').upper()
+    if combine not in ('AND', 'OR'):
+        raise ValueError(f"Unsupported combine operator: {combine}")
+
+    days = spec.get('days') or []
+    if not isinstance(days, list):
+        raise ValueError(f"days must be a list of day names, got {days!r}")
+    if days and not config['day_attribute']:
+        raise ValueError(f"The {dataset} layer has no day property")
+    for day in days:
+        if not isinstance(day, str) or day.capitalize() not in DAYS:
+            raise ValueError(f"Unknown day: {day!r}")
+    days = [day.capitalize() for day in days]
+
+    time_range = spec.get('time_range')
+    if time_range is not None and not isinstance(time_range, dict):
+        raise ValueError(f"time_range must be an object with start and end dates, got {time_range!r}")
+    if time_range and not config['time_attribute']:
+        raise ValueError(f"The {dataset} layer has no timestamp property")
+    if time_range:
+        start, end = time_range.get('start'), time_range.get('end')
+        start = _iso_date(start, 'start') if start else None
+        end = _iso_date(end, 'end') if end else None
+        if start and end and start > end:
+            raise ValueError(f"time_range starts after it ends: {start} > {end}")
+        time_range = {'start': start, 'end': end} if start or end else None
+
+    aggregate = bool(spec.get('aggregate'))
+    if aggregate and not config.get('rollups'):
+        raise ValueError(f"The {dataset} layer has no daily rows to aggregate")
+
+    radius_km = spec.get('radius_km')
+    if radius_km is not None:
+        if isinstance(radius_km, bool) or not isinstance(radius_km, (int, float, str)):
+            raise ValueError(f"Radius must be a number: {radius_km!r}")
+        radius_km = float(radius_km)
+        if radius_km <= 0:
+            raise ValueError(f"Radius must be positive: {radius_km}")
+
+    return {
+        'predicates': predicates,
+        'combine': combine,
+        'days': days or None,
+        'time_range': time_range,
+        'aggregate': aggregate,
+        'radius_km': radius_km,
+    }
+
+_flights = SingleFlight()
+
+def get_filter_spec(dataset, query, on_delta=None):
+    """
+    Ask the LLM for a structured filter spec for the given dataset ('traffic' or 'footfall').
+    Concurrent calls for the same dataset and normalized query share one request.
+    Args:
+        on_delta: Optional callback streaming the partial response text (only the caller
+            that starts the request receives it)
+    """
+    with telemetry.span("filter_spec", dataset=dataset):
+        return _flights.do((dataset, normalize_query(query)), _get_filter_spec, dataset, query, on_delta)
+
+def _get_filter_spec(dataset, query, on_delta):
+    cache = get_cache()
+    # The prompt embeds the schema's statistics, so a spec is only reused under the schema it was built from
+    version = f"{PROMPT_VERSION}:{get_registry().fingerprint(dataset)}"
+    cached = cache.get(f"filter_spec:{dataset}", query, MODEL, version)
+    if cached is not None:
+        return cached
+
+    system_prompt, prompt = _build_prompts(dataset, query)
+
+    try:
+        content = complete(MODEL, system_prompt, prompt, temperature=0.2, on_delta=on_delta,
+                           response_format={'type': 'json_object'})
+    except LLMUnavailable:
+        spec = rule_based_spec(dataset, query)
+        if spec is None:
+            raise
+        # Not cached, so the LLM's answer replaces it once the provider recovers
+        current = telemetry.current_span()
+        if current:
+            current.set(fallback='rules')
+        return spec
+
+    try:
+        spec = json.loads(content)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Error parsing {dataset} filter spec: {str(e)}")
+    spec = validate_spec(dataset, spec)
+    cache.set(f"filter_spec:{dataset}", query, MODEL, version, spec)
+    return spec
+
+def _words(text):
+    return {word.rstrip('s') for word in WORD.findall(text.lower())}
+
+def rule_based_spec(dataset, query):
+    """
+    Best-effort filter spec without the LLM: the query's first comparison applied to the
+    numeric attribute whose name and description share the most words with the query,
+    plus any day names and radius it mentions
+    Returns:
+        Validated spec marked 'fallback', or None if the query has no comparison
+    """
+    match = THRESHOLD.search(query)
+    if not match:
+        return None
+    config = DATASETS[dataset]
+    words = _words(query)
+    attributes = get_registry().schema(dataset)
+    candidates = [name for name, attribute in attributes.items() if attribute['type'] in ('number', None)]
+    if not candidates:
+        return None
+    # max() keeps the first of equally good matches, i.e. the order layers.json lists them in
+    attribute = max(candidates, key=lambda name: len(words & _words(f"{name.replace('_', ' ')} {attributes[name]['description']}")))
+
+    days = None
+    if config['day_attribute']:
+        lowered = query.lower()
+        days = [day for day in DAYS if day.lower() in lowered]
+        if 'weekend' in lowered:
+            days += ['Saturday', 'Sunday']
+        elif 'weekday' in lowered:
+            days += list(DAYS[:5])
+    radius = RADIUS.search(query)
+    spec = validate_spec(dataset, {
+        'predicates': [{'attribute': attribute, 'op': match.group(1), 'value': float(match.group(2))}],
+        'days': sorted(set(days), key=DAYS.index) if days else None,
+        'radius_km': radius.group(1) if radius else None,
+    })
+    spec['fallback'] = True
+    return spec
+
+def radius_bbox(radius_km):
+    """Return (min_lon, min_lat, max_lon, max_lat) of the box around the mall for a radius in km"""
+    return tuple(float(value) for value in spatial.radius_bbox(MALL_LONGITUDE, MALL_LATITUDE, radius_km))
+
+def _cql_literal(value):
+    """Format a value as a CQL literal, quoting and escaping strings"""
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return repr(value) if isinstance(value, float) else str(value)
+
+def _cql_timestamp(day):
+    """Format a validated yyyy-mm-dd date as the layer's start-of-day timestamp literal"""
+    return f"'{date.fromisoformat(day[:10]).isoformat()}T00:00:00Z'"
+
+def render_cql(dataset, spec, include_bbox, bbox=None):
+    """
+    Render a validated filter spec as a CQL_FILTER expression
+    Args:
+        dataset: 'traffic' or 'footfall'
+        spec: Filter spec returned by validate_spec
+        include_bbox: Whether to append the radius as a BBOX condition (WFS only)
+        bbox: (min_lon, min_lat, max_lon, max_lat) to use for the radius instead of the
+            box around the default site
+    Returns:
+        CQL string, or None if the spec has no conditions
+    """
+    config = DATASETS[dataset]
+    clauses = []
+
+    # Aggregate predicates apply to per-road averages, which CQL can't express; the URLs
+    # then select the daily rows the averages are taken over (see rollups.query_spec)
+    predicates = [
+        f"{p['attribute']}{p['op']}{_cql_literal(p['value'])}"
+        for p in spec['predicates']
+    ] if not spec.get('aggregate') else []
+    if predicates:
+        joined = f" {spec['combine']} ".join(predicates)
+        clauses.append(f"({joined})" if len(predicates) > 1 else joined)
+
+    if spec['days']:
+        days = " OR ".join(f"{config['day_attribute']}={_cql_literal(day)}" for day in spec['days'])
+        clauses.append(f"({days})" if len(spec['days']) > 1 else days)
+
+    time_range = spec['time_range']
+    if time_range:
+        attribute = config['time_attribute']
+        start, end = time_range.get('start'), time_range.get('end')
+        if start and start == end:
+            clauses.append(f"{attribute}={_cql_timestamp(start)}")
+        else:
+            if start:
+                clauses.append(f"{attribute}>={_cql_timestamp(start)}")
+            if end:
+                clauses.append(f"{attribute}<={_cql_timestamp(end)}")
+
+    if include_bbox and spec['radius_km']:
+        min_lon, min_lat, max_lon, max_lat = bbox or radius_bbox(spec['radius_km'])
+        # The WFS 1.1.0 endpoint reads EPSG:4326 BBOX filters in latitude/longitude order
+        clauses.append(f"BBOX(geom,{min_lat},{min_lon},{max_lat},{max_lon})")
+
+    return " AND ".join(clauses) or None
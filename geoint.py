@@ -1,13 +1,27 @@
 import streamlit as st
 import pandas as pd
 import requests
-from openai import OpenAI
 import os
 from dotenv import load_dotenv
 from PIL import Image
 import json
-from wfs import get_traffic_url, get_footfall_url
-from wms import get_footfall_wms_url, get_wms_traffic_url
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import segregation
+from cache import normalize_query
+from filter_spec import get_filter_spec
+from wfs import build_wfs_url
+from wms import build_wms_url
+import tile_proxy
+import cql
+import wfs_client
+import simplify
+import rollups
+import sites
+import export
+import telemetry
+from singleflight import SingleFlight
+from schema import get_registry
 
 # Load environment variables
 load_dotenv()
@@ -15,22 +29,54 @@ load_dotenv()
 # Page config
 st.set_page_config(page_title="GeoInt Analysis", layout="wide")
 
-def create_map_html(wfs_urls, wms_urls):
+# Seconds a query's datasets may take, filter spec and map layer together, before the
+# unfinished ones are reported as timed out
+LLM_TIMEOUT = float(os.getenv("GEOINT_LLM_TIMEOUT", "60"))
+
+# Past query results kept per session for instant re-display (each holds its map HTML)
+HISTORY_SIZE = int(os.getenv("GEOINT_HISTORY_SIZE", "10"))
+
+# Shared pool for the filter spec calls so one query's datasets run side by side
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("GEOINT_LLM_WORKERS", "8")))
+
+# Sessions showing the same WFS URL at the same time share one load and simplification
+_layer_flights = SingleFlight()
+
+def create_map_html(wfs_urls, wms_urls, trace_id=None, site_names=None):
     """
     Create the HTML for the OpenLayers map with improved layer loading
     Args:
-        wfs_urls: List of WFS URL strings
+        wfs_urls: List of WFS URL strings for the browser to fetch, or GeoJSON
+            FeatureCollections already loaded server-side
         wms_urls: List of WMS URL strings
+        trace_id: Trace the browser's WFS fetch/parse timings are reported under, when
+            the telemetry endpoint is enabled
+        site_names: Registered sites to mark on the map; the map opens on them (on the
+            default site when not given)
     """
     # Convert single URLs to lists for consistent handling
-    if isinstance(wfs_urls, str):
+    if isinstance(wfs_urls, (str, dict)):
         wfs_urls = [wfs_urls]
     if isinstance(wms_urls, str):
         wms_urls = [wms_urls]
 
-    # Create the JavaScript array initialization for URLs
-    wfs_urls_js = "[" + ",".join(f"'{url}'" for url in wfs_urls) + "]"
-    wms_urls_js = "[" + ",".join(f"'{url}'" for url in wms_urls) + "]"
+    # Serve tiles through the local caching proxy when it is enabled
+    if tile_proxy.TILE_PROXY_ENABLED:
+        tile_proxy.start_proxy()
+        wms_urls = [tile_proxy.proxy_url(url) for url in wms_urls]
+
+    # Create the JavaScript array initialization for URLs and inline layers
+    wfs_urls_js = json.dumps(wfs_urls).replace("</", "<\\/")
+    wms_urls_js = json.dumps(wms_urls).replace("</", "<\\/")
+    registry = get_registry()
+    site = registry.site(site_names[0] if site_names else None)
+    sites_js = json.dumps([
+        {'name': registry.site(name).get('name', name), 'longitude': registry.site(name)['longitude'],
+         'latitude': registry.site(name)['latitude']}
+        for name in site_names or ()
+    ])
+    report_url = telemetry.browser_report_url() if trace_id else None
+    report_js = json.dumps({'url': report_url, 'trace_id': trace_id})
 
     return f"""
     <!DOCTYPE html>
@@ -68,7 +114,7 @@ def create_map_html(wfs_urls, wms_urls):
 
           // Map view
           const view = new ol.View({{
-            center: ol.proj.fromLonLat([28.060564, -26.059083]),
+            center: ol.proj.fromLonLat([{site['longitude']}, {site['latitude']}]),
             zoom: 12
           }});
 
@@ -93,6 +139,32 @@ def create_map_html(wfs_urls, wms_urls):
           map.addLayer(wmsGroup);
           map.addLayer(wfsGroup);
 
+          // Mark the compared sites and open on all of them
+          const sites = {sites_js};
+          if (sites.length) {{
+            const siteSource = new ol.source.Vector({{
+              features: sites.map(site => new ol.Feature({{
+                geometry: new ol.geom.Point(ol.proj.fromLonLat([site.longitude, site.latitude])),
+                name: site.name
+              }}))
+            }});
+            map.addLayer(new ol.layer.Vector({{
+              title: 'Sites',
+              source: siteSource,
+              style: feature => new ol.style.Style({{
+                image: new ol.style.Circle({{
+                  radius: 6,
+                  fill: new ol.style.Fill({{color: 'rgba(20, 20, 20, 0.9)'}}),
+                  stroke: new ol.style.Stroke({{color: '#fff', width: 2}})
+                }}),
+                text: new ol.style.Text({{text: feature.get('name'), offsetY: -14}})
+              }})
+            }}));
+            if (sites.length > 1) {{
+              view.fit(siteSource.getExtent(), {{padding: [50, 50, 50, 50]}});
+            }}
+          }}
+
           // Add WMS layers
           const wmsUrls = {wms_urls_js};
           wmsUrls.forEach((url, index) => {{
@@ -100,7 +172,7 @@ def create_map_html(wfs_urls, wms_urls):
               source: new ol.source.TileWMS({{
                 url: url,
                 params: {{
-                  'LAYERS': url.includes('traffic') ? 'mtn:mtn_rivonia_geom_traffic' : 'mtn:mtn_rivonia_ff_dataset',
+                  'LAYERS': new URL(url, window.location.href).searchParams.get('layers'),
                   'TILED': true
                 }},
                 serverType: 'geoserver'
@@ -113,15 +185,38 @@ def create_map_html(wfs_urls, wms_urls):
           const wfsUrls = {wfs_urls_js};
           const colors = ['rgba(0, 0, 255, 0.2)', 'rgba(255, 0, 0, 0.2)'];
           
-          wfsUrls.forEach((url, index) => {{
-            fetch(url)
-              .then(response => response.json())
+          // Report WFS fetch and parse timings back to the app's telemetry endpoint
+          const report = {report_js};
+          const reportTiming = (stage, start, index, extra) => {{
+            if (!report.url || !navigator.sendBeacon) return;
+            navigator.sendBeacon(report.url, JSON.stringify(Object.assign({{
+              trace_id: report.trace_id,
+              stage: stage,
+              seconds: (performance.now() - start) / 1000,
+              layer: index
+            }}, extra || {{}})));
+          }};
+          
+          wfsUrls.forEach((source, index) => {{
+            const fetchStart = performance.now();
+            const load = typeof source === 'string'
+              ? fetch(source).then(response => response.json()).then(data => {{
+                  reportTiming('wfs_fetch', fetchStart, index);
+                  return data;
+                }})
+              : Promise.resolve(source);
+            load
               .then(data => {{
+                // Server-side layers arrive as simplified, quantized TopoJSON
+                const format = data.type === 'Topology' ? new ol.format.TopoJSON() : new ol.format.GeoJSON();
+                const parseStart = performance.now();
+                const features = format.readFeatures(data, {{
+                  featureProjection: 'EPSG:3857'
+                }});
+                reportTiming('wfs_parse', parseStart, index, {{features: features.length, format: data.type}});
                 const layer = new ol.layer.Vector({{
                   source: new ol.source.Vector({{
-                    features: new ol.format.GeoJSON().readFeatures(data, {{
-                      featureProjection: 'EPSG:3857'
-                    }})
+                    features: features
                   }}),
                   style: new ol.style.Style({{
                     fill: new ol.style.Fill({{
@@ -130,6 +225,12 @@ def create_map_html(wfs_urls, wms_urls):
                     stroke: new ol.style.Stroke({{
                       color: colors[index].replace('0.2', '1'),
                       width: 2
+                    }}),
+                    image: new ol.style.Circle({{
+                      radius: 6,
+                      fill: new ol.style.Fill({{
+                        color: colors[index].replace('0.2', '0.6')
+                      }})
                     }})
                   }})
                 }});
@@ -137,10 +238,12 @@ def create_map_html(wfs_urls, wms_urls):
                 
                 // Fit to the extent of all features
                 const extent = layer.getSource().getExtent();
-                map.getView().fit(extent, {{
-                  padding: [50, 50, 50, 50],
-                  duration: 1000
-                }});
+                if (!ol.extent.isEmpty(extent)) {{
+                  map.getView().fit(extent, {{
+                    padding: [50, 50, 50, 50],
+                    duration: 1000
+                  }});
+                }}
               }});
           }});
 
@@ -164,115 +267,315 @@ def create_map_html(wfs_urls, wms_urls):
     """
 
 def segregate_query(query):
-    """Use GPT-4 to segregate the query into traffic and footfall components"""
-    system_prompt = '''You are a query analysis expert specializing in separating mixed queries into distinct traffic and footfall components. 
-    Your task is to analyze a user query and split it into separate traffic-related and footfall-related queries while maintaining the original intent and parameters of each part.
-    
-    For traffic data, look for:
-    - "traffic density" or "avg_traffic_den"
-    - References to "roads" and "traffic"
-    - Numerical thresholds related to traffic (e.g., "> 8")
-    - Time periods specifically related to traffic
-    
-    For footfall data, look for:
-    - References to "visitors", "footfall", or "competitors"
-    - "ff_" or "ffc_" prefixed metrics
-    - Evening/morning/afternoon visitor patterns
-    - References to mall visitors or competitor locations
-    
-    Each component should maintain its own:
-    - Distance/radius conditions
-    - Time period specifications
-    - Numerical thresholds
-    
-    If a condition is ambiguous (like a number threshold), assign it based on nearby context words:
-    - If near traffic/roads/density words → traffic query
-    - If near footfall/visitors/mall words → footfall query
-    
-    Return ONLY a JSON with two keys: 'traffic_query' and 'footfall_query'. If either component is not present, set that key to null.
-    '''
-
-    prompt = f'''Analyze the following query and separate it into traffic and footfall components.
-    Maintain any radius/distance conditions, thresholds, and time periods specific to each component.
-    
-    Query: {query}
-    '''
-
-    client = OpenAI()
-    response = client.chat.completions.create(
-        model='gpt-4',
-        messages=[
-            {'role': 'system', 'content': system_prompt},
-            {'role': 'user', 'content': prompt}
-        ],
-        temperature=0.1
-    )
-
+    """Segregate the query into traffic and footfall components, reporting parse failures in the UI"""
     try:
-        # Parse the response using json.loads instead of eval
-        result = json.loads(response.choices[0].message.content)
-        return result
-    except Exception as e:
-        st.error(f"Error parsing query segregation response: {str(e)}")
+        return segregation.segregate_query(query)
+    except ValueError as e:
+        st.error(str(e))
         return {"traffic_query": None, "footfall_query": None}
 
-def process_query(query):
-    """Process the query and generate map with both WFS and WMS layers"""
+def _load_wfs_layer(url, dataset=None, spec=None):
+    """
+    Load a WFS layer server-side, sized for the browser: simplified TopoJSON for small results,
+    clustered points for large ones and nothing (WMS only) for very large ones.
+    Given the filter spec the URL was built from, a radius is applied as an exact distance
+    when the feature store holds the layer, rather than as the URL's bounding box.
+    Falls back to letting the browser fetch the URL if the server-side load fails.
+    Returns:
+        Tuple of (layer for create_map_html or None, notice for the user or None)
+    """
+    return _layer_flights.do(url, _fetch_wfs_layer, url, dataset, spec)
+
+def _fetch_wfs_layer(url, dataset=None, spec=None):
+    with telemetry.span("wfs_layer") as current:
+        try:
+            exact = cql.query_spec(dataset, spec) if spec and spec['radius_km'] else None
+            if exact is not None:
+                current.set(radius='exact')
+                layer = wfs_client.size_layer(*exact)
+            else:
+                layer = wfs_client.load_layer(url)
+        except Exception as e:
+            current.set(mode='browser', fallback_reason=str(e))
+            return url, None
+        current.set(mode=layer['mode'], features=layer['count'])
+
+    notice = None
+    if layer['mode'] == 'clustered':
+        notice = f"{layer['count']:,} features matched; showing them as clustered points."
+    elif layer['mode'] == 'wms':
+        notice = f"{layer['count']:,} features matched; showing the WMS layer only."
+    if layer['data'] is None:
+        return None, notice
+    with telemetry.span("simplify", features=len(layer['data']['features'])):
+        return simplify.encode_for_map(layer['data']), notice
+
+def _prepare_dataset(dataset, dataset_query, progress, site_names=None):
+    """
+    Stream the filter spec for one dataset, build its URLs and load its map layer; with
+    `site_names` the one spec is run at every listed site
+    """
+    def on_delta(text):
+        progress[dataset] = len(text)
+
+    with telemetry.span("dataset", dataset=dataset):
+        spec = get_filter_spec(dataset, dataset_query, on_delta=on_delta)
+        if site_names:
+            result = _build_sites_layer(dataset, spec, site_names)
+        else:
+            result = _build_dataset_layer(dataset, spec)
+        result['fallback'] = bool(spec.get('fallback'))
+        if result['fallback']:
+            notice = "The LLM is unavailable, so this filter was read from the query text and may be approximate."
+            result['notice'] = f"{notice} {result['notice']}" if result['notice'] else notice
+        return result
+
+def _build_dataset_layer(dataset, spec):
+    """URLs and map layer for one dataset's filter spec"""
+    if spec.get('aggregate'):
+        aggregated = rollups.query_spec(dataset, spec)
+        if aggregated is not None:
+            result = {'wfs': build_wfs_url(dataset, spec), 'wms': build_wms_url(dataset, spec)}
+            with telemetry.span("simplify", features=len(aggregated['features'])):
+                result['layer'] = simplify.encode_for_map(aggregated)
+            result['notice'] = f"{len(aggregated['features']):,} roads matched on their average over the selected days."
+            return result
+        # Without the local feature store there is nothing to average; filter the daily rows instead
+        spec = dict(spec, aggregate=False)
+    result = {'wfs': build_wfs_url(dataset, spec), 'wms': build_wms_url(dataset, spec)}
+    result['layer'], result['notice'] = _load_wfs_layer(result['wfs'], dataset, spec)
+    return result
+
+def _build_sites_layer(dataset, spec, site_names):
+    """Per-site URLs and match counts for one dataset's filter spec, and one map layer for all the sites"""
+    # Per-road averages come from a single layer's rollups; across sites the daily rows are filtered instead
+    if spec.get('aggregate'):
+        spec = dict(spec, aggregate=False)
+    fanned = sites.query_sites(dataset, spec, site_names)
+    result = {'sites': fanned['sites'], 'layer': None, 'map_wms': []}
+    features = [feature for layer in fanned['layers'] if layer['data'] is not None for feature in layer['data']['features']]
+    if features:
+        with telemetry.span("simplify", features=len(features)):
+            result['layer'] = simplify.encode_for_map({'type': 'FeatureCollection', 'features': features})
+    # Layers too large to send inline are drawn from their sites' WMS layers
+    for layer in fanned['layers']:
+        if layer['data'] is None:
+            result['map_wms'].extend(fanned['sites'][name]['wms'] for name in layer['sites'])
+    matched = sum(1 for site in fanned['sites'].values() if site['count'])
+    count = sum(layer['count'] for layer in fanned['layers'])
+    result['notice'] = f"{count:,} features matched at {matched} of {len(fanned['sites'])} sites."
+    approximate = [name for layer in fanned['layers'] if layer.get('approximate') for name in layer['sites']]
+    if approximate:
+        result['notice'] += (f" Too many features matched to download at {len(approximate)} sites, so their counts "
+                             f"cover the square around the radius rather than the circle.")
+    return result
+
+def _show_dataset_urls(dataset, entry):
+    """Show one dataset's generated URLs (or its error) in the query results"""
+    if 'error' in entry:
+        st.error(f"An error occurred: {entry['error']}")
+        return
+    st.success(f"{dataset.capitalize()} URLs Generated Successfully!")
+    st.subheader(f"Generated {dataset.capitalize()} URLs")
+    if 'sites' in entry:
+        registry = get_registry()
+        st.dataframe(pd.DataFrame([
+            {'Site': registry.site(name).get('name', name), 'Features': site['count'], 'WFS': site['wfs'], 'WMS': site['wms']}
+            for name, site in entry['sites'].items()
+        ]), hide_index=True)
+    else:
+        st.code(f"WFS: {entry['wfs']}\nWMS: {entry['wms']}")
+    if entry['notice']:
+        st.info(entry['notice'])
+    if entry.get('wfs'):
+        _show_export(dataset, entry['wfs'])
+
+def _show_export(dataset, wfs_url):
+    """
+    Export a dataset's WFS result to a file on disk in bounded chunks, then link to it on
+    the download server, which streams it from disk rather than through Streamlit's memory
+    """
+    with st.expander(f"Export {dataset} features"):
+        fmt = st.selectbox("Format", list(export.FORMATS), key=f"export_format_{dataset}",
+                           format_func=lambda name: {'parquet': 'GeoParquet', 'csv': 'CSV', 'csv.gz': 'CSV (gzip)'}[name])
+        exports = st.session_state.setdefault('exports', {})
+        if st.button("Prepare export", key=f"export_{dataset}"):
+            progress = st.empty()
+            try:
+                exports[(wfs_url, fmt)] = export.export_url(
+                    wfs_url, fmt, on_progress=lambda count: progress.caption(f"{count:,} features written")
+                )
+            except Exception as e:
+                st.error(f"Export failed: {e}")
+            progress.empty()
+        path = exports.get((wfs_url, fmt))
+        if path and os.path.exists(path):
+            try:
+                export.start_server()
+                link = export.download_url(path, f"{dataset}{export.FORMATS[fmt][0]}")
+            except (OSError, ValueError) as e:
+                st.warning(f"The download server is unavailable ({e}); the export was saved on the server as {os.path.abspath(path)}.")
+                return
+            st.link_button(f"Download {dataset}{export.FORMATS[fmt][0]} ({os.path.getsize(path) / 2 ** 20:.1f} MB)", link)
+
+def _remember_result(result):
+    """Keep a query's result in the session's history, newest last, and make it the one shown"""
+    results = st.session_state.setdefault('results', {})
+    results.pop(result['key'], None)
+    results[result['key']] = result
+    while len(results) > HISTORY_SIZE:
+        results.pop(next(iter(results)))
+    st.session_state['current_result'] = result['key']
+    for dataset, entry in result['datasets'].items():
+        st.session_state[f"{dataset}_wfs_url"] = entry.get('wfs')
+        st.session_state[f"{dataset}_wms_url"] = entry.get('wms')
+
+def show_result(result):
+    """Re-display a remembered result without calling the LLM or rebuilding the map"""
+    st.caption(f"Showing saved results for: {result['query']}"
+               + (f" ({len(result['sites'])} sites)" if result.get('sites') else ""))
+    if result.get('warning'):
+        st.warning(result['warning'])
+    for dataset, entry in result['datasets'].items():
+        _show_dataset_urls(dataset, entry)
+    if result['map_html']:
+        st.subheader("Geographic Visualization")
+        st.components.v1.html(result['map_html'], height=600)
+
+def result_key(query, site_names=None):
+    """Session history key of a query, run at the default site or at the given sites"""
+    key = normalize_query(query)
+    return f"{key} @ {','.join(site_names)}" if site_names else key
+
+def process_query(query, site_names=None):
+    """
+    Process the query and generate map with both WFS and WMS layers. Each dataset's URLs and
+    layer are shown as soon as that dataset is ready; the map is redrawn as the other arrives.
+    Args:
+        site_names: Sites to compare; the query is interpreted once and its filters run at
+            every site. None for the default site alone.
+    Returns:
+        The result remembered for the session: the segregated queries, each dataset's URLs
+        (or error) and the final map HTML
+    """
+    result = {'key': result_key(query, site_names), 'query': query, 'sites': site_names,
+              'segregated': None, 'datasets': {}, 'map_html': None}
     try:
-        with st.spinner("Analyzing query..."):
-            segregated_queries = segregate_query(query)
-            wfs_urls = []
-            wms_urls = []
-            
-            # Process traffic query if present
-            if segregated_queries['traffic_query']:
-                with st.spinner("Processing traffic data..."):
-                    # Generate WFS URL
-                    traffic_wfs_url = get_traffic_url(segregated_queries['traffic_query'])
-                    wfs_urls.append(traffic_wfs_url)
-                    st.session_state.traffic_wfs_url = traffic_wfs_url
-                    
-                    # Generate WMS URL
-                    traffic_wms_url = get_wms_traffic_url(segregated_queries['traffic_query'])
-                    wms_urls.append(traffic_wms_url)
-                    st.session_state.traffic_wms_url = traffic_wms_url
-                    
-                    st.success("Traffic URLs Generated Successfully!")
-                    st.subheader("Generated Traffic URLs")
-                    st.code(f"WFS: {traffic_wfs_url}\nWMS: {traffic_wms_url}")
-            
-            # Process footfall query if present
-            if segregated_queries['footfall_query']:
-                with st.spinner("Processing footfall data..."):
-                    # Generate WFS URL
-                    footfall_wfs_url = get_footfall_url(segregated_queries['footfall_query'])
-                    wfs_urls.append(footfall_wfs_url)
-                    st.session_state.footfall_wfs_url = footfall_wfs_url
-                    
-                    # Generate WMS URL
-                    footfall_wms_url = get_footfall_wms_url(segregated_queries['footfall_query'])
-                    wms_urls.append(footfall_wms_url)
-                    st.session_state.footfall_wms_url = footfall_wms_url
-                    
-                    st.success("Footfall URLs Generated Successfully!")
-                    st.subheader("Generated Footfall URLs")
-                    st.code(f"WFS: {footfall_wfs_url}\nWMS: {footfall_wms_url}")
-            
-            # Generate map if we have any URLs
-            if wfs_urls or wms_urls:
-                st.subheader("Geographic Visualization")
-                # map_html = create_map_html(wfs_urls, wms_urls)
-                # st.components.v1.html(map_html, height=600)
-                map_html = create_map_html(wfs_urls, wms_urls)
-                st.components.v1.html(map_html, height=600)
-            
-            # If neither query was generated
-            if not (segregated_queries['traffic_query'] or segregated_queries['footfall_query']):
-                st.warning("Could not identify any specific traffic or footfall related queries. Please rephrase your query.")
-                    
+        with telemetry.span("process_query") as trace:
+            st.session_state['last_trace_id'] = trace.trace_id
+            with st.spinner("Analyzing query..."):
+                segregated_queries = segregate_query(query)
+            result['segregated'] = segregated_queries
+
+            datasets = [dataset for dataset in ('traffic', 'footfall') if segregated_queries.get(f"{dataset}_query")]
+            if not datasets:
+                result['warning'] = "Could not identify any specific traffic or footfall related queries. Please rephrase your query."
+                st.warning(result['warning'])
+                _remember_result(result)
+                return result
+
+            progress = {dataset: 0 for dataset in datasets}
+            futures = {
+                _executor.submit(telemetry.propagate(_prepare_dataset), dataset, segregated_queries[f"{dataset}_query"], progress, site_names): dataset
+                for dataset in datasets
+            }
+
+            status = st.empty()
+            url_sections = st.container()
+            map_header = st.empty()
+            map_slot = st.empty()
+
+            completed = {}
+            deadline = time.monotonic() + LLM_TIMEOUT
+            pending = set(futures)
+            with st.spinner("Processing traffic and footfall data..."):
+                while pending:
+                    done, pending = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        dataset = futures[future]
+                        try:
+                            prepared = future.result()
+                        except Exception as e:
+                            result['datasets'][dataset] = {'error': str(e)}
+                            with url_sections:
+                                _show_dataset_urls(dataset, result['datasets'][dataset])
+                            continue
+
+                        result['datasets'][dataset] = {
+                            key: prepared[key] for key in ('wfs', 'wms', 'sites', 'notice', 'fallback') if key in prepared
+                        }
+                        with url_sections:
+                            _show_dataset_urls(dataset, result['datasets'][dataset])
+                        completed[dataset] = prepared
+
+                        # Redraw the map with every dataset finished so far, in a stable order
+                        ready = [completed[name] for name in datasets if name in completed]
+                        map_header.subheader("Geographic Visualization")
+                        with telemetry.span("map_html", datasets=len(ready)):
+                            result['map_html'] = create_map_html(
+                                [item['layer'] for item in ready if item['layer'] is not None],
+                                [url for item in ready for url in item.get('map_wms', [item.get('wms')])],
+                                trace_id=trace.trace_id,
+                                site_names=site_names,
+                            )
+                        with map_slot.container():
+                            st.components.v1.html(result['map_html'], height=600)
+
+                    if pending and time.monotonic() > deadline:
+                        for future in pending:
+                            result['datasets'][futures[future]] = {'error': f"Timed out after {LLM_TIMEOUT:g}s preparing the {futures[future]} filter and map layer"}
+                            with url_sections:
+                                _show_dataset_urls(futures[future], result['datasets'][futures[future]])
+                        break
+                    if pending:
+                        status.caption(" | ".join(
+                            f"{futures[future].capitalize()}: receiving filter ({progress[futures[future]]} chars)"
+                            for future in pending
+                        ))
+            status.empty()
+
     except Exception as e:
         st.error(f"An error occurred: {str(e)}")
-    
+        result['error'] = str(e)
+    # Keep datasets in a stable order for re-display
+    result['datasets'] = {dataset: result['datasets'][dataset] for dataset in ('traffic', 'footfall') if dataset in result['datasets']}
+    _remember_result(result)
+    return result
+
+def _select_result(key):
+    st.session_state['current_result'] = key
+
+def _clear_history():
+    st.session_state['results'] = {}
+    st.session_state['current_result'] = None
+
+def show_history_panel():
+    """Sidebar list of this session's past queries; picking one re-displays its saved result"""
+    results = st.session_state.get('results') or {}
+    st.sidebar.subheader("Query History")
+    if not results:
+        st.sidebar.caption("Analyzed queries appear here.")
+        return
+    for key, result in reversed(list(results.items())):
+        label = result['query'] if len(result['query']) <= 60 else result['query'][:57] + "..."
+        st.sidebar.button(label, key=f"history_{key}", on_click=_select_result, args=(key,),
+                          disabled=key == st.session_state.get('current_result'), use_container_width=True)
+    st.sidebar.button("Clear history", on_click=_clear_history)
+
+def show_debug_panel():
+    """Show the stage timings of the last query; browser timings appear on the next rerun"""
+    trace_id = st.session_state.get('last_trace_id')
+    with st.expander("Performance debug", expanded=True):
+        spans = telemetry.trace_spans(trace_id) if trace_id else []
+        if not spans:
+            st.caption("No timings recorded yet.")
+        else:
+            frame = pd.DataFrame(spans)
+            frame['start'] = frame['start'] - frame['start'].min()
+            frame = frame.drop(columns=['trace_id', 'span_id', 'parent_id'])
+            st.dataframe(frame, use_container_width=True)
+        st.code(telemetry.metrics.render(), language='text')
+
 def main():
     # Try to load logo
     try:
@@ -282,6 +585,10 @@ def main():
         pass
 
     st.title("GeoInt Analysis Dashboard")
+    telemetry.start_server()
+    # Fetch layer statistics for the prompts now rather than on the first query
+    get_registry().warm()
+    show_debug = st.sidebar.checkbox("Show performance debug panel", value=False)
 
     # Initialize session state
     for key in ['traffic_wfs_url', 'traffic_wms_url', 'footfall_wfs_url', 'footfall_wms_url']:
@@ -296,10 +603,36 @@ def main():
         help="Enter your query to analyze traffic and/or footfall data"
     )
 
+    # Comparing several sites interprets the query once and runs its filters at each of them
+    registry = get_registry()
+    site_names = None
+    if len(registry.sites) > 1:
+        selected = st.sidebar.multiselect(
+            "Sites", list(registry.sites), default=[registry.default_site],
+            format_func=lambda name: registry.site(name).get('name', name),
+        )
+        if selected and selected != [registry.default_site]:
+            site_names = selected
+
+    results = st.session_state.setdefault('results', {})
     if st.button("Analyze Data"):
-        process_query(query)
+        saved = results.get(result_key(query, site_names))
+        # Results with errors or rule-based fallback filters are recomputed; everything else is shown from the session
+        if saved is not None and not saved.get('error') and not any(
+                'error' in entry or entry.get('fallback') for entry in saved['datasets'].values()):
+            _remember_result(saved)
+            show_result(saved)
+        else:
+            process_query(query, site_names)
+    elif st.session_state.get('current_result') in results:
+        # Reruns from other widgets re-display the current result instead of recomputing it
+        show_result(results[st.session_state['current_result']])
     else:
         st.info("Enter a query and click 'Analyze Data' to begin analysis")
 
+    show_history_panel()
+    if show_debug:
+        show_debug_panel()
+
 if __name__ == "__main__":
     main()
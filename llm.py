@@ -0,0 +1,255 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import httpx
+import openai
+from dotenv import load_dotenv
+from openai import OpenAI, DefaultHttpxClient
+import telemetry
+from ratelimit import RateLimiter
+import resilience
+
+# Settings below may come from .env, which the app loads after importing this module
+load_dotenv()
+
+# Connection pool and retry settings for the shared OpenAI client
+LLM_POOL_SIZE = int(os.getenv("GEOINT_LLM_POOL_SIZE", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("GEOINT_LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("GEOINT_LLM_CONNECT_TIMEOUT", "5"))
+LLM_REQUEST_TIMEOUT = float(os.getenv("GEOINT_LLM_REQUEST_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("GEOINT_LLM_MAX_RETRIES", "2"))
+
+# Seconds a completion may take overall, across retries and hedged requests
+LLM_DEADLINE = float(os.getenv("GEOINT_LLM_DEADLINE", "30"))
+# Send a duplicate request once the first has taken longer than this quantile of recent
+# latencies (time to first chunk when streaming); 0 disables hedging
+LLM_HEDGE_QUANTILE = float(os.getenv("GEOINT_LLM_HEDGE_QUANTILE", "0.9"))
+# Consecutive failed attempts that open the circuit, and seconds it stays open
+LLM_BREAKER_FAILURES = int(os.getenv("GEOINT_LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET = float(os.getenv("GEOINT_LLM_BREAKER_RESET", "30"))
+
+# Point at a local OpenAI-compatible endpoint (e.g. a mock server) instead of api.openai.com
+LLM_BASE_URL = os.getenv("GEOINT_LLM_BASE_URL") or None
+
+# Optional client-side caps; the OpenAI rate-limit headers are honoured either way
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("GEOINT_LLM_REQUESTS_PER_MINUTE", "0")) or None
+LLM_TOKENS_PER_MINUTE = int(os.getenv("GEOINT_LLM_TOKENS_PER_MINUTE", "0")) or None
+
+_client = None
+_client_lock = threading.Lock()
+
+rate_limiter = RateLimiter(LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE)
+latencies = resilience.LatencyTracker()
+breaker = resilience.CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET)
+
+# Attempts run here so a hedged duplicate can race the original
+_attempts = ThreadPoolExecutor(max_workers=LLM_POOL_SIZE * 2, thread_name_prefix='llm')
+
+# Failures worth retrying: the provider is slow, overloaded or unreachable
+RETRYABLE_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+class LLMUnavailable(RuntimeError):
+    """Raised when the provider can't produce a completion in time; callers fall back where they can"""
+
+class _Superseded(Exception):
+    """Ends a streamed attempt once another attempt has started delivering text"""
+
+def _observe_response(response):
+    rate_limiter.update(response.headers, response.status_code)
+
+def create_client(base_url=LLM_BASE_URL, pool_size=LLM_POOL_SIZE, timeout=LLM_REQUEST_TIMEOUT,
+                  max_retries=0):
+    """
+    Create an OpenAI client backed by a keep-alive connection pool
+    Args:
+        base_url: API endpoint, or None for the OpenAI default / OPENAI_BASE_URL
+        pool_size: Maximum number of pooled connections
+        timeout: Seconds a request may take before it is abandoned
+        max_retries: Retries inside the SDK; none by default, since complete() retries
+            within its deadline itself
+    """
+    http_client = DefaultHttpxClient(
+        limits=httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(timeout, connect=LLM_CONNECT_TIMEOUT),
+        event_hooks={'response': [_observe_response]},
+    )
+    return OpenAI(
+        base_url=base_url,
+        timeout=httpx.Timeout(timeout, connect=LLM_CONNECT_TIMEOUT),
+        max_retries=max_retries,
+        http_client=http_client,
+    )
+
+def get_client():
+    """Return the process-wide OpenAI client, creating it on first use"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = create_client()
+        return _client
+
+def set_client(client):
+    """Replace the process-wide client, e.g. with one pointed at a mock endpoint"""
+    global _client
+    with _client_lock:
+        _client = client
+
+class _DeltaChannel:
+    """Forwards streamed text to the caller from whichever attempt delivers text first"""
+
+    def __init__(self, on_delta):
+        self.on_delta = on_delta
+        self.owner = None
+        self._lock = threading.Lock()
+
+    def claim(self, attempt):
+        with self._lock:
+            if self.owner is None:
+                self.owner = attempt
+            return self.owner is attempt
+
+def _attempt(model, messages, temperature, channel, stop_at, kwargs):
+    """
+    One request to the provider, bounded by the call's deadline
+    Returns:
+        Tuple of (content, latency), the latency being time to first chunk when streaming
+    """
+    # Roughly four characters per token is close enough for pacing
+    rate_limiter.acquire(sum(len(message['content']) for message in messages) // 4)
+    timeout = stop_at - time.monotonic()
+    if timeout <= 0:
+        raise resilience.DeadlineExceeded("LLM deadline passed while waiting for the rate limiter")
+    start = time.monotonic()
+    if channel is None:
+        response = get_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            timeout=timeout,
+            **kwargs
+        )
+        if response.usage:
+            telemetry.record_tokens(model, response.usage.prompt_tokens, response.usage.completion_tokens)
+        return response.choices[0].message.content, time.monotonic() - start
+
+    # The final chunk carries token usage and no choices
+    kwargs = dict(kwargs)
+    kwargs.setdefault('stream_options', {'include_usage': True})
+    stream = get_client().chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        stream=True,
+        timeout=timeout,
+        **kwargs
+    )
+    content = ''
+    first_chunk = None
+    token = object()
+    try:
+        for chunk in stream:
+            if first_chunk is None:
+                first_chunk = time.monotonic() - start
+            if chunk.choices and chunk.choices[0].delta.content:
+                if not channel.claim(token):
+                    raise _Superseded()
+                content += chunk.choices[0].delta.content
+                channel.on_delta(content)
+            if getattr(chunk, 'usage', None):
+                telemetry.record_tokens(model, chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+    finally:
+        # Stops a superseded stream from running (and billing) to the end
+        stream.response.close()
+    return content, first_chunk if first_chunk is not None else time.monotonic() - start
+
+def _hedged(model, messages, temperature, on_delta, stop_at, current, kwargs):
+    """
+    Run one attempt, adding a duplicate if it is slower than usual, and return the first
+    content to arrive. Raises the first attempt's error if every attempt fails.
+    """
+    key = (model, on_delta is not None)
+    channel = _DeltaChannel(on_delta) if on_delta is not None else None
+    hedge_after = latencies.quantile(key, LLM_HEDGE_QUANTILE) if LLM_HEDGE_QUANTILE else None
+    submit = lambda: _attempts.submit(telemetry.propagate(_attempt), model, messages, temperature, channel, stop_at, kwargs)
+    start = time.monotonic()
+    futures = {submit(): 'first'}
+    hedged = False
+    errors = []
+    while futures:
+        now = time.monotonic()
+        if now >= stop_at:
+            raise resilience.DeadlineExceeded("No LLM response within the deadline")
+        timeout = stop_at - now
+        hedge_due = hedge_after is not None and not hedged
+        if hedge_due:
+            timeout = max(0.0, min(timeout, start + hedge_after - now))
+        done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            if hedge_due and time.monotonic() >= start + hedge_after:
+                hedged = True
+                # A stream that has started delivering text is not worth duplicating
+                if channel is None or channel.owner is None:
+                    current.set(hedged=True)
+                    futures[submit()] = 'hedge'
+            continue
+        for future in done:
+            label = futures.pop(future)
+            try:
+                content, latency = future.result()
+            except _Superseded:
+                continue
+            except Exception as e:
+                errors.append(e)
+                continue
+            latencies.record(key, latency)
+            if label == 'hedge':
+                current.set(hedge_won=True)
+            return content
+    raise errors[0]
+
+def complete(model, system_prompt, prompt, temperature, on_delta=None, deadline=LLM_DEADLINE, **kwargs):
+    """
+    Run a chat completion on the shared client and return the message content. Slow
+    requests are hedged with a duplicate, failed ones retried with jittered backoff, all
+    within `deadline` seconds; while the provider keeps failing the circuit breaker
+    refuses calls straight away.
+    Args:
+        on_delta: Optional callback; when given the completion is streamed and the callback
+            receives the accumulated text after every chunk
+    Raises:
+        LLMUnavailable: the deadline passed, retries ran out or the circuit is open
+    """
+    messages = [
+        {'role': 'system', 'content': system_prompt},
+        {'role': 'user', 'content': prompt}
+    ]
+    stop_at = time.monotonic() + deadline
+    with telemetry.span("llm", model=model, streamed=on_delta is not None) as current:
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            if not breaker.allow():
+                current.set(circuit='open')
+                raise LLMUnavailable("LLM provider is failing; not calling it for now")
+            try:
+                content = _hedged(model, messages, temperature, on_delta, stop_at, current, kwargs)
+            except resilience.DeadlineExceeded as e:
+                breaker.record_failure()
+                raise LLMUnavailable(f"No LLM response within {deadline:g}s") from e
+            except RETRYABLE_ERRORS as e:
+                breaker.record_failure()
+                current.set(retries=attempt)
+                delay = resilience.backoff(attempt)
+                if attempt == LLM_MAX_RETRIES or time.monotonic() + delay >= stop_at:
+                    raise LLMUnavailable(f"LLM request failed: {e}") from e
+                time.sleep(delay)
+                continue
+            except Exception:
+                # A rejected request or a failing on_delta callback; let the next call be the trial
+                breaker.release()
+                raise
+            breaker.record_success()
+            return content
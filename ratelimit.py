@@ -0,0 +1,106 @@
+import re
+import threading
+import time
+
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+def parse_duration(text):
+    """Seconds in an OpenAI reset header such as '1s', '6m0s' or '20ms'; None if unparseable"""
+    if not text:
+        return None
+    parts = DURATION_PART.findall(text)
+    if not parts:
+        try:
+            return float(text)
+        except ValueError:
+            return None
+    return sum(float(value) * DURATION_UNITS[unit] for value, unit in parts)
+
+class RateLimiter:
+    """
+    Client-side limiter for LLM requests. Optional local caps (requests and tokens per minute)
+    are enforced as token buckets; on top of that the x-ratelimit-* headers of every response
+    tell it how much of the server's budget is left, and once less than `low_water` of it
+    remains, requests are spread evenly over the time until the server's window resets.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, low_water=0.1):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.low_water = low_water
+        self._request_budget = float(requests_per_minute or 0)
+        self._token_budget = float(tokens_per_minute or 0)
+        self._refilled_at = time.monotonic()
+        self._next_request_at = 0.0
+        self._interval = 0.0
+        self._tokens_blocked_until = 0.0
+        self._lock = threading.Lock()
+        self.waited = 0.0
+
+    def _refill(self, now):
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        if self.requests_per_minute:
+            self._request_budget = min(self.requests_per_minute, self._request_budget + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._token_budget = min(self.tokens_per_minute, self._token_budget + elapsed * self.tokens_per_minute / 60)
+
+    def _delay(self, tokens, now):
+        """Seconds until a request of `tokens` may start, or 0 after reserving it"""
+        self._refill(now)
+        waits = [self._next_request_at - now, self._tokens_blocked_until - now]
+        if self.requests_per_minute and self._request_budget < 1:
+            waits.append((1 - self._request_budget) * 60 / self.requests_per_minute)
+        if self.tokens_per_minute and self._token_budget < min(tokens, self.tokens_per_minute):
+            waits.append((min(tokens, self.tokens_per_minute) - self._token_budget) * 60 / self.tokens_per_minute)
+        delay = max(waits)
+        if delay > 0:
+            return delay
+        if self.requests_per_minute:
+            self._request_budget -= 1
+        if self.tokens_per_minute:
+            self._token_budget -= tokens
+        self._next_request_at = now + self._interval
+        return 0
+
+    def acquire(self, tokens=0):
+        """Block until a request estimated at `tokens` tokens may be sent"""
+        while True:
+            with self._lock:
+                delay = self._delay(tokens, time.monotonic())
+                if delay <= 0:
+                    return
+                self.waited += delay
+            time.sleep(delay)
+
+    def update(self, headers, status_code=200):
+        """Adjust pacing from a response's rate-limit headers"""
+        try:
+            self._update(headers, status_code, time.monotonic())
+        except (TypeError, ValueError):
+            # Malformed headers; keep the current pacing
+            pass
+
+    def _update(self, headers, status_code, now):
+        with self._lock:
+            if status_code == 429:
+                retry_after = parse_duration(headers.get('retry-after')) or parse_duration(headers.get('x-ratelimit-reset-requests')) or 1.0
+                self._next_request_at = max(self._next_request_at, now + retry_after)
+
+            limit = headers.get('x-ratelimit-limit-requests')
+            remaining = headers.get('x-ratelimit-remaining-requests')
+            reset = parse_duration(headers.get('x-ratelimit-reset-requests'))
+            if limit and remaining is not None and reset is not None:
+                remaining = int(remaining)
+                if remaining < int(limit) * self.low_water:
+                    self._interval = reset / max(remaining, 1)
+                else:
+                    self._interval = 0.0
+
+            remaining_tokens = headers.get('x-ratelimit-remaining-tokens')
+            reset_tokens = parse_duration(headers.get('x-ratelimit-reset-tokens'))
+            token_limit = headers.get('x-ratelimit-limit-tokens')
+            if remaining_tokens is not None and reset_tokens is not None and token_limit:
+                if int(remaining_tokens) < int(token_limit) * self.low_water:
+                    self._tokens_blocked_until = max(self._tokens_blocked_until, now + reset_tokens)
@@ -0,0 +1,86 @@
+import random
+import threading
+import time
+from collections import deque
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a call has used up its deadline"""
+
+def backoff(attempt, base=0.5, cap=8.0):
+    """Full-jitter exponential backoff: a random delay up to base * 2**attempt, capped"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+class LatencyTracker:
+    """Recent successful call latencies per key, for picking hedge delays"""
+
+    def __init__(self, window=200, min_samples=20):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, key, seconds):
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def quantile(self, key, q):
+        """The q-quantile of the recent latencies, or None until there are enough of them"""
+        with self._lock:
+            samples = sorted(self._samples.get(key) or ())
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+class CircuitBreaker:
+    """
+    Fails fast once a dependency keeps failing: after `failure_threshold` consecutive
+    failures the circuit opens and calls are refused for `reset_timeout` seconds, then a
+    single trial call is let through; its success closes the circuit, its failure reopens it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = 'closed'
+        self.failures = 0
+        self.opened = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may go ahead now"""
+        with self._lock:
+            if self.state == 'open' and self.clock() - self._opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                self._trial = False
+            if self.state == 'closed':
+                return True
+            if self.state == 'half_open' and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.failure_threshold):
+                self.state = 'open'
+                self.opened += 1
+                self._opened_at = self.clock()
+                self._trial = False
+
+    def release(self):
+        """End a call that says nothing about the dependency's health, freeing the half-open trial"""
+        with self._lock:
+            self._trial = False
@@ -0,0 +1,336 @@
+import json
+import os
+import shutil
+import threading
+import time
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+import cql
+from feature_store import FEATURE_STORE_DIR, LayerData, get_store, take_geometries
+from filter_spec import DATASETS, MALL_LATITUDE, MALL_LONGITUDE, render_cql
+import spatial
+import telemetry
+
+load_dotenv()
+
+# Set to 0 to answer aggregate queries by scanning the stored daily rows instead
+ROLLUPS_ENABLED = os.getenv("GEOINT_ROLLUPS", "1") != "0"
+
+# Each rollup and the columns it is grouped by; 'segment' identifies a road
+ROLLUPS = {
+    'segment': ['segment'],
+    'day_of_week': ['segment', 'day'],
+    'week': ['segment', 'week'],
+}
+
+def _parse_timestamps(column):
+    """Timestamps as UTC instants however the store spells them"""
+    if pd.api.types.is_datetime64_any_dtype(column):
+        return pd.to_datetime(column, utc=True)
+    return pd.to_datetime(column.astype(str).str.rstrip('Z'), format='ISO8601', errors='coerce', utc=True)
+
+def segment_ids(layer, attribute=None):
+    """
+    Identify the road each row belongs to: by an id attribute when the layer has one,
+    otherwise by a fingerprint of the geometry (first and last vertex plus vertex count),
+    which is the same on every daily row of a road
+    """
+    if attribute:
+        return pd.util.hash_pandas_object(layer.attributes[attribute], index=False).to_numpy()
+    geometry = layer.geometry
+    coords = np.asarray(geometry['coords'])
+    starts = geometry['ring_offsets'][geometry['part_offsets'][geometry['geom_offsets'][:-1]]]
+    ends = geometry['ring_offsets'][geometry['part_offsets'][geometry['geom_offsets'][1:]]]
+    last = max(len(coords) - 1, 0)
+    first_vertex = coords[np.minimum(starts, last)] if len(coords) else np.zeros((len(starts), 2))
+    last_vertex = coords[np.clip(ends - 1, 0, last)] if len(coords) else np.zeros((len(starts), 2))
+    fingerprint = pd.DataFrame({
+        'x1': first_vertex[:, 0], 'y1': first_vertex[:, 1],
+        'x2': last_vertex[:, 0], 'y2': last_vertex[:, 1],
+        'n': ends - starts,
+    })
+    return pd.util.hash_pandas_object(fingerprint, index=False).to_numpy()
+
+def _rows(layer, config, indices):
+    """Daily rows to aggregate: segment, day of week, week start, timestamp, fid and the measures"""
+    rollup_config = config['rollups']
+    attributes = layer.attributes.iloc[indices]
+    timestamps = _parse_timestamps(attributes[config['time_attribute']])
+    frame = pd.DataFrame({
+        'segment': segment_ids(layer, rollup_config.get('segment_attribute'))[indices],
+        'fid': attributes['fid'].to_numpy(),
+        'ts': timestamps.dt.tz_convert(None).to_numpy(),
+    })
+    if config['day_attribute']:
+        frame['day'] = attributes[config['day_attribute']].astype(str).str.capitalize().to_numpy()
+    else:
+        frame['day'] = timestamps.dt.day_name().to_numpy()
+    # Weeks start on Monday and are named by that date
+    frame['week'] = (timestamps.dt.normalize() - pd.to_timedelta(timestamps.dt.weekday, unit='D')).dt.strftime('%Y-%m-%d').to_numpy()
+    for measure in rollup_config['measures']:
+        frame[measure] = pd.to_numeric(attributes[measure], errors='coerce').to_numpy()
+    return frame
+
+def _partials(frame, keys, measures):
+    """Sums and counts of each measure per group, plus the latest row of the group"""
+    aggregations = {}
+    for measure in measures:
+        aggregations[f"{measure}_sum"] = (measure, 'sum')
+        aggregations[f"{measure}_count"] = (measure, 'count')
+    aggregations['rows'] = ('fid', 'size')
+    aggregations['last_ts'] = ('ts', 'last')
+    aggregations['fid'] = ('fid', 'last')
+    return frame.sort_values('ts', kind='stable').groupby(keys, sort=False).agg(**aggregations).reset_index()
+
+def _combine(tables, keys):
+    """Merge partial aggregates of the same groups; sums and counts add up, the latest row wins"""
+    frame = pd.concat([table for table in tables if table is not None], ignore_index=True)
+    additive = [column for column in frame.columns if column.endswith(('_sum', '_count')) or column == 'rows']
+    aggregations = {column: (column, 'sum') for column in additive}
+    aggregations['last_ts'] = ('last_ts', 'last')
+    aggregations['fid'] = ('fid', 'last')
+    return frame.sort_values('last_ts', kind='stable').groupby(keys, sort=False).agg(**aggregations).reset_index()
+
+def _negate(table):
+    """
+    Partials that cancel `table` when combined with it; their latest row is left empty so
+    _combine keeps the group's latest row from the remaining tables
+    """
+    table = table.copy()
+    for column in table.columns:
+        if column.endswith(('_sum', '_count')) or column == 'rows':
+            table[column] = -table[column]
+    table['last_ts'] = pd.NaT
+    table['fid'] = None
+    return table
+
+def _to_layer(table, layer, measures):
+    """
+    Turn aggregates into a LayerData with one feature per group, drawn with the geometry of
+    the group's latest row, so it can be filtered and serialized like any stored layer
+    """
+    indices = pd.Index(layer.attributes['fid']).get_indexer(table['fid'])
+    table = table[indices >= 0]
+    indices = indices[indices >= 0]
+
+    attributes = pd.DataFrame({'fid': table['fid'].to_numpy()})
+    for column in ('day', 'week'):
+        if column in table:
+            attributes[column] = table[column].to_numpy()
+    for measure, how in measures.items():
+        sums = table[f"{measure}_sum"].to_numpy(dtype=float)
+        if how == 'mean':
+            counts = table[f"{measure}_count"].to_numpy(dtype=float)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                attributes[measure] = np.where(counts > 0, sums / counts, np.nan)
+        else:
+            attributes[measure] = sums
+    attributes['days'] = table['rows'].to_numpy()
+    return LayerData(layer.type_name, attributes, take_geometries(layer.geometry, indices))
+
+class Rollups:
+    """
+    Per-road, per-road-and-day-of-week and per-road-and-week aggregates of a daily layer,
+    kept next to the feature store as sums and counts so new days are folded in without
+    rescanning the old ones. The partials of the latest (watermark) day are kept too, so a
+    refresh that replaces that day's rows swaps its contribution rather than adding to it.
+    """
+
+    def __init__(self, dataset, store=None, root=FEATURE_STORE_DIR):
+        self.dataset = dataset
+        self.config = DATASETS[dataset]
+        self.type_name = self.config['type_name']
+        self.measures = self.config['rollups']['measures']
+        self.store = store or get_store()
+        self.path = os.path.join(root, f"{self.type_name.replace(':', '_')}_rollups")
+        self.tables = {}
+        self.watermark = None
+        self.watermark_tables = {}
+        self._source = None
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        meta_path = os.path.join(self.path, 'meta.json')
+        if not os.path.exists(meta_path):
+            return
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if not all(os.path.exists(os.path.join(self.path, f"{name}_watermark.parquet")) for name in ROLLUPS):
+            # Written before the watermark day's partials were kept; rebuilt on the next update
+            return
+        self.watermark = meta.get('watermark')
+        self.tables = {name: pd.read_parquet(os.path.join(self.path, f"{name}.parquet")) for name in ROLLUPS}
+        self.watermark_tables = {
+            name: pd.read_parquet(os.path.join(self.path, f"{name}_watermark.parquet")) for name in ROLLUPS
+        }
+
+    def _save(self):
+        tmp_dir = f"{self.path}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for name, table in self.tables.items():
+            table.to_parquet(os.path.join(tmp_dir, f"{name}.parquet"), index=False)
+            self.watermark_tables[name].to_parquet(os.path.join(tmp_dir, f"{name}_watermark.parquet"), index=False)
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump({'watermark': self.watermark, 'updated_at': time.time()}, f)
+
+        old_dir = f"{self.path}.old"
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if os.path.exists(self.path):
+            os.replace(self.path, old_dir)
+        os.replace(tmp_dir, self.path)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    def update(self, rebuild=False):
+        """
+        Fold rows added to the feature store since the last update into the rollups: rows after
+        the watermark, plus the watermark day's rows again, replacing what that day contributed
+        last time (a refresh may have added to or rewritten it)
+        Returns:
+            Number of daily rows aggregated
+        """
+        with self._lock:
+            layer = self.store.load(self.type_name)
+            if layer is None:
+                return 0
+            if rebuild:
+                self.tables, self.watermark, self.watermark_tables = {}, None, {}
+
+            timestamps = _parse_timestamps(layer.attributes[self.config['time_attribute']])
+            new = timestamps.notna().to_numpy()
+            if self.watermark:
+                new = new & (timestamps >= pd.Timestamp(self.watermark)).to_numpy()
+
+            indices = np.flatnonzero(new)
+            if len(indices):
+                frame = _rows(layer, self.config, indices)
+                latest = timestamps.max()
+                on_latest = frame['ts'] == latest.tz_convert(None)
+                for name, keys in ROLLUPS.items():
+                    replaced = self.watermark_tables.get(name)
+                    combined = _combine([
+                        self.tables.get(name),
+                        _negate(replaced) if replaced is not None else None,
+                        _partials(frame, keys, self.measures),
+                    ], keys)
+                    self.tables[name] = combined[combined['rows'] > 0].reset_index(drop=True)
+                    self.watermark_tables[name] = _partials(frame[on_latest], keys, self.measures)
+                self.watermark = latest.isoformat()
+                self._save()
+            self._source = layer
+            return len(indices)
+
+    def current(self):
+        """Bring the rollups up to date if the feature store has been refreshed since the last look"""
+        layer = self.store.load(self.type_name)
+        if layer is not None and layer is not self._source:
+            self.update()
+        return layer
+
+    def answer(self, spec):
+        """
+        Per-road aggregates for the spec's days or time range, from the rollup that covers them
+        Returns:
+            Tuple of (LayerData, rollup name), or None if no rollup can answer the spec
+        """
+        layer = self.current()
+        if layer is None or not self.tables:
+            return None
+        time_range = spec['time_range']
+        if spec['days'] and time_range:
+            return None
+
+        if spec['days']:
+            name = 'day_of_week'
+            table = self.tables[name]
+            table = table[table['day'].isin(spec['days'])]
+        elif time_range:
+            # Only ranges made of whole weeks, Monday to Sunday, line up with the weekly rollup
+            start, end = time_range.get('start'), time_range.get('end')
+            start = pd.Timestamp(start[:10]) if start else None
+            end = pd.Timestamp(end[:10]) if end else None
+            if (start is not None and start.weekday() != 0) or (end is not None and end.weekday() != 6):
+                return None
+            name = 'week'
+            table = self.tables[name]
+            weeks = pd.to_datetime(table['week'])
+            selected = np.ones(len(table), dtype=bool)
+            if start is not None:
+                selected &= (weeks >= start).to_numpy()
+            if end is not None:
+                selected &= (weeks <= end).to_numpy()
+            table = table[selected]
+        else:
+            name = 'segment'
+            table = self.tables[name]
+
+        if name != 'segment':
+            table = _combine([table.drop(columns=[column for column in ('day', 'week') if column in table])], ['segment'])
+        return _to_layer(table, layer, self.measures), name
+
+def aggregate_rows(dataset, layer, mask):
+    """Per-road aggregates of the selected daily rows, computed by scanning them"""
+    config = DATASETS[dataset]
+    measures = config['rollups']['measures']
+    frame = _rows(layer, config, np.flatnonzero(mask))
+    return _to_layer(_partials(frame, ['segment'], measures), layer, measures)
+
+_rollups = {}
+_rollups_lock = threading.Lock()
+
+def get_rollups(dataset):
+    """Return the process-wide rollups of a dataset, or None if it isn't configured for them"""
+    if not DATASETS[dataset].get('rollups'):
+        return None
+    with _rollups_lock:
+        if dataset not in _rollups:
+            _rollups[dataset] = Rollups(dataset)
+        return _rollups[dataset]
+
+def query_spec(dataset, spec, store=None):
+    """
+    Answer an aggregate filter spec locally: the predicates apply to each road's average
+    over the selected days, looked up in a rollup when one covers them and otherwise
+    computed by scanning the stored daily rows
+    Returns:
+        GeoJSON FeatureCollection with one feature per matching road, or None if the layer
+        isn't in the feature store or a predicate can't apply to the averages
+    """
+    with telemetry.span("rollup", dataset=dataset) as current:
+        store = store or get_store()
+        layer = store.load(DATASETS[dataset]['type_name'])
+        if layer is None:
+            return None
+
+        rollups = get_rollups(dataset) if ROLLUPS_ENABLED and store is get_store() else None
+        answered = rollups.answer(spec) if rollups else None
+        if answered is not None:
+            aggregated, source = answered
+        else:
+            selection = render_cql(dataset, dict(spec, predicates=[], radius_km=None), include_bbox=False)
+            aggregated, source = aggregate_rows(dataset, layer, cql.evaluate(layer, selection)), 'scan'
+        current.set(source=source, roads=len(aggregated))
+
+        predicates = render_cql(dataset, dict(spec, aggregate=False, days=None, time_range=None, radius_km=None), include_bbox=False)
+        try:
+            mask = cql.evaluate(aggregated, predicates)
+        except cql.UnsupportedFilter as e:
+            # e.g. a predicate on day or daily_ts, which per-road averages don't have
+            current.set(unsupported=str(e))
+            return None
+        if spec['radius_km']:
+            mask = mask & spatial.within_radius(aggregated, MALL_LONGITUDE, MALL_LATITUDE, spec['radius_km'])
+        return aggregated.to_geojson(mask)
+
+if __name__ == "__main__":
+    import sys
+    rebuild = '--rebuild' in sys.argv[1:]
+    for dataset in DATASETS:
+        rollups = get_rollups(dataset)
+        if rollups is None:
+            continue
+        aggregated = rollups.update(rebuild=rebuild)
+        sizes = ", ".join(f"{name} {len(table):,}" for name, table in rollups.tables.items())
+        print(f"{dataset}: aggregated {aggregated:,} new rows (through {rollups.watermark}); {sizes}")
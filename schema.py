@@ -0,0 +1,303 @@
+import json
+import os
+import threading
+import time
+from hashlib import sha256
+import pandas as pd
+import requests
+from dotenv import load_dotenv
+from singleflight import SingleFlight
+
+load_dotenv()
+
+# Layers and sites the app knows about; add entries here rather than in code
+LAYERS_CONFIG_PATH = os.getenv("GEOINT_LAYERS_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "layers.json"))
+# Attribute types and statistics fetched from GeoServer, kept between runs
+SCHEMA_CACHE_PATH = os.getenv("GEOINT_SCHEMA_CACHE", ".geoint_schema.json")
+# Features sampled from GeoServer for statistics when the layer isn't in the feature store
+SCHEMA_STATS_SAMPLE = int(os.getenv("GEOINT_SCHEMA_STATS_SAMPLE", "2000"))
+# Seconds a user request waits for DescribeFeatureType when the schema isn't cached yet;
+# the full refresh with statistics then runs in the background
+SCHEMA_REQUEST_TIMEOUT = float(os.getenv("GEOINT_SCHEMA_REQUEST_TIMEOUT", "2"))
+
+WFS_BASE_URL = os.getenv("GEOINT_WFS_BASE_URL", "https://mapstack2.mapit.co.za/geoserver/mtn/ows")
+
+NUMERIC_TYPES = {'byte', 'short', 'int', 'integer', 'long', 'float', 'double', 'decimal', 'number'}
+DATE_TYPES = {'date', 'date-time', 'datetime', 'time', 'timestamp'}
+
+# String attributes with at most this many distinct values list them in the prompt
+MAX_LISTED_VALUES = 12
+
+def load_config(path=LAYERS_CONFIG_PATH):
+    """Read the layer and site configuration"""
+    with open(path) as f:
+        return json.load(f)
+
+def _kind(xsd_type):
+    """'number', 'date', 'string' or 'geometry' for a DescribeFeatureType type name"""
+    prefix, _, name = (xsd_type or '').rpartition(':')
+    if prefix == 'gml':
+        return 'geometry'
+    name = name.lower()
+    if name in NUMERIC_TYPES:
+        return 'number'
+    if name in DATE_TYPES:
+        return 'date'
+    return 'string'
+
+def describe_feature_type(type_name, session=None, timeout=10):
+    """Return {attribute: kind} for a layer from GeoServer's JSON DescribeFeatureType"""
+    params = {
+        'service': 'WFS',
+        'version': '2.0.0',
+        'request': 'DescribeFeatureType',
+        'typeNames': type_name,
+        'outputFormat': 'application/json',
+    }
+    response = (session or requests).get(WFS_BASE_URL, params=params, timeout=timeout)
+    response.raise_for_status()
+    feature_types = response.json().get('featureTypes') or []
+    if not feature_types:
+        raise ValueError(f"DescribeFeatureType returned no schema for {type_name}")
+    return {item['name']: _kind(item.get('type')) for item in feature_types[0].get('properties', [])}
+
+def _sample_attributes(type_name, session=None, timeout=60):
+    """Attribute table of the first SCHEMA_STATS_SAMPLE features from GeoServer"""
+    params = {
+        'service': 'WFS',
+        'version': '2.0.0',
+        'request': 'GetFeature',
+        'typeNames': type_name,
+        'outputFormat': 'application/json',
+        'count': SCHEMA_STATS_SAMPLE,
+    }
+    response = (session or requests).get(WFS_BASE_URL, params=params, timeout=timeout)
+    response.raise_for_status()
+    return pd.DataFrame([feature.get('properties') or {} for feature in response.json().get('features', [])])
+
+def _round(value):
+    return float(f"{value:.4g}")
+
+def summarize(frame, kinds):
+    """Per-attribute statistics: min/mean/max for numbers, min/max for dates, values or a count for strings"""
+    stats = {}
+    for name, kind in kinds.items():
+        if name not in frame or kind == 'geometry':
+            continue
+        column = frame[name].dropna()
+        if not len(column):
+            continue
+        if kind == 'number':
+            column = pd.to_numeric(column, errors='coerce').dropna()
+            if len(column):
+                stats[name] = {'min': _round(column.min()), 'mean': _round(column.mean()), 'max': _round(column.max())}
+        elif kind == 'date':
+            stats[name] = {'min': str(column.min())[:10], 'max': str(column.max())[:10]}
+        else:
+            values = column.astype(str).unique()
+            if len(values) <= MAX_LISTED_VALUES:
+                stats[name] = {'values': sorted(values.tolist())}
+            else:
+                stats[name] = {'distinct': int(len(values))}
+    return stats
+
+def _format_stats(stats):
+    if 'values' in stats:
+        return "one of " + ", ".join(stats['values'])
+    if 'distinct' in stats:
+        return f"{stats['distinct']} distinct values"
+    if 'mean' in stats:
+        # The mean anchors words like "high" or "above average"; the full range stays in the cache
+        return f"mean {stats['mean']}"
+    return ", ".join(f"{key} {stats[key]}" for key in ('min', 'max') if key in stats)
+
+class SchemaRegistry:
+    """
+    Layer schemas for prompt building and validation: the configured datasets and sites,
+    plus attribute types and statistics fetched from GeoServer once and cached on disk.
+    """
+
+    def __init__(self, config_path=LAYERS_CONFIG_PATH, cache_path=SCHEMA_CACHE_PATH):
+        config = load_config(config_path)
+        self.datasets = config['datasets']
+        self.sites = config.get('sites', {})
+        self.default_site = config.get('default_site') or next(iter(self.sites), None)
+        self.cache_path = cache_path
+        self._schemas = None
+        self._lock = threading.Lock()
+        self._refreshes = SingleFlight()
+        self._warming = set()
+
+    def site(self, name=None):
+        """Configuration of a site (the default site if no name is given)"""
+        return self.sites[name or self.default_site]
+
+    def site_attribute(self, attribute, name):
+        """
+        An attribute named for the default site (ending in its suffix, e.g. ff_week_rivil)
+        renamed for another site; other attributes are returned unchanged
+        """
+        template = self.site().get('suffix')
+        suffix = self.site(name).get('suffix')
+        ending = f"_{template}"
+        if not template or not suffix or not attribute.endswith(ending):
+            return attribute
+        return attribute[:-len(ending)] + f"_{suffix}"
+
+    def dataset_for(self, type_name):
+        """The dataset a layer holds, through its own type name or a site's, or None"""
+        for dataset, config in self.datasets.items():
+            if type_name == config['type_name'] or any(
+                    site.get('type_names', {}).get(dataset) == type_name for site in self.sites.values()):
+                return dataset
+        return None
+
+    def attributes(self, dataset):
+        """
+        Every attribute name filters on a dataset may use, as a (names, geometry names) pair:
+        the schema's attributes under every site's suffix, plus any others GeoServer reported
+        """
+        config = self.datasets[dataset]
+        schema = self.schema(dataset)
+        with self._lock:
+            kinds = self._load_cache().get(config['type_name'], {}).get('attributes', {})
+        names = set(schema) | {name for name, kind in kinds.items() if kind != 'geometry'}
+        names |= {config[key] for key in ('time_attribute', 'day_attribute') if config.get(key)}
+        names |= {self.site_attribute(name, site) for name in list(names) for site in self.sites}
+        # URL builders filter on `geom` whatever GeoServer calls the column
+        geometry = {'geom'} | {name for name, kind in kinds.items() if kind == 'geometry'}
+        return names, geometry
+
+    def _load_cache(self):
+        if self._schemas is None:
+            self._schemas = {}
+            if os.path.exists(self.cache_path):
+                with open(self.cache_path) as f:
+                    self._schemas = json.load(f).get('layers', {})
+        return self._schemas
+
+    def _save_cache(self):
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'layers': self._schemas}, f, indent=2)
+        os.replace(tmp_path, self.cache_path)
+
+    def refresh(self, dataset, session=None):
+        """Fetch a dataset's attribute types and statistics from GeoServer and cache them"""
+        type_name = self.datasets[dataset]['type_name']
+        kinds = describe_feature_type(type_name, session=session)
+
+        from feature_store import get_store
+        layer = get_store().load(type_name)
+        frame = layer.attributes if layer is not None else _sample_attributes(type_name, session=session)
+        entry = {
+            'attributes': kinds,
+            'stats': summarize(frame, kinds),
+            'sample_size': len(frame),
+            'updated_at': time.time(),
+        }
+        with self._lock:
+            self._load_cache()[type_name] = entry
+            self._save_cache()
+        return entry
+
+    def warm(self, datasets=None):
+        """
+        Refresh, in a background thread, every dataset (or the given ones) whose statistics
+        aren't cached yet, once per process; call at startup so user requests find them
+        """
+        with self._lock:
+            cache = self._load_cache()
+            pending = [
+                dataset for dataset in (datasets or self.datasets)
+                if dataset not in self._warming and 'updated_at' not in cache.get(self.datasets[dataset]['type_name'], {})
+            ]
+            self._warming.update(pending)
+        if pending:
+            threading.Thread(target=self._warm, args=(pending,), daemon=True).start()
+
+    def _warm(self, datasets):
+        for dataset in datasets:
+            try:
+                self._refreshes.do(dataset, self.refresh, dataset)
+            except (requests.RequestException, ValueError, KeyError):
+                # Configured values stay in use; `python schema.py` refreshes explicitly
+                pass
+
+    def _quick_schema(self, dataset):
+        """Attribute types only, fetched with SCHEMA_REQUEST_TIMEOUT, while warm() fetches the rest"""
+        type_name = self.datasets[dataset]['type_name']
+        try:
+            kinds = self._refreshes.do(('describe', dataset), describe_feature_type, type_name,
+                                       timeout=SCHEMA_REQUEST_TIMEOUT)
+        except (requests.RequestException, ValueError, KeyError):
+            kinds = {}
+        with self._lock:
+            # Kept in memory only, so the next prompt doesn't wait again
+            cached = self._load_cache().setdefault(type_name, {'attributes': kinds, 'stats': {}})
+        self.warm([dataset])
+        return cached
+
+    def schema(self, dataset):
+        """
+        Attributes the model may use for a dataset, as {name: {'type', 'description', 'stats'}}.
+        Configured properties are used as listed; a dataset configured without properties
+        exposes every non-geometry attribute GeoServer reports. Types and statistics come
+        from .geoint_schema.json; if a layer isn't there yet, only its types are fetched (with
+        a short timeout) and its statistics follow from a background refresh.
+        """
+        config = self.datasets[dataset]
+        type_name = config['type_name']
+        with self._lock:
+            cached = self._load_cache().get(type_name)
+        if cached is None:
+            cached = self._quick_schema(dataset)
+        elif 'updated_at' not in cached:
+            self.warm([dataset])
+
+        kinds = cached['attributes']
+        descriptions = config.get('properties') or {
+            name: '' for name, kind in kinds.items() if kind != 'geometry'
+        }
+        stats = dict(config.get('stats') or {}, **cached['stats'])
+        return {
+            name: {
+                'type': kinds.get(name, 'date' if name == config.get('time_attribute') else None),
+                'description': description,
+                'stats': stats.get(name),
+            }
+            for name, description in descriptions.items()
+        }
+
+    def fingerprint(self, dataset):
+        """Short hash of the schema text prompts embed, changing whenever its types or statistics do"""
+        return sha256(self.describe(dataset).encode('utf-8')).hexdigest()[:16]
+
+    def describe(self, dataset):
+        """Compact one-line-per-attribute schema text for prompts"""
+        lines = []
+        for name, attribute in self.schema(dataset).items():
+            details = "; ".join(part for part in (attribute['type'], attribute['stats'] and _format_stats(attribute['stats'])) if part)
+            line = f"- {name}" + (f" ({details})" if details else "")
+            if attribute['description']:
+                line += f": {attribute['description']}"
+            lines.append(line)
+        return "\n".join(lines)
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_registry():
+    """Return the process-wide schema registry"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = SchemaRegistry()
+        return _registry
+
+if __name__ == "__main__":
+    registry = get_registry()
+    for dataset in registry.datasets:
+        entry = registry.refresh(dataset)
+        print(f"{dataset}: {len(entry['attributes'])} attributes, stats from {entry['sample_size']:,} features")
+        print(registry.describe(dataset))
@@ -0,0 +1,205 @@
+import json
+import os
+import re
+from dotenv import load_dotenv
+from cache import get_cache, normalize_query
+from filter_spec import DATASETS
+from llm import LLMUnavailable, complete
+import telemetry
+from singleflight import SingleFlight
+
+load_dotenv()
+
+SEGREGATION_MODEL = 'gpt-4'
+
+# Bump whenever the segregation prompt changes so stale cache entries are ignored
+SEGREGATION_PROMPT_VERSION = 2
+
+# Rule-based results at or above this confidence skip the LLM entirely
+RULE_CONFIDENCE_THRESHOLD = float(os.getenv("GEOINT_RULE_CONFIDENCE_THRESHOLD", "0.75"))
+
+# Cues taken from the segregation prompt below
+TRAFFIC_CUES = re.compile(
+    r"\b(traffic|density|avg_traffic_den|avg_hits|total_hits|hits|roads?|streets?|highways?|congest\w*|daily_ts)\b"
+)
+FOOTFALL_CUES = re.compile(
+    r"\b(footfall|visitors?|competitors?|shoppers?|income(_class)?|mall|ffm?c?_\w+|"
+    r"morning|midday|afternoon|evening)\b"
+)
+
+# Conditions that belong to both components
+RADIUS_PHRASE = re.compile(
+    r"\b(within|in|inside|around)?\s*(a\s+)?\d+(\.\d+)?\s*(km|kms|kilomet\w+|m|metres|meters)\b"
+    r"(\s+radius)?(\s+(of|from|around)\s+(my|the|our)?\s*mall)?"
+    r"|\bradius\s+of\s+\d+(\.\d+)?\s*(km|kms|kilomet\w+)?(\s+(of|from|around)\s+(my|the|our)?\s*mall)?"
+    r"|\b(near|around|close to)\s+(my|the|our)\s+mall\b"
+)
+# Dates and date ranges, which select on a dataset's time attribute
+DATE_PHRASE = re.compile(
+    r"\d{4}-\d{2}-\d{2}|\b(last|this|past|previous|next)\s+(\d+\s+)?(days?|weeks?|months?|years?)\b"
+    r"|\b(january|february|march|april|may|june|july|august|september|october|november|december)\b"
+    r"|\b(between|from|since|until|before|after)\s+\S*\d"
+)
+# Days of the week, which select on a dataset's day attribute
+DAY_PHRASE = re.compile(
+    r"\b(on\s+)?(mondays?|tuesdays?|wednesdays?|thursdays?|fridays?|saturdays?|sundays?|weekends?|weekdays?)\b"
+)
+TIME_PHRASE = re.compile(f"{DATE_PHRASE.pattern}|{DAY_PHRASE.pattern}")
+NUMBER = re.compile(r"\d")
+
+# Clause boundaries; "between x and y" is protected before splitting
+CLAUSE_SEPARATOR = re.compile(r"(\s*[,;]\s*|\s+and\s+|\s+but\s+|\s+also\s+)")
+BETWEEN_RANGE = re.compile(r"\bbetween\s+(\S+)\s+and\s+(\S+)")
+
+FILLER_WORDS = {
+    'show', 'me', 'all', 'the', 'give', 'list', 'find', 'display', 'please', 'i', 'want', 'to', 'see',
+    'what', 'are', 'where', 'which', 'with', 'of', 'my', 'our', 'a', 'an', 'in', 'on', 'for', 'data',
+    'areas', 'area', 'locations', 'places', 'that', 'have', 'has', 'is', 'there', 'any', 'get', 'also',
+    'can', 'you', 'and', 'or', 'too', 'as', 'well', 'where', 'those', 'these', 'them', 'it', 'be',
+}
+
+def _label_clause(clause):
+    """Label a lower-cased clause as 'traffic', 'footfall', 'both', 'shared', 'threshold', 'filler' or 'unknown'"""
+    remainder = RADIUS_PHRASE.sub(" ", clause)
+    shared = remainder != clause
+    without_time = TIME_PHRASE.sub(" ", remainder)
+    shared = shared or without_time != remainder
+
+    traffic = bool(TRAFFIC_CUES.search(remainder))
+    footfall = bool(FOOTFALL_CUES.search(remainder))
+    if traffic and footfall:
+        return 'both'
+    if traffic:
+        return 'traffic'
+    if footfall:
+        return 'footfall'
+    if NUMBER.search(without_time):
+        return 'threshold'
+    if shared:
+        return 'shared'
+    words = re.findall(r"[a-z_]+", without_time)
+    if all(word in FILLER_WORDS for word in words):
+        return 'filler'
+    return 'unknown'
+
+def _embedded_phrases(clause):
+    """
+    Radius and date phrases inside a clause, as {'radius': [text], 'date': [text]} in the
+    clause's own spelling. Days of the week are left out: on footfall they pick weekday or
+    weekend columns rather than rows, so they stay with the clause that names them.
+    """
+    lowered = clause.lower()
+    radius = [clause[m.start():m.end()].strip() for m in RADIUS_PHRASE.finditer(lowered)]
+    # Blank out the radius phrases (keeping offsets) so "in 5 km" isn't read as a date too
+    remainder = RADIUS_PHRASE.sub(lambda m: " " * len(m.group(0)), lowered)
+    dates = [clause[m.start():m.end()].strip() for m in DATE_PHRASE.finditer(remainder)]
+    return {'radius': [text for text in radius if text], 'date': [text for text in dates if text]}
+
+def classify_query(query):
+    """
+    Split a query into traffic and footfall components using the keyword cues, without an LLM call
+    Args:
+        query: Raw user query
+    Returns:
+        Tuple of ({'traffic_query': str or None, 'footfall_query': str or None}, confidence in [0, 1])
+    """
+    protected = BETWEEN_RANGE.sub(lambda m: f"between {m.group(1)}\0{m.group(2)}", query.strip())
+    parts = CLAUSE_SEPARATOR.split(protected)
+    clauses = [part.replace("\0", " and ") for part in parts[0::2]]
+    separators = [""] + parts[1::2]
+
+    labels = [_label_clause(clause.lower()) for clause in clauses]
+    confidence = 1.0
+
+    for index, label in enumerate(labels):
+        if label == 'both':
+            confidence = 0.0
+        elif label == 'unknown':
+            confidence -= 0.3
+        elif label in ('traffic', 'footfall') and not NUMBER.search(clauses[index]):
+            # Qualitative conditions ("busy roads") and bare nouns are left to the LLM
+            confidence -= 0.3
+        elif label == 'threshold':
+            # A bare threshold belongs to the nearest preceding component, as the prompt instructs
+            previous = [l for l in labels[:index] if l in ('traffic', 'footfall')]
+            following = [l for l in labels[index + 1:] if l in ('traffic', 'footfall')]
+            nearest = previous[-1:] or following[:1]
+            labels[index] = nearest[0] if nearest else 'unknown'
+            confidence -= 0.4
+
+    # "Within 8 km show traffic > 2" scopes the whole query, not just its own clause: a radius
+    # or date phrase inside one component's clause also goes to the other component, unless
+    # that one states its own or (for a date) its layer has no time attribute
+    embedded = {dataset: {'radius': [], 'date': []} for dataset in ('traffic', 'footfall')}
+    for clause, label in zip(clauses, labels):
+        if label in embedded:
+            for kind, phrases in _embedded_phrases(clause).items():
+                embedded[label][kind].extend(phrases)
+
+    result = {}
+    for dataset in ('traffic', 'footfall'):
+        pieces = []
+        for clause, separator, label in zip(clauses, separators, labels):
+            if label in (dataset, 'shared') and clause.strip():
+                pieces.append((separator if pieces else "") + clause.strip())
+        has_component = dataset in labels
+        if has_component:
+            other = 'footfall' if dataset == 'traffic' else 'traffic'
+            for kind, phrases in embedded[other].items():
+                if kind == 'date' and not DATASETS[dataset]['time_attribute']:
+                    continue
+                if phrases and not embedded[dataset][kind]:
+                    pieces.extend(" " + phrase for phrase in phrases)
+        result[f"{dataset}_query"] = "".join(pieces) if has_component else None
+
+    if not (result['traffic_query'] or result['footfall_query']):
+        confidence = 0.0
+    return result, max(confidence, 0.0)
+
+# Identical for every query so the provider can reuse the cached prefix; the user message is just the query
+SEGREGATION_SYSTEM_PROMPT = """Split the user's query into a traffic part and a footfall part, keeping each part's own radius/distance, time period and thresholds.
+Traffic: roads, traffic, traffic density (avg_traffic_den), traffic counts.
+Footfall: visitors, footfall, mall, competitors, ff_/ffc_ metrics, morning/midday/afternoon/evening visitor patterns.
+Assign an ambiguous condition (such as a bare number) to the part whose words it is next to.
+Return ONLY a JSON object with keys "traffic_query" and "footfall_query"; use null for a part that is not present."""
+
+# Sessions sending the same query at the same time share one LLM call
+_flights = SingleFlight()
+
+def segregate_with_llm(query):
+    """Use GPT-4 to segregate the query into traffic and footfall components"""
+    return _flights.do(normalize_query(query), _segregate_with_llm, query)
+
+def _segregate_with_llm(query):
+    cache = get_cache()
+    cached = cache.get("segregation", query, SEGREGATION_MODEL, SEGREGATION_PROMPT_VERSION)
+    if cached is not None:
+        return cached
+
+    content = complete(SEGREGATION_MODEL, SEGREGATION_SYSTEM_PROMPT, query, temperature=0.1)
+
+    try:
+        # Parse the response using json.loads instead of eval
+        result = json.loads(content)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Error parsing query segregation response: {str(e)}")
+    cache.set("segregation", query, SEGREGATION_MODEL, SEGREGATION_PROMPT_VERSION, result)
+    return result
+
+def segregate_query(query):
+    """Segregate the query with the rule-based classifier, falling back to the LLM when it is unsure"""
+    with telemetry.span("segregation") as current:
+        result, confidence = classify_query(query)
+        current.set(rule_confidence=round(confidence, 2))
+        if confidence >= RULE_CONFIDENCE_THRESHOLD:
+            current.set(source='rules')
+            return result
+        current.set(source='llm')
+        try:
+            return segregate_with_llm(query)
+        except LLMUnavailable as e:
+            # Provider trouble: a best guess from the rules beats no answer at all
+            if not (result['traffic_query'] or result['footfall_query']):
+                raise
+            current.set(source='rules_fallback', fallback_reason=str(e))
+            return result
@@ -0,0 +1,191 @@
+import math
+import os
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Zoom level the inline map layers are simplified for; the map opens at 12, leaving headroom to zoom in
+SIMPLIFY_ZOOM = int(os.getenv("GEOINT_SIMPLIFY_ZOOM", "14"))
+# Largest deviation, in screen pixels at SIMPLIFY_ZOOM, that simplification may introduce
+SIMPLIFY_PIXELS = float(os.getenv("GEOINT_SIMPLIFY_PIXELS", "1"))
+# Grid cells per axis used to quantize TopoJSON coordinates
+TOPOJSON_QUANTIZATION = int(os.getenv("GEOINT_TOPOJSON_QUANTIZATION", "100000"))
+
+# Metres per pixel at zoom 0 on the equator for 256px Web Mercator tiles
+EQUATOR_RESOLUTION = 156543.03392804097
+METRES_PER_DEGREE = 111320.0
+
+def tolerance_degrees(zoom, latitude, pixels=SIMPLIFY_PIXELS):
+    """Distance in degrees of latitude covered by `pixels` screen pixels at a zoom level"""
+    metres_per_pixel = EQUATOR_RESOLUTION * math.cos(math.radians(latitude)) / 2 ** zoom
+    return pixels * metres_per_pixel / METRES_PER_DEGREE
+
+def douglas_peucker(coords, tolerance):
+    """
+    Douglas-Peucker simplification of one line or ring
+    Args:
+        coords: n x 2 array of lon/lat, with longitude pre-scaled by cos(latitude)
+        tolerance: Maximum allowed deviation in the same units
+    Returns:
+        Boolean mask of the vertices to keep (always including both ends)
+    """
+    count = len(coords)
+    keep = np.zeros(count, dtype=bool)
+    if count <= 2:
+        keep[:] = True
+        return keep
+    keep[0] = keep[-1] = True
+
+    stack = [(0, count - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        segment = coords[end] - coords[start]
+        offsets = coords[start + 1:end] - coords[start]
+        length = np.hypot(*segment)
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(offsets[:, 0] * segment[1] - offsets[:, 1] * segment[0]) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return keep
+
+def _simplify_ring(ring, tolerance, scale, closed):
+    coords = np.asarray(ring, dtype=np.float64)[:, :2]
+    if len(coords) <= (4 if closed else 2):
+        return coords.tolist()
+    scaled = coords * [scale, 1.0]
+    keep = douglas_peucker(scaled, tolerance)
+    if closed and keep.sum() < 4:
+        # Too small to draw at this zoom; keep the outline coarse but valid
+        keep[np.linspace(0, len(coords) - 1, 4).astype(int)] = True
+    return coords[keep].tolist()
+
+def simplify_geometry(geometry, tolerance, scale):
+    """Simplify a GeoJSON geometry's lines and rings; points are returned unchanged"""
+    if not geometry:
+        return geometry
+    kind, coordinates = geometry['type'], geometry['coordinates']
+    if kind == 'LineString':
+        coordinates = _simplify_ring(coordinates, tolerance, scale, False)
+    elif kind == 'MultiLineString':
+        coordinates = [_simplify_ring(line, tolerance, scale, False) for line in coordinates]
+    elif kind == 'Polygon':
+        coordinates = [_simplify_ring(ring, tolerance, scale, True) for ring in coordinates]
+    elif kind == 'MultiPolygon':
+        coordinates = [[_simplify_ring(ring, tolerance, scale, True) for ring in polygon] for polygon in coordinates]
+    return {'type': kind, 'coordinates': coordinates}
+
+def simplify_features(feature_collection, zoom=SIMPLIFY_ZOOM, latitude=None):
+    """
+    Return a copy of a FeatureCollection simplified for display at `zoom`; the tolerance is
+    worked out at `latitude`, by default the middle of the collection's bounds
+    """
+    if latitude is None:
+        latitude = _middle_latitude(feature_collection)
+    tolerance = tolerance_degrees(zoom, latitude)
+    scale = math.cos(math.radians(latitude))
+    return {
+        'type': 'FeatureCollection',
+        'features': [
+            dict(feature, geometry=simplify_geometry(feature.get('geometry'), tolerance, scale))
+            for feature in feature_collection['features']
+        ],
+    }
+
+def _all_coords(feature_collection):
+    """Every lon/lat pair in a FeatureCollection, as an n x 2 array"""
+    coords = []
+
+    def collect(coordinates):
+        if coordinates and isinstance(coordinates[0], (int, float)):
+            coords.append(coordinates[:2])
+        else:
+            for item in coordinates:
+                collect(item)
+
+    for feature in feature_collection['features']:
+        if feature.get('geometry'):
+            collect(feature['geometry']['coordinates'])
+    return np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+
+def _middle_latitude(feature_collection):
+    """Latitude halfway between a FeatureCollection's southern and northern bounds (0 if it has no coordinates)"""
+    latitudes = _all_coords(feature_collection)[:, 1]
+    return float((latitudes.min() + latitudes.max()) / 2) if len(latitudes) else 0.0
+
+def to_topojson(feature_collection, quantization=TOPOJSON_QUANTIZATION, name='layer'):
+    """
+    Encode a FeatureCollection as quantized, delta-encoded TopoJSON that ol.format.TopoJSON reads.
+    Every line and ring becomes its own arc; coordinates snap to a quantization x quantization grid.
+    """
+    coords = _all_coords(feature_collection)
+    if len(coords):
+        low, high = coords.min(axis=0), coords.max(axis=0)
+    else:
+        low, high = np.zeros(2), np.ones(2)
+    scale = np.where(high > low, (high - low) / (quantization - 1), 1.0)
+    arcs = []
+
+    def quantize(points):
+        return np.round((np.asarray(points, dtype=np.float64)[:, :2] - low) / scale).astype(np.int64)
+
+    def arc(points, closed):
+        quantized = quantize(points)
+        # Drop vertices that collapse onto their predecessor after quantization
+        moved = np.ones(len(quantized), dtype=bool)
+        moved[1:] = (np.diff(quantized, axis=0) != 0).any(axis=1)
+        moved[-1] = True
+        if moved.sum() >= (4 if closed else 2):
+            quantized = quantized[moved]
+        deltas = np.diff(quantized, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+        arcs.append(deltas.tolist())
+        return len(arcs) - 1
+
+    def position(point):
+        return quantize([point])[0].tolist()
+
+    geometries = []
+    for feature in feature_collection['features']:
+        geometry = feature.get('geometry')
+        if not geometry:
+            topology_geometry = {'type': None}
+        else:
+            kind, coordinates = geometry['type'], geometry['coordinates']
+            if kind == 'Point':
+                topology_geometry = {'type': kind, 'coordinates': position(coordinates)}
+            elif kind == 'MultiPoint':
+                topology_geometry = {'type': kind, 'coordinates': [position(point) for point in coordinates]}
+            elif kind == 'LineString':
+                topology_geometry = {'type': kind, 'arcs': [arc(coordinates, False)]}
+            elif kind == 'MultiLineString':
+                topology_geometry = {'type': kind, 'arcs': [[arc(line, False)] for line in coordinates]}
+            elif kind == 'Polygon':
+                topology_geometry = {'type': kind, 'arcs': [[arc(ring, True)] for ring in coordinates]}
+            else:
+                topology_geometry = {
+                    'type': kind,
+                    'arcs': [[[arc(ring, True)] for ring in polygon] for polygon in coordinates],
+                }
+        if feature.get('id') is not None:
+            topology_geometry['id'] = feature['id']
+        topology_geometry['properties'] = feature.get('properties') or {}
+        geometries.append(topology_geometry)
+
+    return {
+        'type': 'Topology',
+        'transform': {'scale': scale.tolist(), 'translate': low.tolist()},
+        'objects': {name: {'type': 'GeometryCollection', 'geometries': geometries}},
+        'arcs': arcs,
+    }
+
+def encode_for_map(feature_collection, zoom=SIMPLIFY_ZOOM, latitude=None):
+    """Simplify a FeatureCollection for `zoom` (at `latitude`, see simplify_features) and encode it as compact TopoJSON"""
+    return to_topojson(simplify_features(feature_collection, zoom, latitude))
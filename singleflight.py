@@ -0,0 +1,46 @@
+import threading
+from concurrent.futures import Future
+import telemetry
+
+class SingleFlight:
+    """
+    Deduplicates concurrent work: while a call for a key is running, other callers with the
+    same key wait for it and get its result (or its exception) instead of repeating it.
+    Nothing is kept once the call finishes; caching is left to the caller.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) unless a call for `key` is already in flight, then share its outcome"""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+                self.calls += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            current = telemetry.current_span()
+            if current:
+                current.set(coalesced=True)
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
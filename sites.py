@@ -0,0 +1,216 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from dotenv import load_dotenv
+import cql
+import spatial
+import telemetry
+import wfs_client
+from feature_store import LayerData, _features_to_frame, get_store
+from filter_spec import DATASETS, DEFAULT_RADIUS_KM, render_cql
+from schema import get_registry
+from wfs import build_wfs_url, feature_url
+from wms import build_wms_url
+
+load_dotenv()
+
+# Sites whose conditions are OR'd into one WFS request; keeps the CQL_FILTER within URL limits
+SITE_BATCH_SIZE = int(os.getenv("GEOINT_SITE_BATCH_SIZE", "10"))
+# Combined WFS requests in flight at once
+SITE_WORKERS = int(os.getenv("GEOINT_SITE_WORKERS", "8"))
+
+_requests = ThreadPoolExecutor(max_workers=SITE_WORKERS, thread_name_prefix='sites')
+
+def site_names(names=None):
+    """The given site names, checked against the registry, or every registered site"""
+    sites = get_registry().sites
+    if not names:
+        return list(sites)
+    unknown = [name for name in names if name not in sites]
+    if unknown:
+        raise ValueError(f"Unknown site(s): {', '.join(unknown)}")
+    return list(names)
+
+def site_type_name(dataset, name):
+    """The layer holding a site's data: its own if the site lists one, else the dataset's"""
+    return get_registry().site(name).get('type_names', {}).get(dataset) or DATASETS[dataset]['type_name']
+
+def spec_for_site(spec, name):
+    """
+    Rewrite a filter spec interpreted against the default site for another site: attributes
+    carrying the default site's suffix (e.g. ff_week_rivil) get the other site's suffix
+    """
+    registry = get_registry()
+    predicates = [dict(p, attribute=registry.site_attribute(p['attribute'], name)) for p in spec['predicates']]
+    return dict(spec, predicates=predicates)
+
+def site_bboxes(names, radius_km):
+    """(min_lon, min_lat, max_lon, max_lat) of the radius around every site, in one vectorized step"""
+    registry = get_registry()
+    centres = np.array([(registry.site(name)['longitude'], registry.site(name)['latitude']) for name in names],
+                       dtype=float).reshape(-1, 2)
+    boxes = np.column_stack(spatial.radius_bbox(centres[:, 0], centres[:, 1], radius_km))
+    return {name: tuple(float(value) for value in box) for name, box in zip(names, boxes)}
+
+def build_site_urls(dataset, spec, names=None):
+    """
+    Per-site CQL filters and WFS/WMS URLs for one filter spec
+    Returns:
+        Dict mapping site name to {'type_name', 'cql', 'wfs', 'wms', 'circle'}, where 'circle'
+        is the site's (lon, lat, radius_km) when the spec has a radius and None otherwise
+    """
+    registry = get_registry()
+    names = site_names(names)
+    bboxes = site_bboxes(names, spec['radius_km'] or DEFAULT_RADIUS_KM)
+    urls = {}
+    for name in names:
+        site_spec = spec_for_site(spec, name)
+        type_name = site_type_name(dataset, name)
+        urls[name] = {
+            'type_name': type_name,
+            'cql': render_cql(dataset, site_spec, include_bbox=True, bbox=bboxes[name]),
+            'wfs': build_wfs_url(dataset, site_spec, type_name=type_name, bbox=bboxes[name]),
+            'wms': build_wms_url(dataset, site_spec, type_name=type_name, bbox=bboxes[name]),
+            'circle': (registry.site(name)['longitude'], registry.site(name)['latitude'], spec['radius_km'])
+            if spec['radius_km'] else None,
+        }
+    return urls
+
+def combined_cql(filters):
+    """OR sites' CQL filters into one; None (the whole layer) if any site has no filter"""
+    if any(cql_filter is None for cql_filter in filters):
+        return None
+    unique = list(dict.fromkeys(filters))
+    return unique[0] if len(unique) == 1 else " OR ".join(f"({cql_filter})" for cql_filter in unique)
+
+def _fetch_batch(type_name, filters):
+    """
+    Features matching any of the filters, fetched with one paged WFS request when the
+    combined count is under load_layer's thresholds; otherwise clustered or left to WMS as
+    load_layer would, with each site's own count from a hits request
+    """
+    url = feature_url(type_name, combined_cql(filters))
+    with telemetry.span("site_batch", sites=len(filters)) as current:
+        batch = wfs_client.fetch_layer(url)
+        current.set(mode=batch['mode'], features=batch['count'])
+        if batch['mode'] != 'wfs':
+            batch['counts'] = [wfs_client.count_features(feature_url(type_name, cql_filter)) for cql_filter in filters]
+    return batch
+
+def _merge_batches(type_name, batches):
+    """One LayerData of the features the batches fetched, each feature once"""
+    features = {}
+    for batch in batches:
+        for feature in batch:
+            features.setdefault(feature.get('id') or len(features), feature)
+    attributes, geometry = _features_to_frame(list(features.values()))
+    return LayerData(type_name, attributes, geometry)
+
+def _split(layer, filters, circles):
+    """
+    Each filter's mask over a combined result; where a site has a circle the mask is narrowed
+    from the filter's bounding box to the exact radius
+    """
+    if not len(layer):
+        return [np.zeros(0, dtype=bool) for _ in filters]
+    masks = []
+    for cql_filter, circle in zip(filters, circles):
+        mask = cql.evaluate(layer, cql_filter)
+        if circle:
+            mask = mask & spatial.within_radius(layer, *circle)
+        masks.append(mask)
+    return masks
+
+def fetch_sites(urls, store=None):
+    """
+    Run every site's WFS query. Layers in the feature store are filtered locally; for the
+    rest, sites sharing a layer are OR'd into one request per SITE_BATCH_SIZE sites, the
+    requests run concurrently and their results are merged and split locally by evaluating
+    every site's own filter and radius on them. Batches matching too many features to
+    download are sized like load_layer results instead; their per-site counts come from
+    hits requests and so cover each radius's bounding box rather than the circle.
+    Args:
+        urls: Result of build_site_urls
+    Returns:
+        Tuple of (dict mapping site name to (LayerData, mask of the site's features), with
+        sites sharing a layer sharing the LayerData; list of the oversized batches as
+        load_layer style dicts with 'sites', their per-site 'counts' and 'approximate' set
+        when those counts are of bounding boxes standing in for a radius)
+    """
+    store = store or get_store()
+    groups = {}
+    for name, site in urls.items():
+        groups.setdefault(site['type_name'], []).append(name)
+
+    local, remote = [], []
+    for type_name, names in groups.items():
+        filters = [urls[name]['cql'] for name in names]
+        circles = [urls[name]['circle'] for name in names]
+        layer = store.load(type_name)
+        if layer is not None:
+            try:
+                local.append((names, layer, _split(layer, filters, circles)))
+                continue
+            except cql.UnsupportedFilter:
+                pass
+        batches = [
+            (names[start:start + SITE_BATCH_SIZE], filters[start:start + SITE_BATCH_SIZE],
+             circles[start:start + SITE_BATCH_SIZE],
+             _requests.submit(telemetry.propagate(_fetch_batch), type_name, filters[start:start + SITE_BATCH_SIZE]))
+            for start in range(0, len(names), SITE_BATCH_SIZE)
+        ]
+        remote.append((type_name, batches))
+
+    results, oversized = {}, []
+    for names, layer, masks in local:
+        results.update((name, (layer, mask)) for name, mask in zip(names, masks))
+    for type_name, batches in remote:
+        fetched_names, fetched_filters, fetched_circles, fetched = [], [], [], []
+        for names, filters, circles, future in batches:
+            batch = future.result()
+            if batch['mode'] == 'wfs':
+                fetched_names += names
+                fetched_filters += filters
+                fetched_circles += circles
+                fetched.append(batch['data']['features'])
+            else:
+                oversized.append(dict(batch, sites=names, approximate=any(circles)))
+        if fetched:
+            layer = _merge_batches(type_name, fetched)
+            masks = _split(layer, fetched_filters, fetched_circles)
+            results.update((name, (layer, mask)) for name, mask in zip(fetched_names, masks))
+    return results, oversized
+
+def query_sites(dataset, spec, names=None, store=None):
+    """
+    Run one filter spec at many sites: URLs for each, every site's matches and one map layer
+    holding all of them
+    Returns:
+        Dict with 'sites' (site name to {'wfs', 'wms', 'count'}) and 'layers' (one load_layer
+        style dict per distinct result layer or oversized batch, holding the matches of the
+        sites listed under its 'sites' key)
+    """
+    with telemetry.span("sites", dataset=dataset) as current:
+        urls = build_site_urls(dataset, spec, names)
+        current.set(sites=len(urls))
+        matches, oversized = fetch_sites(urls, store)
+
+        counts = {name: int(mask.sum()) for name, (_, mask) in matches.items()}
+        unions = {}
+        for name, (layer, mask) in matches.items():
+            union = unions.get(id(layer))
+            if union is None:
+                unions[id(layer)] = (layer, mask, [name])
+            else:
+                unions[id(layer)] = (layer, union[1] | mask, union[2] + [name])
+        layers = [dict(wfs_client.size_layer(layer, mask), sites=names) for layer, mask, names in unions.values()]
+        for batch in oversized:
+            counts.update(zip(batch['sites'], batch.pop('counts')))
+            layers.append(batch)
+        return {
+            'sites': {
+                name: {'wfs': site['wfs'], 'wms': site['wms'], 'count': counts[name]}
+                for name, site in urls.items()
+            },
+            'layers': layers,
+        }
@@ -0,0 +1,141 @@
+import threading
+import weakref
+import numpy as np
+from feature_store import GEOMETRY_TYPES, take_geometries
+
+# Mean Earth radius (IUGG) used for all distance calculations
+EARTH_RADIUS_KM = 6371.0088
+
+POLYGON_TYPES = (GEOMETRY_TYPES.index('Polygon'), GEOMETRY_TYPES.index('MultiPolygon'))
+
+# Grid cell size of the spatial index, in degrees
+GRID_CELL_DEGREES = 0.01
+
+def haversine_km(lon1, lat1, lon2, lat2):
+    """Great-circle distance in km between points given in degrees (vectorized)"""
+    lon1, lat1, lon2, lat2 = map(np.radians, (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+def radius_bbox(lon, lat, radius_km):
+    """
+    Smallest lon/lat box containing the circle of `radius_km` around a point
+    Returns:
+        (min_lon, min_lat, max_lon, max_lat); works on scalars or arrays of centres
+    """
+    lat_offset = np.degrees(radius_km / EARTH_RADIUS_KM)
+    # A degree of longitude shrinks with cos(latitude), so the box is wider than it is tall
+    lon_offset = lat_offset / np.cos(np.radians(lat))
+    return lon - lon_offset, lat - lat_offset, lon + lon_offset, lat + lat_offset
+
+class GridIndex:
+    """
+    Uniform grid over feature bounding boxes. Each feature is registered in every cell its
+    box touches; a box query only inspects the cells it overlaps.
+    """
+
+    def __init__(self, bounds, cell_size=GRID_CELL_DEGREES):
+        self.bounds = bounds
+        self.cell_size = cell_size
+        valid = np.flatnonzero(~np.isnan(bounds).any(axis=1))
+        self.origin = bounds[valid, :2].min(axis=0) if len(valid) else np.zeros(2)
+
+        min_cells = self._cells(bounds[valid, :2])
+        max_cells = self._cells(bounds[valid, 2:])
+        self.columns = int(max_cells[:, 0].max()) + 1 if len(valid) else 1
+
+        spans_x = max_cells[:, 0] - min_cells[:, 0] + 1
+        spans_y = max_cells[:, 1] - min_cells[:, 1] + 1
+        counts = spans_x * spans_y
+        features = np.repeat(valid, counts)
+        # Position of each entry inside its feature's block of cells
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cell_x = np.repeat(min_cells[:, 0], counts) + local % np.repeat(spans_x, counts)
+        cell_y = np.repeat(min_cells[:, 1], counts) + local // np.repeat(spans_x, counts)
+        keys = cell_y * self.columns + cell_x
+
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.features = features[order]
+
+    def _cells(self, points):
+        return np.floor((np.asarray(points) - self.origin) / self.cell_size).astype(np.int64)
+
+    def query(self, min_lon, min_lat, max_lon, max_lat):
+        """Indices of features whose bounding box intersects the given box"""
+        low = np.maximum(self._cells([min_lon, min_lat]), 0)
+        high = self._cells([max_lon, max_lat])
+        high[0] = min(high[0], self.columns - 1)
+        if (high < low).any():
+            return np.zeros(0, dtype=np.int64)
+
+        xs = np.arange(low[0], high[0] + 1)
+        rows = np.arange(low[1], high[1] + 1)
+        starts = np.searchsorted(self.keys, rows * self.columns + xs[0], side='left')
+        ends = np.searchsorted(self.keys, rows * self.columns + xs[-1], side='right')
+        candidates = np.unique(np.concatenate([self.features[s:e] for s, e in zip(starts, ends)] or [[]])).astype(np.int64)
+
+        bounds = self.bounds[candidates]
+        hit = (bounds[:, 0] <= max_lon) & (bounds[:, 2] >= min_lon) & (bounds[:, 1] <= max_lat) & (bounds[:, 3] >= min_lat)
+        return candidates[hit]
+
+_indexes = weakref.WeakKeyDictionary()
+_indexes_lock = threading.Lock()
+
+def get_index(layer):
+    """Return the grid index of a LayerData snapshot, building it on first use"""
+    with _indexes_lock:
+        index = _indexes.get(layer)
+        if index is None:
+            index = GridIndex(layer.bounds)
+            _indexes[layer] = index
+        return index
+
+def distances_km(layer, indices, lon, lat):
+    """
+    Distance in km from a point to each of the given features' geometry: 0 inside a polygon,
+    otherwise the closest vertex or segment. Coordinates are projected onto a local plane
+    around the point, which is accurate to well under a metre at the radii used here.
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    if not len(indices):
+        return np.zeros(0)
+    geometry = take_geometries(layer.geometry, indices)
+    coords = geometry['coords']
+    x = np.radians(coords[:, 0] - lon) * np.cos(np.radians(lat)) * EARTH_RADIUS_KM
+    y = np.radians(coords[:, 1] - lat) * EARTH_RADIUS_KM
+
+    ring_offsets = geometry['ring_offsets']
+    # Feature number of every coordinate
+    coord_counts = np.diff(ring_offsets[geometry['part_offsets'][geometry['geom_offsets']]])
+    coord_feature = np.repeat(np.arange(len(indices)), coord_counts)
+
+    result = np.full(len(indices), np.inf)
+    np.minimum.at(result, coord_feature, np.hypot(x, y))
+
+    # Segments join consecutive coordinates of the same ring
+    is_segment = np.ones(len(coords), dtype=bool)
+    is_segment[ring_offsets[1:] - 1] = False
+    starts = np.flatnonzero(is_segment[:-1]) if len(coords) > 1 else np.zeros(0, dtype=np.int64)
+    if len(starts):
+        x1, y1, x2, y2 = x[starts], y[starts], x[starts + 1], y[starts + 1]
+        dx, dy = x2 - x1, y2 - y1
+        length2 = dx * dx + dy * dy
+        with np.errstate(invalid='ignore', divide='ignore'):
+            t = np.clip(np.where(length2 > 0, -(x1 * dx + y1 * dy) / length2, 0), 0, 1)
+        np.minimum.at(result, coord_feature[starts], np.hypot(x1 + t * dx, y1 + t * dy))
+
+        # Even-odd ray casting from the point for polygon features
+        polygonal = np.isin(geometry['geom_types'][coord_feature[starts]], POLYGON_TYPES)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            crosses = polygonal & ((y1 > 0) != (y2 > 0)) & (x1 - y1 * dx / dy > 0)
+        inside = np.bincount(coord_feature[starts][crosses], minlength=len(indices)) % 2 == 1
+        result[inside] = 0.0
+    return result
+
+def within_radius(layer, lon, lat, radius_km):
+    """Boolean mask of the layer's features lying at least partly within `radius_km` of a point"""
+    mask = np.zeros(len(layer), dtype=bool)
+    candidates = get_index(layer).query(*radius_bbox(lon, lat, radius_km))
+    mask[candidates[distances_km(layer, candidates, lon, lat) <= radius_km]] = True
+    return mask
@@ -0,0 +1,269 @@
+import contextvars
+import json
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Optional outputs: a JSON-lines span log, a Prometheus text file and an HTTP endpoint
+TRACE_LOG_PATH = os.getenv("GEOINT_TRACE_LOG")
+METRICS_FILE = os.getenv("GEOINT_METRICS_FILE")
+METRICS_HOST = os.getenv("GEOINT_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("GEOINT_METRICS_PORT", "0"))
+# Address the browser posts map timings to, if it differs from the bind address
+METRICS_PUBLIC_URL = os.getenv("GEOINT_METRICS_PUBLIC_URL", f"http://localhost:{METRICS_PORT}")
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+RECENT_SPANS = 500
+
+# Timings the map page may report; anything else is rejected to keep metric labels bounded
+BROWSER_STAGES = ('wfs_fetch', 'wfs_parse')
+# Extra fields a browser report may carry, with the types they must have
+BROWSER_ATTRIBUTES = {'layer': int, 'features': int, 'format': str}
+
+logger = logging.getLogger("geoint.telemetry")
+if TRACE_LOG_PATH:
+    _handler = logging.FileHandler(TRACE_LOG_PATH)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+_current_span = contextvars.ContextVar("geoint_span", default=None)
+
+class Span:
+    """One timed stage; attributes set while it is open end up in its log record"""
+
+    def __init__(self, name, parent, attributes):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes)
+        self.start = time.time()
+        self.duration = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self.start,
+            'duration_s': self.duration,
+            **self.attributes,
+        }
+
+def _label(value):
+    """A label value escaped for the Prometheus text format"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class _Metrics:
+    """Process-wide counters and latency histograms, rendered in Prometheus text format"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = defaultdict(lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+        self.latency_sum = defaultdict(float)
+        self.tokens = defaultdict(int)
+        self.cache = defaultdict(int)
+        self.errors = defaultdict(int)
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            buckets = self.latency[stage]
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    buckets[index] += 1
+            buckets[-1] += 1
+            self.latency_sum[stage] += seconds
+
+    def render(self):
+        lines = [
+            "# HELP geoint_stage_seconds Wall time of each pipeline stage",
+            "# TYPE geoint_stage_seconds histogram",
+        ]
+        with self.lock:
+            for stage, buckets in sorted(self.latency.items()):
+                stage = _label(stage)
+                for bound, count in zip(LATENCY_BUCKETS, buckets):
+                    lines.append(f'geoint_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'geoint_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {buckets[-1]}')
+                lines.append(f'geoint_stage_seconds_sum{{stage="{stage}"}} {self.latency_sum[stage]}')
+                lines.append(f'geoint_stage_seconds_count{{stage="{stage}"}} {buckets[-1]}')
+
+            lines += ["# HELP geoint_llm_tokens_total Tokens used by LLM calls", "# TYPE geoint_llm_tokens_total counter"]
+            for (model, kind), count in sorted(self.tokens.items()):
+                lines.append(f'geoint_llm_tokens_total{{model="{_label(model)}",type="{_label(kind)}"}} {count}')
+
+            lines += ["# HELP geoint_cache_requests_total LLM cache lookups", "# TYPE geoint_cache_requests_total counter"]
+            for (kind, result), count in sorted(self.cache.items()):
+                lines.append(f'geoint_cache_requests_total{{kind="{_label(kind)}",result="{_label(result)}"}} {count}')
+
+            lines += ["# HELP geoint_stage_errors_total Stages that raised", "# TYPE geoint_stage_errors_total counter"]
+            for stage, count in sorted(self.errors.items()):
+                lines.append(f'geoint_stage_errors_total{{stage="{_label(stage)}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+metrics = _Metrics()
+recent_spans = deque(maxlen=RECENT_SPANS)
+
+def _finish(span):
+    record = span.to_dict()
+    recent_spans.append(record)
+    metrics.observe(span.name, span.duration)
+    logger.info(json.dumps(record, default=str))
+    if METRICS_FILE and span.parent_id is None:
+        write_metrics(METRICS_FILE)
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Time a stage of the pipeline. Spans opened inside another span (including in worker
+    threads started through `propagate`) share its trace id.
+    """
+    current = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    except Exception as e:
+        current.set(error=str(e))
+        with metrics.lock:
+            metrics.errors[name] += 1
+        raise
+    finally:
+        current.duration = time.perf_counter() - start
+        _current_span.reset(token)
+        _finish(current)
+
+def current_span():
+    """Return the innermost open span, or None"""
+    return _current_span.get()
+
+def propagate(fn):
+    """Wrap a callable so it runs in a copy of the caller's context, keeping spans connected across threads"""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+def record_tokens(model, prompt_tokens, completion_tokens):
+    """Count LLM token usage and attach it to the current span"""
+    with metrics.lock:
+        metrics.tokens[(model, 'prompt')] += prompt_tokens or 0
+        metrics.tokens[(model, 'completion')] += completion_tokens or 0
+    current = _current_span.get()
+    if current:
+        current.set(model=model, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+def record_cache(kind, hit):
+    """Count an LLM cache lookup and attach the outcome to the current span"""
+    with metrics.lock:
+        metrics.cache[(kind, 'hit' if hit else 'miss')] += 1
+    current = _current_span.get()
+    if current:
+        current.set(cache='hit' if hit else 'miss')
+
+def record_browser_timing(trace_id, stage, seconds, **attributes):
+    """
+    Record a timing reported by the map's JavaScript as a span of the query's trace
+    Raises:
+        ValueError: unknown stage or attribute, or `seconds` is negative or not finite
+    """
+    if stage not in BROWSER_STAGES:
+        raise ValueError(f"Unknown browser stage: {stage}")
+    if not math.isfinite(seconds) or seconds < 0:
+        raise ValueError(f"Invalid browser timing: {seconds}")
+    for key, value in attributes.items():
+        kind = BROWSER_ATTRIBUTES.get(key)
+        if kind is None or not isinstance(value, kind) or isinstance(value, bool):
+            raise ValueError(f"Invalid browser timing attribute: {key}")
+    record = {
+        **attributes,
+        'trace_id': trace_id,
+        'span_id': uuid.uuid4().hex[:16],
+        'parent_id': None,
+        'name': f"browser.{stage}",
+        'start': time.time() - seconds,
+        'duration_s': seconds,
+    }
+    recent_spans.append(record)
+    metrics.observe(record['name'], seconds)
+    logger.info(json.dumps(record, default=str))
+
+def trace_spans(trace_id):
+    """Recent spans belonging to one trace, oldest first"""
+    return sorted((record for record in list(recent_spans) if record['trace_id'] == trace_id), key=lambda r: r['start'])
+
+def write_metrics(path):
+    """Write the Prometheus text exposition to a file (for node_exporter's textfile collector)"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(metrics.render())
+    os.replace(tmp_path, path)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path.split('?')[0] != '/browser':
+            self.send_error(404)
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            report = json.loads(self.rfile.read(min(length, 65536)))
+            # Fields other than the known extras are dropped rather than logged
+            record_browser_timing(
+                str(report.get('trace_id')),
+                str(report.get('stage')),
+                float(report.get('seconds')),
+                **{key: report[key] for key in BROWSER_ATTRIBUTES if key in report}
+            )
+        except (ValueError, TypeError, AttributeError):
+            self.send_error(400)
+            return
+        self.send_response(204)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+_server = None
+_server_lock = threading.Lock()
+
+def start_server():
+    """Start the /metrics and /browser endpoint once per process, if GEOINT_METRICS_PORT is set"""
+    global _server
+    if not METRICS_PORT:
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), _MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+        return _server
+
+def browser_report_url():
+    """URL the map should post timings to, or None when the endpoint is disabled"""
+    return f"{METRICS_PUBLIC_URL}/browser" if METRICS_PORT else None
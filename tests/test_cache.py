@@ -0,0 +1,40 @@
+import pytest
+import cache
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'time', lambda: now[0])
+    return now
+
+def make_cache(tmp_path, **kwargs):
+    return cache.QueryCache(str(tmp_path / 'cache.sqlite'), **kwargs)
+
+def test_queries_differing_in_spelling_share_an_entry(tmp_path, clock):
+    store = make_cache(tmp_path)
+    store.set('spec', "Traffic  density > 2?", 'model', 'v1', {'radius_km': 1})
+    assert store.get('spec', " traffic density > 2", 'model', 'v1') == {'radius_km': 1}
+    assert store.get('spec', "traffic density > 2", 'model', 'v2') is None
+
+def test_entries_expire_after_the_ttl(tmp_path, clock):
+    store = make_cache(tmp_path, ttl=60)
+    store.set('spec', "query", 'model', 'v1', [1])
+    clock[0] += 60
+    assert store.get('spec', "query", 'model', 'v1') == [1]
+    clock[0] += 1
+    assert store.get('spec', "query", 'model', 'v1') is None
+    assert store.stats() == {'hits': 1, 'misses': 1, 'entries': 0}
+
+def test_least_recently_used_entry_is_evicted(tmp_path, clock):
+    store = make_cache(tmp_path, max_entries=2)
+    for query in ("first", "second"):
+        clock[0] += 1
+        store.set('spec', query, 'model', 'v1', query)
+    clock[0] += 1
+    assert store.get('spec', "first", 'model', 'v1') == "first"
+    clock[0] += 1
+    store.set('spec', "third", 'model', 'v1', "third")
+    assert store.get('spec', "second", 'model', 'v1') is None
+    assert store.get('spec', "first", 'model', 'v1') == "first"
+    assert store.get('spec', "third", 'model', 'v1') == "third"
+    assert store.stats()['entries'] == 2
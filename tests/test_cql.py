@@ -0,0 +1,96 @@
+"""
+Local CQL engine over a synthetic traffic layer: fixtures/traffic_layer.geojson is a
+hand-built layer of four roads on two days and fixtures/traffic_expected.json lists, for
+each CQL_FILTER, the feature ids worked out by hand from the CQL/WFS 2.0 semantics (BBOX
+on EPSG:4326 is latitude first). These are not captured GeoServer responses.
+"""
+import json
+from pathlib import Path
+import pandas as pd
+import pytest
+import cql
+from feature_store import LayerData, _features_to_frame
+from filter_spec import render_cql
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+
+CASES = json.loads((FIXTURES / 'traffic_expected.json').read_text())
+
+BBOX = "BBOX(geom,-26.068076,28.050553,-26.05009,28.070575)"
+
+# Envelope of road A alone: latitudes -26.0591..-26.0584, longitudes 28.0599..28.0611
+ROAD_A = (28.0599, -26.0591, 28.0611, -26.0584)
+
+@pytest.fixture(scope='module')
+def layer():
+    features = json.loads((FIXTURES / 'traffic_layer.geojson').read_text())['features']
+    attributes, geometry = _features_to_frame(features)
+    return LayerData('mtn:mtn_rivonia_geom_traffic', attributes, geometry)
+
+def matched_ids(layer, cql_filter):
+    return sorted(layer.attributes['fid'][cql.evaluate(layer, cql_filter)])
+
+@pytest.mark.parametrize('case', CASES, ids=[case['cql_filter'] for case in CASES])
+def test_evaluate(layer, case):
+    assert matched_ids(layer, case['cql_filter']) == sorted(case['ids'])
+
+@pytest.mark.parametrize('case', CASES, ids=[case['cql_filter'] for case in CASES])
+def test_evaluate_on_datetime_column(layer, case):
+    # The feature store may hold daily_ts as timestamps rather than the strings WFS returns
+    attributes = layer.attributes.assign(daily_ts=pd.to_datetime(layer.attributes['daily_ts'], utc=True))
+    stored = LayerData(layer.type_name, attributes, layer.geometry)
+    assert matched_ids(stored, case['cql_filter']) == sorted(case['ids'])
+
+def test_bbox_is_latitude_first(layer):
+    min_lon, min_lat, max_lon, max_lat = ROAD_A
+    latitude_first = f"BBOX(geom,{min_lat},{min_lon},{max_lat},{max_lon})"
+    longitude_first = f"BBOX(geom,{min_lon},{min_lat},{max_lon},{max_lat})"
+    assert matched_ids(layer, latitude_first) == ['mtn_rivonia_geom_traffic.1', 'mtn_rivonia_geom_traffic.5']
+    assert matched_ids(layer, longitude_first) == []
+
+def test_bbox_rendered_by_filter_spec_selects_inside_the_box(layer):
+    spec = {'predicates': [], 'combine': 'AND', 'days': None, 'time_range': None, 'aggregate': False, 'radius_km': 1.0}
+    cql_filter = render_cql('traffic', spec, include_bbox=True, bbox=ROAD_A)
+    assert matched_ids(layer, cql_filter) == ['mtn_rivonia_geom_traffic.1', 'mtn_rivonia_geom_traffic.5']
+
+def test_empty_filter_selects_everything(layer):
+    assert cql.evaluate(layer, None).all()
+    assert cql.evaluate(layer, '').all()
+
+def test_parse_and_binds_tighter_than_or():
+    assert cql.parse("day='Monday' OR day='Tuesday' AND avg_hits>1") == (
+        'or',
+        ('cmp', '=', 'day', 'Monday'),
+        ('and', ('cmp', '=', 'day', 'Tuesday'), ('cmp', '>', 'avg_hits', 1)),
+    )
+
+def test_parse_parentheses():
+    assert cql.parse("(avg_traffic_den>2 OR avg_hits<=1500) AND day='Monday'") == (
+        'and',
+        ('or', ('cmp', '>', 'avg_traffic_den', 2), ('cmp', '<=', 'avg_hits', 1500)),
+        ('cmp', '=', 'day', 'Monday'),
+    )
+
+def test_parse_daily_ts_equality():
+    assert cql.parse("daily_ts='2024-01-01T00:00:00Z'") == ('cmp', '=', 'daily_ts', '2024-01-01T00:00:00Z')
+
+def test_parse_day_in_and_between():
+    assert cql.parse("day IN ('Monday','Tuesday')") == ('in', 'day', ['Monday', 'Tuesday'])
+    assert cql.parse("avg_traffic_den NOT BETWEEN 1 AND 3") == ('not', ('between', 'avg_traffic_den', 1, 3))
+
+def test_parse_bbox():
+    assert cql.parse(BBOX) == ('bbox', 'geom', -26.068076, 28.050553, -26.05009, 28.070575)
+
+@pytest.mark.parametrize('cql_filter', [
+    "BBOX(geom,-26.07,28.05,-26.05,28.07,'EPSG:4326')",
+    "INTERSECTS(geom,POINT(28.06 -26.06))",
+    "avg_hits>",
+    "day LIKE 'Mon%'",
+])
+def test_unsupported_filters_raise(cql_filter):
+    with pytest.raises(cql.UnsupportedFilter):
+        cql.parse(cql_filter)
+
+def test_unknown_attribute_raises(layer):
+    with pytest.raises(cql.UnsupportedFilter):
+        cql.evaluate(layer, "avg_speed>2")
@@ -0,0 +1,45 @@
+import pytest
+from filter_spec import render_cql, validate_spec
+
+def spec(**fields):
+    return dict({'predicates': [{'attribute': 'avg_traffic_den', 'op': '>', 'value': 2}]}, **fields)
+
+def test_valid_spec_is_normalized():
+    validated = validate_spec('traffic', spec(days=['monday'], time_range={'start': '2024-01-01T00:00:00Z', 'end': '2024-01-07'},
+                                              radius_km='2'))
+    assert validated['days'] == ['Monday']
+    assert validated['time_range'] == {'start': '2024-01-01', 'end': '2024-01-07'}
+    assert validated['radius_km'] == 2.0
+    assert render_cql('traffic', validated, include_bbox=False) == (
+        "avg_traffic_den>2 AND day='Monday' AND daily_ts>='2024-01-01T00:00:00Z' AND daily_ts<='2024-01-07T00:00:00Z'"
+    )
+
+def test_empty_time_range_is_dropped():
+    assert validate_spec('traffic', spec(time_range={'start': None, 'end': ''}))['time_range'] is None
+
+@pytest.mark.parametrize('fields', [
+    {'time_range': '2024-01-01'},
+    {'time_range': ['2024-01-01', '2024-01-02']},
+    {'time_range': {'start': 20240101}},
+    {'time_range': {'start': "2024-01-01' OR 1=1 OR daily_ts='"}},
+    {'time_range': {'start': '2024-13-01'}},
+    {'time_range': {'start': '2024-01-07', 'end': '2024-01-01'}},
+    {'days': 'Monday'},
+    {'days': [1]},
+    {'days': [None]},
+    {'days': ['Someday']},
+    {'predicates': {'attribute': 'avg_traffic_den'}},
+    {'predicates': ['avg_traffic_den>2']},
+    {'radius_km': [1]},
+    {'radius_km': 'far'},
+    {'radius_km': -1},
+])
+def test_malformed_specs_raise_value_error(fields):
+    with pytest.raises(ValueError):
+        validate_spec('traffic', spec(**fields))
+
+def test_footfall_has_no_days_or_time_range():
+    with pytest.raises(ValueError):
+        validate_spec('footfall', {'predicates': [], 'days': ['Monday']})
+    with pytest.raises(ValueError):
+        validate_spec('footfall', {'predicates': [], 'time_range': {'start': '2024-01-01'}})
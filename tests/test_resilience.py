@@ -0,0 +1,76 @@
+from resilience import CircuitBreaker, LatencyTracker
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def opened(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    breaker.record_failure()
+    return breaker
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=Clock())
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == 'closed' and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open' and breaker.opened == 1
+    assert not breaker.allow()
+
+def test_half_open_lets_one_trial_through():
+    clock = Clock()
+    breaker = opened(clock)
+    clock.now = 9.9
+    assert not breaker.allow()
+    clock.now = 10
+    assert breaker.allow()
+    assert breaker.state == 'half_open'
+    assert not breaker.allow()
+
+def test_trial_success_closes():
+    clock = Clock()
+    breaker = opened(clock)
+    clock.now = 10
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed' and breaker.failures == 0
+    assert breaker.allow() and breaker.allow()
+
+def test_trial_failure_reopens():
+    clock = Clock()
+    breaker = opened(clock)
+    clock.now = 10
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open' and breaker.opened == 2
+    clock.now = 19.9
+    assert not breaker.allow()
+    clock.now = 20
+    assert breaker.allow()
+
+def test_release_frees_the_trial_without_closing():
+    clock = Clock()
+    breaker = opened(clock)
+    clock.now = 10
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == 'half_open'
+    assert breaker.allow()
+    assert not breaker.allow()
+
+def test_latency_quantile_needs_enough_samples():
+    tracker = LatencyTracker(window=10, min_samples=5)
+    for seconds in range(4):
+        tracker.record('llm', seconds)
+    assert tracker.quantile('llm', 0.5) is None
+    for seconds in range(4, 20):
+        tracker.record('llm', seconds)
+    # Only the last 10 samples (10..19) are kept
+    assert tracker.quantile('llm', 0.0) == 10
+    assert tracker.quantile('llm', 1.0) == 19
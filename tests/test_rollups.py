@@ -0,0 +1,74 @@
+import copy
+import numpy as np
+import pytest
+import rollups
+from benchmarks.mock_geoserver import traffic_features
+from feature_store import LayerData, _features_to_frame
+
+TYPE_NAME = 'mtn:mtn_rivonia_geom_traffic'
+
+class Store:
+    """Stands in for the feature store, holding one traffic layer"""
+
+    def __init__(self, features):
+        self.layer = None
+        self.refresh(features)
+
+    def refresh(self, features):
+        attributes, geometry = _features_to_frame(features)
+        self.layer = LayerData(TYPE_NAME, attributes, geometry)
+
+    def load(self, type_name):
+        return self.layer if type_name == TYPE_NAME else None
+
+def aggregate(spec=None, **changes):
+    spec = spec or {'predicates': [], 'combine': 'AND', 'days': None, 'time_range': None, 'aggregate': True, 'radius_km': None}
+    return dict(spec, **changes)
+
+def sorted_table(table, name):
+    return table.sort_values(rollups.ROLLUPS[name]).reset_index(drop=True)
+
+@pytest.fixture
+def features():
+    return traffic_features(roads=20, days=10, vertices=5)
+
+def test_refresh_replacing_the_watermark_day_matches_a_rebuild(tmp_path, features):
+    store = Store([feature for feature in features if feature['properties']['daily_ts'] < '2024-01-09'])
+    incremental = rollups.Rollups('traffic', store=store, root=tmp_path / 'incremental')
+    assert incremental.update() == 160
+
+    # The refresh rewrites the watermark day (2024-01-08) and adds two more days
+    refreshed = copy.deepcopy(features)
+    for feature in refreshed:
+        if feature['properties']['daily_ts'].startswith('2024-01-08'):
+            feature['properties']['avg_traffic_den'] += 5
+    store.refresh(refreshed)
+    assert incremental.update() == 60
+
+    rebuilt = rollups.Rollups('traffic', store=store, root=tmp_path / 'rebuilt')
+    rebuilt.update(rebuild=True)
+    for name in rollups.ROLLUPS:
+        left, right = sorted_table(incremental.tables[name], name), sorted_table(rebuilt.tables[name], name)
+        additive = [column for column in left.columns if column.endswith(('_sum', '_count')) or column == 'rows']
+        assert len(left) == len(right)
+        np.testing.assert_allclose(left[additive].to_numpy(float), right[additive].to_numpy(float))
+        assert (left['fid'] == right['fid']).all()
+
+def test_rollups_reload_from_disk(tmp_path, features):
+    store = Store(features)
+    rollups.Rollups('traffic', store=store, root=tmp_path).update()
+    reloaded = rollups.Rollups('traffic', store=store, root=tmp_path)
+    assert reloaded.watermark == '2024-01-10T00:00:00+00:00'
+    assert len(reloaded.watermark_tables['segment']) == 20
+    assert reloaded.update() == 20
+
+def test_predicate_on_a_daily_column_falls_back(features):
+    spec = aggregate(predicates=[{'attribute': 'day', 'op': '=', 'value': 'Monday'}])
+    assert rollups.query_spec('traffic', spec, store=Store(features)) is None
+
+def test_average_predicate(features):
+    store = Store(features)
+    everything = rollups.query_spec('traffic', aggregate(), store=store)
+    dense = rollups.query_spec('traffic', aggregate(predicates=[{'attribute': 'avg_traffic_den', 'op': '>', 'value': 2.4}]), store=store)
+    assert len(everything['features']) == 20
+    assert all(feature['properties']['avg_traffic_den'] > 2.4 for feature in dense['features'])
@@ -0,0 +1,64 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import schema
+
+class SlowGeoServer(BaseHTTPRequestHandler):
+    """DescribeFeatureType answers after `delay` seconds; GetFeature returns two features"""
+    delay = 0.0
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        if 'DescribeFeatureType' in self.path:
+            body = {'featureTypes': [{'properties': [
+                {'name': 'avg_traffic_den', 'type': 'xsd:double'}, {'name': 'geom', 'type': 'gml:LineString'},
+            ]}]}
+        else:
+            body = {'features': [{'properties': {'avg_traffic_den': 1.0}}, {'properties': {'avg_traffic_den': 3.0}}]}
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def geoserver(monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SlowGeoServer)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(schema, 'WFS_BASE_URL', f"http://127.0.0.1:{server.server_address[1]}/ows")
+    yield SlowGeoServer
+    SlowGeoServer.delay = 0.0
+    server.shutdown()
+
+def wait_for_stats(registry, dataset, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if registry.schema(dataset)['avg_traffic_den']['stats'].get('max') == 3.0:
+            return True
+        time.sleep(0.05)
+    return False
+
+def test_uncached_schema_does_not_block_on_a_slow_geoserver(tmp_path, geoserver, monkeypatch):
+    monkeypatch.setattr(schema, 'SCHEMA_REQUEST_TIMEOUT', 0.2)
+    geoserver.delay = 1.0
+    registry = schema.SchemaRegistry(cache_path=tmp_path / 'schema.json')
+    start = time.monotonic()
+    attributes = registry.schema('traffic')
+    assert time.monotonic() - start < 0.9
+    assert 'avg_traffic_den' in attributes
+
+def test_statistics_arrive_in_the_background_and_change_the_fingerprint(tmp_path, geoserver):
+    cache_path = tmp_path / 'schema.json'
+    registry = schema.SchemaRegistry(cache_path=cache_path)
+    before = registry.fingerprint('traffic')
+    assert wait_for_stats(registry, 'traffic')
+    assert registry.fingerprint('traffic') != before
+    # Written to disk, so the next process starts with the statistics
+    assert schema.SchemaRegistry(cache_path=cache_path).fingerprint('traffic') == registry.fingerprint('traffic')
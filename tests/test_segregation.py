@@ -0,0 +1,32 @@
+import pytest
+from segregation import classify_query
+
+@pytest.mark.parametrize('query, traffic, footfall', [
+    ("Within 8 km show traffic density > 2 on Monday and morning footfall > 3",
+     "Within 8 km show traffic density > 2 on Monday", "morning footfall > 3 Within 8 km"),
+    ("Footfall > 1 within 6 km and roads with traffic density > 2.5",
+     "roads with traffic density > 2.5 within 6 km", "Footfall > 1 within 6 km"),
+    ("traffic density > 2 within 5 km and footfall > 3 within 2 km",
+     "traffic density > 2 within 5 km", "footfall > 3 within 2 km"),
+    # Days pick rows on traffic but columns on footfall, so they are never copied
+    ("footfall > 3 on weekends and traffic density > 2", "traffic density > 2", "footfall > 3 on weekends"),
+    # The footfall layer has no time attribute to take a date range
+    ("traffic density > 2 since 2024-01-01 and footfall > 3", "traffic density > 2 since 2024-01-01", "footfall > 3"),
+    ("footfall > 3 last 2 weeks and traffic density > 2", "traffic density > 2 last 2 weeks", "footfall > 3 last 2 weeks"),
+])
+def test_embedded_phrases_are_shared(query, traffic, footfall):
+    result, confidence = classify_query(query)
+    assert result == {'traffic_query': traffic, 'footfall_query': footfall}
+    assert confidence == 1.0
+
+def test_shared_clause_goes_to_both():
+    result, _ = classify_query("within 5 km, traffic density > 2 and footfall > 1")
+    assert result == {'traffic_query': "within 5 km, traffic density > 2", 'footfall_query': "within 5 km and footfall > 1"}
+
+def test_single_component():
+    result, _ = classify_query("roads with traffic density > 2")
+    assert result == {'traffic_query': "roads with traffic density > 2", 'footfall_query': None}
+
+def test_mixed_clause_is_left_to_the_llm():
+    _, confidence = classify_query("busy roads near high footfall areas")
+    assert confidence < 0.75
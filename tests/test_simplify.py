@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+import simplify
+
+LINES = [[[28.05, -26.06], [28.06, -26.05]], [[28.06, -26.06], [28.07, -26.055], [28.07, -26.05]]]
+SQUARE = [[28.0, -26.1], [28.01, -26.1], [28.01, -26.09], [28.0, -26.09], [28.0, -26.1]]
+HOLE = [[28.004, -26.096], [28.006, -26.096], [28.006, -26.094], [28.004, -26.094], [28.004, -26.096]]
+OTHER = [[28.05, -26.05], [28.06, -26.05], [28.06, -26.04], [28.05, -26.05]]
+
+def collection(*geometries):
+    return {'type': 'FeatureCollection', 'features': [
+        {'type': 'Feature', 'id': f"f.{index}", 'geometry': geometry, 'properties': {'index': index}}
+        for index, geometry in enumerate(geometries)
+    ]}
+
+def decode(topology, arc):
+    """Coordinates of one arc, undoing the delta encoding and quantization"""
+    transform = topology['transform']
+    return np.cumsum(topology['arcs'][arc], axis=0) * transform['scale'] + transform['translate']
+
+def test_multilinestring_arcs_are_one_list_per_line():
+    topology = simplify.to_topojson(collection({'type': 'MultiLineString', 'coordinates': LINES}))
+    [geometry] = topology['objects']['layer']['geometries']
+    assert geometry['arcs'] == [[0], [1]]
+    for arc, line in zip((0, 1), LINES):
+        np.testing.assert_allclose(decode(topology, arc), line, atol=1e-6)
+
+def test_multipolygon_arcs_are_one_list_per_ring_per_polygon():
+    topology = simplify.to_topojson(collection({'type': 'MultiPolygon', 'coordinates': [[SQUARE, HOLE], [OTHER]]}))
+    [geometry] = topology['objects']['layer']['geometries']
+    assert geometry['arcs'] == [[[0], [1]], [[2]]]
+    for arc, ring in zip((0, 1, 2), (SQUARE, HOLE, OTHER)):
+        np.testing.assert_allclose(decode(topology, arc), ring, atol=1e-6)
+
+def test_ids_properties_and_empty_geometries_are_kept():
+    topology = simplify.to_topojson(collection({'type': 'Point', 'coordinates': [28.0, -26.1]}, None))
+    point, empty = topology['objects']['layer']['geometries']
+    assert point['id'] == 'f.0' and point['properties'] == {'index': 0}
+    assert empty == {'type': None, 'id': 'f.1', 'properties': {'index': 1}}
+
+def test_douglas_peucker_drops_only_collinear_vertices():
+    coords = np.array([[0, 0], [1, 0.001], [2, 0], [3, 1], [4, 0]], dtype=float)
+    assert simplify.douglas_peucker(coords, 0.01).tolist() == [True, False, True, True, True]
+
+def test_tolerance_defaults_to_the_collection_latitude():
+    # A 6.7 m bend: over a zoom 14 pixel at latitude 60 (4.8 m) but under one at the equator (9.6 m)
+    features = collection({'type': 'LineString', 'coordinates': [[0.0, 60.0], [0.0005, 60.00006], [0.001, 60.0]]})
+    assert simplify._middle_latitude(features) == pytest.approx(60.00003)
+    assert len(simplify.simplify_features(features, zoom=14)['features'][0]['geometry']['coordinates']) == 3
+    assert len(simplify.simplify_features(features, zoom=14, latitude=0)['features'][0]['geometry']['coordinates']) == 2
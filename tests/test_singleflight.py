@@ -0,0 +1,59 @@
+import threading
+import pytest
+from singleflight import SingleFlight
+
+def run_concurrently(flight, key, fn, callers):
+    """Call flight.do from `callers` threads; returns each caller's result or exception"""
+    outcomes = [None] * callers
+
+    def call(index):
+        try:
+            outcomes[index] = flight.do(key, fn)
+        except Exception as e:
+            outcomes[index] = e
+
+    threads = [threading.Thread(target=call, args=(index,)) for index in range(callers)]
+    for thread in threads:
+        thread.start()
+    return threads, outcomes
+
+def test_concurrent_callers_share_one_result():
+    flight, release, calls = SingleFlight(), threading.Event(), []
+
+    def work():
+        calls.append(1)
+        release.wait(5)
+        return {'rows': 3}
+
+    threads, outcomes = run_concurrently(flight, 'key', work, 4)
+    while flight.calls + flight.shared < 4:
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1
+    assert flight.calls == 1 and flight.shared == 3
+    assert all(outcome is outcomes[0] for outcome in outcomes)
+
+def test_concurrent_callers_share_one_exception():
+    flight, release = SingleFlight(), threading.Event()
+
+    def work():
+        release.wait(5)
+        raise RuntimeError("GeoServer unavailable")
+
+    threads, outcomes = run_concurrently(flight, 'key', work, 3)
+    while flight.calls + flight.shared < 3:
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert isinstance(outcomes[0], RuntimeError)
+    assert all(outcome is outcomes[0] for outcome in outcomes)
+
+def test_nothing_is_kept_after_the_call():
+    flight = SingleFlight()
+    with pytest.raises(ValueError):
+        flight.do('key', int, 'x')
+    assert flight.do('key', int, '7') == 7
+    assert flight.calls == 2 and flight.shared == 0
@@ -0,0 +1,48 @@
+import pytest
+import sites
+import spatial
+from feature_store import LayerData, _features_to_frame
+from filter_spec import MALL_LATITUDE, MALL_LONGITUDE
+
+TYPE_NAME = 'mtn:mtn_rivonia_ff_dataset'
+
+class Store:
+    """Stands in for the feature store, holding one footfall layer"""
+
+    def __init__(self, features):
+        attributes, geometry = _features_to_frame(features)
+        self.layer = LayerData(TYPE_NAME, attributes, geometry)
+
+    def load(self, type_name):
+        return self.layer if type_name == TYPE_NAME else None
+
+def point(fid, lon, lat):
+    return {'type': 'Feature', 'id': fid, 'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+            'properties': {'ff_rivil': 1.0}}
+
+def spec(radius_km):
+    return {'predicates': [], 'combine': 'AND', 'days': None, 'time_range': None, 'aggregate': False, 'radius_km': radius_km}
+
+@pytest.fixture
+def store():
+    min_lon, min_lat, _, _ = spatial.radius_bbox(MALL_LONGITUDE, MALL_LATITUDE, 1.0)
+    # The second point sits in the corner of the radius's bounding box, about 1.4 km from the mall
+    return Store([
+        point('ff.1', MALL_LONGITUDE, MALL_LATITUDE),
+        point('ff.2', min_lon + 0.0005, min_lat + 0.0005),
+        point('ff.3', MALL_LONGITUDE + 0.1, MALL_LATITUDE),
+    ])
+
+def matched(store, radius_km):
+    urls = sites.build_site_urls('footfall', spec(radius_km), ['rivonia'])
+    results, oversized = sites.fetch_sites(urls, store)
+    layer, mask = results['rivonia']
+    assert oversized == []
+    return sorted(layer.attributes['fid'][mask])
+
+def test_sites_are_split_on_the_exact_radius(store):
+    assert matched(store, 1.0) == ['ff.1']
+
+def test_circle_is_recorded_only_with_a_radius():
+    assert sites.build_site_urls('footfall', spec(2.0), ['rivonia'])['rivonia']['circle'] == (MALL_LONGITUDE, MALL_LATITUDE, 2.0)
+    assert sites.build_site_urls('footfall', spec(None), ['rivonia'])['rivonia']['circle'] is None
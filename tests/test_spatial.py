@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+import spatial
+from feature_store import LayerData, _features_to_frame
+
+CENTRE = (28.060564, -26.059083)
+
+@pytest.fixture(scope='module')
+def points():
+    rng = np.random.default_rng(0)
+    coords = np.column_stack([CENTRE[0] + rng.uniform(-0.1, 0.1, 500), CENTRE[1] + rng.uniform(-0.1, 0.1, 500)])
+    features = [{'type': 'Feature', 'id': f"p.{index}", 'geometry': {'type': 'Point', 'coordinates': coord.tolist()},
+                 'properties': {}} for index, coord in enumerate(coords)]
+    attributes, geometry = _features_to_frame(features)
+    return coords, LayerData('points', attributes, geometry)
+
+def test_grid_index_matches_a_brute_force_box_test():
+    rng = np.random.default_rng(1)
+    low = np.column_stack([rng.uniform(28.0, 28.1, 300), rng.uniform(-26.1, -26.0, 300)])
+    bounds = np.hstack([low, low + rng.uniform(0, 0.03, (300, 2))])
+    bounds[::50] = np.nan
+    index = spatial.GridIndex(bounds)
+    for _ in range(50):
+        min_lon, min_lat = rng.uniform(27.99, 28.1), rng.uniform(-26.11, -26.0)
+        box = (min_lon, min_lat, min_lon + rng.uniform(0, 0.05), min_lat + rng.uniform(0, 0.05))
+        expected = np.flatnonzero((bounds[:, 0] <= box[2]) & (bounds[:, 2] >= box[0])
+                                  & (bounds[:, 1] <= box[3]) & (bounds[:, 3] >= box[1]))
+        assert sorted(index.query(*box)) == list(expected)
+
+def test_box_outside_the_grid_is_empty():
+    index = spatial.GridIndex(np.array([[28.0, -26.1, 28.01, -26.09]]))
+    assert len(index.query(29.0, -25.0, 29.1, -24.9)) == 0
+
+@pytest.mark.parametrize('radius_km', [0.5, 2.0, 7.5])
+def test_within_radius_matches_haversine(points, radius_km):
+    coords, layer = points
+    distances = spatial.haversine_km(CENTRE[0], CENTRE[1], coords[:, 0], coords[:, 1])
+    mask = spatial.within_radius(layer, *CENTRE, radius_km)
+    # The local plane projection may disagree with the great circle only within a metre of the edge
+    edge = np.abs(distances - radius_km) < 0.001
+    assert (mask[~edge] == (distances[~edge] <= radius_km)).all()
+    assert mask.any()
+
+def test_radius_bbox_contains_the_circle():
+    min_lon, min_lat, max_lon, max_lat = spatial.radius_bbox(*CENTRE, 3.0)
+    assert spatial.haversine_km(CENTRE[0], CENTRE[1], CENTRE[0], max_lat) == pytest.approx(3.0)
+    assert spatial.haversine_km(CENTRE[0], CENTRE[1], max_lon, CENTRE[1]) == pytest.approx(3.0, rel=1e-4)
+    assert min_lon < CENTRE[0] < max_lon and min_lat < CENTRE[1] < max_lat
@@ -0,0 +1,46 @@
+import json
+import threading
+import pytest
+import requests
+import telemetry
+
+@pytest.fixture(scope='module')
+def server():
+    server = telemetry.ThreadingHTTPServer(('127.0.0.1', 0), telemetry._MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+def post(server, report):
+    return requests.post(f"{server}/browser", data=json.dumps(report), timeout=5).status_code
+
+def test_browser_timing_keeps_its_fixed_fields(server):
+    report = {'trace_id': 'fixed-fields', 'stage': 'wfs_parse', 'seconds': 0.5, 'layer': 1, 'features': 10,
+              'format': 'Topology', 'name': 'evil', 'start': 0, 'duration_s': 99}
+    assert post(server, report) == 204
+    [record] = telemetry.trace_spans('fixed-fields')
+    assert record['name'] == 'browser.wfs_parse'
+    assert record['duration_s'] == 0.5
+    assert record['start'] > 0
+    assert {record[key] for key in ('layer', 'features', 'format')} == {1, 10, 'Topology'}
+    assert 'evil' not in telemetry.metrics.render()
+
+@pytest.mark.parametrize('report', [
+    {'stage': 'wfs_fetch', 'seconds': 'nan'},
+    {'stage': 'wfs_fetch', 'seconds': 'inf'},
+    {'stage': 'wfs_fetch', 'seconds': -1},
+    {'stage': 'wfs_fetch'},
+    {'stage': 'anything', 'seconds': 1},
+    {'stage': 'wfs_fetch', 'seconds': 1, 'layer': 'x'},
+])
+def test_invalid_browser_timings_are_rejected(server, report):
+    assert post(server, dict(report, trace_id='rejected')) == 400
+    assert telemetry.trace_spans('rejected') == []
+
+def test_non_object_report_is_rejected(server):
+    assert requests.post(f"{server}/browser", data='[1]', timeout=5).status_code == 400
+
+def test_label_values_are_escaped():
+    metrics = telemetry._Metrics()
+    metrics.observe('a"b\\c\nd', 0.1)
+    assert 'stage="a\\"b\\\\c\\nd"' in metrics.render()
@@ -0,0 +1,43 @@
+import pytest
+import cql
+import urlnorm
+
+WFS = "https://Geo.Example.com:443/geoserver/mtn/ows"
+
+@pytest.mark.parametrize('cql_filter', [
+    "avg_traffic_den > 2 and day = 'Monday'",
+    "(avg_traffic_den>2 OR avg_hits<=1500) AND day IN ('Monday','Tuesday')",
+    "avg_hits NOT BETWEEN 1 AND 3 AND BBOX(geom,-26.0680761,28.0505529,-26.0500904,28.0705751)",
+    "day='O''Brien' OR NOT (avg_hits>1 AND avg_hits<2)",
+])
+def test_canonical_cql_round_trips(cql_filter):
+    canonical = urlnorm.canonical_cql(cql_filter)
+    assert urlnorm.canonical_cql(canonical) == canonical
+    assert cql.parse(urlnorm.canonical_cql(cql_filter, precision=12)) == cql.parse(cql_filter)
+
+def test_canonical_cql_spelling():
+    assert urlnorm.canonical_cql("avg_traffic_den > 2 and (day = 'Monday')") == "avg_traffic_den>2 AND day='Monday'"
+    assert urlnorm.canonical_cql("BBOX(geom,-26.0680761,28.05,-26.05,28.07)") == "BBOX(geom,-26.068076,28.05,-26.05,28.07)"
+
+def test_canonical_cql_repairs_attribute_case():
+    assert urlnorm.canonical_cql("AVG_TRAFFIC_DEN>2", 'mtn:mtn_rivonia_geom_traffic') == "avg_traffic_den>2"
+    with pytest.raises(urlnorm.InvalidURL):
+        urlnorm.canonical_cql("avg_speed>2", 'mtn:mtn_rivonia_geom_traffic')
+
+def test_equivalent_urls_share_a_canonical_form():
+    first = urlnorm.canonicalize(
+        f"{WFS}?service=wfs&request=getfeature&typeNames=mtn:mtn_rivonia_geom_traffic"
+        "&bbox=28.07,-26.05,28.05,-26.07&CQL_FILTER=avg_traffic_den%20%3E%202"
+    )
+    second = urlnorm.canonicalize(
+        "https://geo.example.com/geoserver/mtn/ows?CQL_FILTER=avg_traffic_den>2&bbox=28.05,-26.07,28.07,-26.05"
+        "&REQUEST=GetFeature&TYPENAMES=mtn:mtn_rivonia_geom_traffic&SERVICE=WFS"
+    )
+    assert first == second
+    assert urlnorm.canonicalize(first) == first
+    assert first.startswith("https://geo.example.com/geoserver/mtn/ows?bbox=28.05%2C-26.07%2C28.07%2C-26.05")
+
+@pytest.mark.parametrize('query', ["bbox=1,2,3", "bbox=1,2,1,4", "bbox=a,b,c,d", "cql_filter=avg_hits>"])
+def test_invalid_urls_raise(query):
+    with pytest.raises(urlnorm.InvalidURL):
+        urlnorm.canonicalize(f"{WFS}?{query}")
@@ -0,0 +1,248 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, urlencode, quote
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from singleflight import SingleFlight
+import urlnorm
+
+load_dotenv()
+
+# Set GEOINT_TILE_PROXY=1 to route map tiles through the local proxy
+TILE_PROXY_ENABLED = os.getenv("GEOINT_TILE_PROXY", "0") == "1"
+TILE_PROXY_HOST = os.getenv("GEOINT_TILE_PROXY_HOST", "127.0.0.1")
+TILE_PROXY_PORT = int(os.getenv("GEOINT_TILE_PROXY_PORT", "8765"))
+# Address the browser uses to reach the proxy, if it differs from the bind address
+TILE_PROXY_PUBLIC_URL = os.getenv("GEOINT_TILE_PROXY_PUBLIC_URL", f"http://localhost:{TILE_PROXY_PORT}/wms")
+
+TILE_CACHE_DIR = os.getenv("GEOINT_TILE_CACHE_DIR", ".geoint_tiles")
+TILE_CACHE_MAX_BYTES = int(os.getenv("GEOINT_TILE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Seconds a cached tile is served before it is fetched again, so data GeoServer updates shows up (0 keeps tiles forever)
+TILE_CACHE_TTL = float(os.getenv("GEOINT_TILE_CACHE_TTL", str(24 * 60 * 60)))
+TILE_UPSTREAM_POOL_SIZE = int(os.getenv("GEOINT_TILE_UPSTREAM_POOL_SIZE", "16"))
+
+WMS_UPSTREAM_URL = os.getenv("GEOINT_WMS_UPSTREAM_URL", "https://mapstack2.mapit.co.za/geoserver/mtn/wms")
+
+# Half the width of the EPSG:3857 world, used to turn tile bboxes back into z/x/y
+WEB_MERCATOR_EXTENT = 20037508.342789244
+
+def tile_key(params):
+    """
+    Cache key for a GetMap request: layer, canonical filter, style, format, transparency and CRS, plus
+    z/x/y for requests on the standard EPSG:3857 tile grid or the rounded bbox for anything else
+    Raises:
+        urlnorm.InvalidURL: the CQL_FILTER is malformed or names unknown attributes
+    """
+    # OpenLayers appends its tile parameters after any already in the URL, so the last value wins
+    lowered = {key.lower(): values[-1] for key, values in params.items()}
+    cql_filter = lowered.get('cql_filter')
+    parts = [
+        lowered.get('layers', ''),
+        urlnorm.canonical_cql(cql_filter, lowered.get('layers')) if cql_filter else '',
+        lowered.get('styles', ''),
+        lowered.get('format', ''),
+        lowered.get('transparent', '').lower(),
+        lowered.get('srs') or lowered.get('crs', ''),
+        lowered.get('width', ''),
+        lowered.get('height', ''),
+    ]
+
+    try:
+        min_x, min_y, max_x, max_y = (float(value) for value in lowered.get('bbox', '').split(','))
+    except ValueError:
+        min_x = min_y = max_x = max_y = None
+
+    tile = None
+    if min_x is not None and parts[5].upper() == 'EPSG:3857' and max_x > min_x:
+        span = max_x - min_x
+        zoom = math.log2(2 * WEB_MERCATOR_EXTENT / span)
+        x = (min_x + WEB_MERCATOR_EXTENT) / span
+        y = (WEB_MERCATOR_EXTENT - max_y) / span
+        if all(abs(value - round(value)) < 1e-6 for value in (zoom, x, y)):
+            tile = f"{round(zoom)}/{round(x)}/{round(y)}"
+    if tile is None and min_x is not None:
+        tile = ",".join(f"{value:.6f}" for value in (min_x, min_y, max_x, max_y))
+    parts.append(tile or '')
+    return sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+class DiskLRU:
+    """
+    Size-bounded on-disk cache of tile bodies, evicting the least recently used first;
+    tiles older than `ttl` seconds (by file mtime) are treated as missing
+    """
+
+    def __init__(self, directory=TILE_CACHE_DIR, max_bytes=TILE_CACHE_MAX_BYTES, ttl=TILE_CACHE_TTL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        existing = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if not name.endswith('.tmp') and os.path.isfile(path):
+                stat = os.stat(path)
+                existing.append((stat.st_mtime, name, stat.st_size))
+        for stored_at, name, size in sorted(existing):
+            self._entries[name] = (size, stored_at)
+            self.total_bytes += size
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _remove(self, key):
+        """Drop an entry and its file; the caller holds the lock"""
+        size, _ = self._entries.pop(key, (0, None))
+        self.total_bytes -= size
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def get(self, key):
+        """Return the cached bytes for a key, or None if it is missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self.ttl and time.time() - entry[1] > self.ttl:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            with self._lock:
+                size, _ = self._entries.pop(key, (0, None))
+                self.total_bytes -= size
+            return None
+
+    def put(self, key, body):
+        """Store bytes under a key and evict old entries beyond the size cap"""
+        tmp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, self._path(key))
+
+        with self._lock:
+            size, _ = self._entries.pop(key, (0, None))
+            self.total_bytes += len(body) - size
+            self._entries[key] = (len(body), time.time())
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                self._remove(next(iter(self._entries)))
+
+class TileProxy:
+    """Serves WMS GetMap tiles from the disk cache, coalescing concurrent misses into one upstream request"""
+
+    def __init__(self, upstream_url=WMS_UPSTREAM_URL, cache=None, pool_size=TILE_UPSTREAM_POOL_SIZE):
+        self.upstream_url = upstream_url
+        self.cache = cache or DiskLRU()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.hits = 0
+        self.misses = 0
+        self._flights = SingleFlight()
+        self._lock = threading.Lock()
+
+    def fetch(self, query_string):
+        """
+        Return (status, content_type, body) for a GetMap query string
+        """
+        params = parse_qs(query_string, keep_blank_values=True)
+        try:
+            key = tile_key(params)
+        except urlnorm.InvalidURL as e:
+            # GeoServer would only answer with an error document
+            return 400, 'text/plain', str(e).encode('utf-8')
+
+        body = self.cache.get(key)
+        if body is not None:
+            with self._lock:
+                self.hits += 1
+            formats = [values[-1] for name, values in params.items() if name.lower() == 'format']
+            return 200, (formats or ['image/png'])[0], body
+
+        with self._lock:
+            self.misses += 1
+        return self._flights.do(key, self._fetch_upstream, key, query_string)
+
+    def _fetch_upstream(self, key, query_string):
+        try:
+            response = self.session.get(f"{self.upstream_url}?{query_string}", timeout=60)
+            content_type = response.headers.get('Content-Type', 'application/octet-stream')
+            # GeoServer reports errors as XML with status 200, so only images are cached
+            if response.status_code == 200 and content_type.startswith('image/'):
+                self.cache.put(key, response.content)
+            return response.status_code, content_type, response.content
+        except (requests.RequestException, OSError) as e:
+            return 502, 'text/plain', str(e).encode('utf-8')
+
+def _make_handler(proxy):
+    class TileHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            if parsed.path != '/wms':
+                self._respond(404, 'text/plain', b'Not found')
+                return
+            self._respond(*proxy.fetch(parsed.query))
+
+        def _respond(self, status, content_type, body):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Access-Control-Allow-Origin', '*')
+            # Only real tiles may be reused; an error tile must not stick in the browser cache
+            if status == 200 and content_type.startswith('image/'):
+                self.send_header('Cache-Control', 'public, max-age=3600')
+            else:
+                self.send_header('Cache-Control', 'no-store')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return TileHandler
+
+def serve(proxy=None, host=TILE_PROXY_HOST, port=TILE_PROXY_PORT):
+    """Create (but don't start) an HTTP server exposing the proxy at /wms"""
+    server = ThreadingHTTPServer((host, port), _make_handler(proxy or TileProxy()))
+    server.daemon_threads = True
+    return server
+
+_server = None
+_server_lock = threading.Lock()
+
+def start_proxy():
+    """Start the process-wide tile proxy in a background thread, once"""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = serve()
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+        return _server
+
+# Parameters that describe what to draw; the tile source supplies bbox, size and CRS itself
+LAYER_PARAMS = ('layers', 'styles', 'cql_filter', 'format', 'transparent')
+
+def proxy_url(wms_url):
+    """Point a WMS URL at the local proxy, keeping only the parameters that select what is drawn"""
+    params = parse_qs(urlparse(wms_url).query, keep_blank_values=True)
+    kept = {key: values[-1] for key, values in params.items() if key.lower() in LAYER_PARAMS}
+    return f"{TILE_PROXY_PUBLIC_URL}?{urlencode(kept, quote_via=quote)}"
+
+if __name__ == "__main__":
+    print(f"Tile proxy on http://{TILE_PROXY_HOST}:{TILE_PROXY_PORT}/wms -> {WMS_UPSTREAM_URL}")
+    serve().serve_forever()
@@ -0,0 +1,180 @@
+import os
+import sys
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode, quote
+from dotenv import load_dotenv
+import cql
+from schema import get_registry
+
+load_dotenv()
+
+# Decimal places kept in bbox coordinates, in the bbox parameter and in CQL BBOX() (6 is about 0.1 m)
+BBOX_PRECISION = int(os.getenv("GEOINT_BBOX_PRECISION", "6"))
+
+# OGC request names, matched case-insensitively and written in their usual spelling
+REQUESTS = {name.lower(): name for name in (
+    'GetFeature', 'GetMap', 'GetCapabilities', 'DescribeFeatureType', 'GetFeatureInfo', 'GetLegendGraphic',
+)}
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+class InvalidURL(ValueError):
+    """Raised for a WFS/WMS URL that would only fail at GeoServer: a bad bbox, or CQL that doesn't parse or names unknown attributes"""
+
+def format_number(value, precision=None):
+    """Shortest decimal form of a number, rounded to `precision` places when given"""
+    if precision is not None:
+        value = round(float(value), precision)
+        text = f"{value:.{precision}f}".rstrip('0').rstrip('.')
+        return '0' if text == '-0' else text
+    return repr(value) if isinstance(value, float) else str(value)
+
+def _literal(value):
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return format_number(value)
+
+def _render(node, precision):
+    """CQL text of a parsed node, in the spelling wfs.build_wfs_url uses"""
+    kind = node[0]
+    if kind in ('and', 'or'):
+        # Flatten chains like a AND b AND c; only an OR inside an AND needs parentheses
+        parts = []
+        for child in node[1:]:
+            text = _render(child, precision)
+            if child[0] == kind:
+                parts.append(text)
+            elif child[0] in ('and', 'or'):
+                parts.append(f"({text})")
+            else:
+                parts.append(text)
+        return f" {kind.upper()} ".join(parts)
+    if kind == 'not':
+        child = node[1]
+        if child[0] == 'between':
+            return f"{child[1]} NOT BETWEEN {_literal(child[2])} AND {_literal(child[3])}"
+        if child[0] == 'in':
+            return f"{child[1]} NOT IN ({','.join(_literal(value) for value in child[2])})"
+        if child[0] == 'null':
+            return f"{child[1]} IS NOT NULL"
+        text = _render(child, precision)
+        return f"NOT ({text})" if child[0] in ('and', 'or') else f"NOT {text}"
+    if kind == 'cmp':
+        _, op, attribute, literal = node
+        return f"{attribute}{op}{_literal(literal)}"
+    if kind == 'between':
+        return f"{node[1]} BETWEEN {_literal(node[2])} AND {_literal(node[3])}"
+    if kind == 'in':
+        return f"{node[1]} IN ({','.join(_literal(value) for value in node[2])})"
+    if kind == 'null':
+        return f"{node[1]} IS NULL"
+    if kind == 'bbox':
+        return f"BBOX({node[1]},{','.join(format_number(value, precision) for value in node[2:])})"
+    raise InvalidURL(f"Unsupported CQL node {kind!r}")
+
+def _repair_attributes(node, attributes, geometry):
+    """
+    Check every attribute a parsed filter names against the layer's, fixing letter case
+    where that identifies one unambiguously
+    """
+    kind = node[0]
+    if kind in ('and', 'or'):
+        return (kind, *(_repair_attributes(child, attributes, geometry) for child in node[1:]))
+    if kind == 'not':
+        return ('not', _repair_attributes(node[1], attributes, geometry))
+    names = geometry if kind == 'bbox' else attributes
+    attribute = node[1] if kind != 'cmp' else node[2]
+    if attribute not in names:
+        matches = [name for name in names if name.lower() == attribute.lower()]
+        if len(matches) != 1:
+            raise InvalidURL(f"Unknown attribute {attribute!r}")
+        attribute = matches[0]
+    if kind == 'cmp':
+        return (kind, node[1], attribute, node[3])
+    return (kind, attribute, *node[2:])
+
+def canonical_cql(cql_filter, type_name=None, precision=BBOX_PRECISION):
+    """
+    Canonical text of a CQL_FILTER: one spelling of keywords, operators, spacing and
+    parentheses, BBOX coordinates rounded to `precision` places and, for a layer the
+    registry knows, attribute names checked against its schema
+    Raises:
+        InvalidURL: the filter doesn't parse or names an attribute the layer doesn't have
+    """
+    try:
+        node = cql.parse(cql_filter)
+    except cql.UnsupportedFilter as e:
+        raise InvalidURL(f"Invalid CQL_FILTER: {e}")
+    registry = get_registry()
+    dataset = registry.dataset_for(type_name) if type_name else None
+    if dataset is not None:
+        node = _repair_attributes(node, *registry.attributes(dataset))
+    return _render(node, precision)
+
+def canonical_bbox(bbox, precision=BBOX_PRECISION):
+    """A bbox parameter with its coordinates rounded and swapped corners put in order"""
+    parts = [part.strip() for part in bbox.split(',')]
+    if len(parts) not in (4, 5):
+        raise InvalidURL(f"bbox needs four coordinates, got {bbox!r}")
+    try:
+        min_x, min_y, max_x, max_y = (float(part) for part in parts[:4])
+    except ValueError:
+        raise InvalidURL(f"Invalid bbox {bbox!r}")
+    min_x, max_x = sorted((min_x, max_x))
+    min_y, max_y = sorted((min_y, max_y))
+    if min_x == max_x or min_y == max_y:
+        raise InvalidURL(f"Empty bbox {bbox!r}")
+    return ",".join([format_number(value, precision) for value in (min_x, min_y, max_x, max_y)] + parts[4:])
+
+def canonical_params(params, precision=BBOX_PRECISION):
+    """
+    Canonical form of WFS/WMS query parameters: lower-case names (the last value wins, as
+    GeoServer reads them), sorted, with bbox and CQL_FILTER normalized
+    Args:
+        params: Iterable of (name, value) pairs, already percent-decoded
+    Returns:
+        List of (name, value) pairs
+    """
+    lowered = {}
+    for name, value in params:
+        lowered[name.strip().lower()] = value.strip()
+    if 'service' in lowered:
+        lowered['service'] = lowered['service'].upper()
+    if 'request' in lowered:
+        lowered['request'] = REQUESTS.get(lowered['request'].lower(), lowered['request'])
+    if lowered.get('bbox'):
+        lowered['bbox'] = canonical_bbox(lowered['bbox'], precision)
+    if lowered.get('cql_filter'):
+        type_name = lowered.get('typenames') or lowered.get('typename') or lowered.get('layers')
+        # One layer per request is all the app builds; filters on several are only parsed
+        if type_name and ',' in type_name:
+            type_name = None
+        lowered['cql_filter'] = canonical_cql(lowered['cql_filter'], type_name, precision)
+    return sorted(lowered.items())
+
+def canonicalize(url, precision=BBOX_PRECISION):
+    """
+    Canonical form of a WFS/WMS URL, so semantically identical requests share one cache
+    entry and filters that GeoServer would reject fail here instead
+    Raises:
+        InvalidURL: the bbox or CQL_FILTER can't be sent as it is
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    params = canonical_params(parse_qsl(parts.query, keep_blank_values=True), precision)
+    return urlunsplit((scheme, host, parts.path, urlencode(params, quote_via=quote), ''))
+
+if __name__ == "__main__":
+    # Print the canonical form of each URL given, or why it was rejected
+    failed = False
+    for url in sys.argv[1:]:
+        try:
+            print(canonicalize(url))
+        except InvalidURL as e:
+            print(f"invalid: {e}", file=sys.stderr)
+            failed = True
+    sys.exit(1 if failed else 0)
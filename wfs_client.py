@@ -0,0 +1,221 @@
+import json
+import os
+import re
+from urllib.parse import urlparse, parse_qs, urlencode, quote
+import numpy as np
+import requests
+from dotenv import load_dotenv
+import cql
+from feature_store import get_store, take_geometries
+
+load_dotenv()
+
+# Above this many features the map gets clustered points instead of full geometry
+WFS_MAX_FEATURES = int(os.getenv("GEOINT_WFS_MAX_FEATURES", "5000"))
+# Above this many features even clustering is skipped and only the WMS layer is shown
+WFS_MAX_CLUSTER_FEATURES = int(os.getenv("GEOINT_WFS_MAX_CLUSTER_FEATURES", "200000"))
+WFS_PAGE_SIZE = int(os.getenv("GEOINT_WFS_PAGE_SIZE", "5000"))
+WFS_CHUNK_BYTES = 64 * 1024
+
+# Grid size, in degrees, used to cluster feature centroids
+CLUSTER_CELL_DEGREES = float(os.getenv("GEOINT_CLUSTER_CELL_DEGREES", "0.005"))
+
+NUMBER_MATCHED = re.compile(r'(?:numberMatched|numberOfFeatures)="(\d+)"')
+FEATURES_ARRAY = re.compile(r'"features"\s*:\s*\[')
+SEPARATORS = ' \t\r\n,'
+
+_session = requests.Session()
+
+def _split_url(url):
+    """Return the base URL and its query parameters with lower-cased names"""
+    params = parse_qs(urlparse(url).query, keep_blank_values=True)
+    return url.split('?', 1)[0], {key.lower(): values[-1] for key, values in params.items()}
+
+def _wfs2_url(url, **overrides):
+    """Rewrite a WFS GetFeature URL as WFS 2.0.0 (which supports paging) with extra parameters"""
+    base, params = _split_url(url)
+    params['version'] = '2.0.0'
+    if 'typename' in params:
+        params['typenames'] = params.pop('typename')
+    params.pop('maxfeatures', None)
+    params.update({key.lower(): value for key, value in overrides.items()})
+    return f"{base}?{urlencode(params, quote_via=quote)}"
+
+def count_features(url, session=None):
+    """Ask GeoServer how many features a WFS URL selects, without downloading them"""
+    response = (session or _session).get(_wfs2_url(url, resultType='hits'), timeout=60)
+    response.raise_for_status()
+    match = NUMBER_MATCHED.search(response.text)
+    if not match:
+        raise ValueError("GeoServer hits response did not include a feature count")
+    return int(match.group(1))
+
+def iter_json_features(chunks):
+    """
+    Incrementally yield the objects of the top-level "features" array of a GeoJSON
+    document from an iterable of text chunks, holding at most one feature plus one chunk
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buffer = ''
+
+    def read():
+        """Append the next chunk to the buffer; False once the input is exhausted"""
+        nonlocal buffer
+        chunk = next(chunks, None)
+        if chunk is None:
+            return False
+        buffer += chunk
+        return True
+
+    match = FEATURES_ARRAY.search(buffer)
+    while not match:
+        if not read():
+            return
+        match = FEATURES_ARRAY.search(buffer)
+    buffer = buffer[match.end():]
+
+    while True:
+        buffer = buffer.lstrip(SEPARATORS)
+        if not buffer:
+            if not read():
+                return
+            continue
+        if buffer[0] == ']':
+            return
+        try:
+            feature, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            # Most likely the feature continues in the next chunk
+            if not read():
+                raise
+            continue
+        yield feature
+        buffer = buffer[end:]
+
+def iter_features(url, page_size=WFS_PAGE_SIZE, session=None):
+    """Stream every feature a WFS URL selects, paging with startIndex/count"""
+    session = session or _session
+    start_index = 0
+    while True:
+        page_url = _wfs2_url(url, count=page_size, startIndex=start_index)
+        with session.get(page_url, stream=True, timeout=120) as response:
+            response.raise_for_status()
+            response.encoding = response.encoding or 'utf-8'
+            received = 0
+            for feature in iter_json_features(response.iter_content(WFS_CHUNK_BYTES, decode_unicode=True)):
+                received += 1
+                yield feature
+        if received < page_size:
+            return
+        start_index += page_size
+
+def _flatten(coordinates):
+    """Flatten nested GeoJSON coordinates into [lon, lat, lon, lat, ...]"""
+    if coordinates and isinstance(coordinates[0], (int, float)):
+        return list(coordinates[:2])
+    return [value for item in coordinates for value in _flatten(item)]
+
+def _centroid(geometry):
+    """Mean of a GeoJSON geometry's vertices, good enough to place a cluster"""
+    coords = np.asarray(_flatten(geometry['coordinates']), dtype=np.float64).reshape(-1, 2)
+    return coords.mean(axis=0)
+
+def cluster_points(points, cell_size=CLUSTER_CELL_DEGREES):
+    """
+    Aggregate lon/lat points onto a grid
+    Args:
+        points: n x 2 array of feature centroids
+    Returns:
+        GeoJSON FeatureCollection of cluster points with a 'count' property
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if not len(points):
+        return {'type': 'FeatureCollection', 'features': []}
+    cells = np.floor(points / cell_size).astype(np.int64)
+    unique, inverse, counts = np.unique(cells, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    centres = np.zeros((len(unique), 2))
+    np.add.at(centres, inverse, points)
+    centres /= counts[:, None]
+    return {
+        'type': 'FeatureCollection',
+        'features': [
+            {
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [float(lon), float(lat)]},
+                'properties': {'count': int(count)},
+            }
+            for (lon, lat), count in zip(centres, counts)
+        ],
+    }
+
+def _layer_centroids(layer, mask):
+    """Mean vertex of each selected feature in a LayerData snapshot"""
+    geometry = take_geometries(layer.geometry, np.flatnonzero(mask))
+    coord_offsets = geometry['ring_offsets'][geometry['part_offsets'][geometry['geom_offsets']]]
+    counts = np.diff(coord_offsets)
+    present = counts > 0
+    if not present.any():
+        return np.zeros((0, 2))
+    sums = np.add.reduceat(geometry['coords'], coord_offsets[:-1][present], axis=0)
+    return sums / counts[present][:, None]
+
+def _local_layer(url, store):
+    """Return (layer, mask) if the URL can be answered from the feature store, else None"""
+    _, params = _split_url(url)
+    type_name = params.get('typenames') or params.get('typename')
+    layer = store.load(type_name) if type_name else None
+    if layer is None:
+        return None
+    try:
+        return layer, cql.evaluate(layer, params.get('cql_filter'))
+    except cql.UnsupportedFilter:
+        return None
+
+def iter_layer_features(url, store=None, session=None):
+    """Stream the features a WFS URL selects, from the feature store when it can answer the filter"""
+    local = _local_layer(url, store or get_store())
+    if local is not None:
+        layer, mask = local
+        return layer.iter_features(mask)
+    return iter_features(url, session=session)
+
+def size_layer(layer, mask, max_features=WFS_MAX_FEATURES, max_cluster_features=WFS_MAX_CLUSTER_FEATURES):
+    """The features of a LayerData snapshot selected by `mask`, in the same representations as load_layer"""
+    count = int(mask.sum())
+    if count <= max_features:
+        return {'mode': 'wfs', 'count': count, 'data': layer.to_geojson(mask)}
+    if count <= max_cluster_features:
+        return {'mode': 'clustered', 'count': count, 'data': cluster_points(_layer_centroids(layer, mask))}
+    return {'mode': 'wms', 'count': count, 'data': None}
+
+def load_layer(url, max_features=WFS_MAX_FEATURES, max_cluster_features=WFS_MAX_CLUSTER_FEATURES,
+               store=None, session=None):
+    """
+    Load a WFS layer server-side in a representation sized for the browser
+    Args:
+        url: WFS GetFeature URL
+        max_features: Largest result sent to the map as full GeoJSON
+        max_cluster_features: Largest result that is clustered rather than left to WMS
+    Returns:
+        Dict with 'mode' ('wfs', 'clustered' or 'wms'), 'count' and 'data' (a FeatureCollection or None)
+    """
+    local = _local_layer(url, store or get_store())
+    if local is not None:
+        return size_layer(*local, max_features=max_features, max_cluster_features=max_cluster_features)
+    return fetch_layer(url, max_features, max_cluster_features, session)
+
+def fetch_layer(url, max_features=WFS_MAX_FEATURES, max_cluster_features=WFS_MAX_CLUSTER_FEATURES, session=None):
+    """
+    load_layer straight from GeoServer: count the matches with a hits request first and only
+    download features when the count is under the thresholds
+    """
+    count = count_features(url, session=session)
+    if count <= max_features:
+        features = list(iter_features(url, session=session))
+        return {'mode': 'wfs', 'count': count, 'data': {'type': 'FeatureCollection', 'features': features}}
+    if count <= max_cluster_features:
+        centroids = [_centroid(feature['geometry']) for feature in iter_features(url, session=session) if feature.get('geometry')]
+        return {'mode': 'clustered', 'count': count, 'data': cluster_points(centroids)}
+    return {'mode': 'wms', 'count': count, 'data': None}